@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Check how long importing the command line entry point takes.
+
+Runs `import gamegirl.cmd` in a fresh interpreter and fails if it takes
+longer than the budget. With `-X importtime` (Python 3.7+) the slowest
+modules are listed; otherwise only the total wall time is measured.
+tests/test_import_time.py checks which modules get imported.
+
+Usage: import_time.py [options]
+
+Options:
+  --help          Show this screen.
+  --budget MS     Fail if importing takes longer than this. [default: 150]
+  --runs N        Take the best of N runs. [default: 5]
+  --top N         Number of slowest modules to list. [default: 10]
+"""
+import subprocess
+import sys
+import time
+
+from docopt import docopt
+
+
+CHECK = 'import gamegirl.cmd'
+
+
+def measure():
+    """Return (total ms, {module: cumulative ms} or None)."""
+    command = [sys.executable]
+    importtime = sys.version_info >= (3, 7)
+    if importtime:
+        command += ['-X', 'importtime']
+
+    start = time.time()
+    process = subprocess.Popen(command + ['-c', CHECK], stderr=subprocess.PIPE,
+                               universal_newlines=True)
+    output, errors = process.communicate()
+    elapsed = (time.time() - start) * 1000
+    if process.returncode:
+        sys.exit(errors)
+
+    if not importtime:
+        return elapsed, None
+
+    modules = {}
+    for line in errors.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative) / 1000.0
+    return modules['gamegirl.cmd'], modules
+
+
+def main():
+    args = docopt(__doc__)
+    budget = float(args['--budget'])
+
+    runs = [measure() for index in range(int(args['--runs']))]
+    total, modules = min(runs, key=lambda run: run[0])
+
+    if modules:
+        for name in sorted(modules, key=modules.get, reverse=True)[:int(args['--top'])]:
+            print('{0:>8.1f}ms  {1}'.format(modules[name], name))
+    print('Importing gamegirl.cmd: {0:.1f}ms (budget {1:.0f}ms)'.format(total, budget))
+    if total > budget:
+        print('Over budget.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
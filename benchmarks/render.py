@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Compare frames/sec for in-process and pipelined rendering.
+
+The CPU spins on a single JR instruction while the screen shows a
+busy background, window and a full set of sprites, so the numbers
+reflect rendering overhead on top of a minimal instruction stream.
+
+Usage: render.py [options]
+
+Options:
+  --help      Show this screen.
+  --frames N  Number of frames to run per mode. [default: 120]
+"""
+import random
+import time
+
+from docopt import docopt
+
+from gamegirl.cpu import CPU
+from gamegirl.memory import Memory, Ram, Rom
+from gamegirl.pipeline import PipelinedRenderer
+
+
+def make_cpu():
+    bios = bytearray(256)
+    bios[0:2] = bytearray((0x18, 0xfe))  # JR -2
+
+    memory = Memory(rom=Rom(bytes(bytearray(0x8000))), bios=Ram(bytes(bios)))
+    random.seed(0)
+    for address in range(0x2000):
+        memory.lcd_ram.raw_data[address] = random.randrange(256)
+    for index in range(40):
+        memory.oam.raw_data[index * 4:index * 4 + 4] = bytearray((
+            16 + (index * 4) % 144, 8 + (index * 17) % 160, index, (index * 16) & 0xf0
+        ))
+
+    memory.lcdc.value = 0xf3
+    memory.wy.value = 100
+    memory.wx.value = 87
+    memory.bgp.write(0xe4)
+
+    cpu = CPU(memory=memory)
+    cpu.PC = 0
+    return cpu
+
+
+def run(cpu, frames):
+    start = time.time()
+    while cpu.graphics.frame_count < frames:
+        cpu.read_and_execute()
+    return frames / (time.time() - start)
+
+
+def main():
+    args = docopt(__doc__)
+    frames = int(args['--frames'])
+
+    cpu = make_cpu()
+    cpu.graphics.set_render_policy(cpu.graphics.RENDER_NEVER)
+    print('No rendering:  {0:7.2f} fps'.format(run(cpu, frames)))
+
+    cpu = make_cpu()
+    print('In-process:    {0:7.2f} fps'.format(run(cpu, frames)))
+    in_process = cpu.graphics.framebuffer[:]
+
+    cpu = make_cpu()
+    pipeline = PipelinedRenderer()
+    cpu.graphics.set_pipeline(pipeline)
+    fps = run(cpu, frames)
+    cpu.graphics.set_pipeline(None)
+    pipeline.close()
+    print('Pipelined:     {0:7.2f} fps'.format(fps))
+
+    if cpu.graphics.framebuffer != in_process:
+        print('Warning: pipelined frame differs from in-process frame.')
+
+
+if __name__ == '__main__':
+    main()
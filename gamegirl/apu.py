@@ -0,0 +1,527 @@
+"""
+Audio processing unit.
+
+The emulation thread only logs sound register writes along with the
+cycle they happened on. At the end of every frame the log, the wave
+pattern RAM and the frame's cycle span are queued as a chunk for an
+AudioSink, whose writer thread replays the writes through a Synthesizer
+and appends the result to a WAV file.
+
+The synthesizer renders each channel in runs of samples between
+register writes and frame sequencer ticks, during which nothing about
+the channel changes. Runs are generated with NumPy when it's installed.
+"""
+import array
+import sys
+import threading
+import wave
+
+try:
+    from queue import Full, Queue
+except ImportError:
+    from Queue import Full, Queue
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from gamegirl.registers import SoundRegister
+
+
+CLOCK_SPEED = 4194304
+
+# The frame sequencer clocks lengths, sweep and envelopes at 512Hz.
+SEQUENCER_CYCLES = 8192
+
+DUTY_PATTERNS = (
+    (0, 0, 0, 0, 0, 0, 0, 1),
+    (1, 0, 0, 0, 0, 0, 0, 1),
+    (1, 0, 0, 0, 0, 1, 1, 1),
+    (0, 1, 1, 1, 1, 1, 1, 0),
+)
+
+# Wave channel output level shifts, as multipliers.
+WAVE_LEVELS = (0.0, 1.0, 0.5, 0.25)
+
+# Mixed output is at most 4 channels * 15 * 8 (master volume); scale it
+# to fill 16 bits.
+OUTPUT_SCALE = 64
+
+
+def _lfsr_sequence(short):
+    """Output bits of the noise channel's LFSR over one period."""
+    lfsr = 0x7fff
+    bits = bytearray()
+    for index in range(127 if short else 32767):
+        bits.append(~lfsr & 1)
+        feedback = (lfsr ^ (lfsr >> 1)) & 1
+        lfsr = (lfsr >> 1) | (feedback << 14)
+        if short:
+            lfsr = (lfsr & ~0x40) | (feedback << 6)
+    return bits
+
+
+LFSR_LONG = _lfsr_sequence(False)
+LFSR_SHORT = _lfsr_sequence(True)
+
+
+def _lookup(table, phase, step, count, scale, offset):
+    """
+    Sample table at phase, phase + step, ... for count samples, and
+    return the samples scaled and offset.
+    """
+    if numpy is not None:
+        positions = (phase + step * numpy.arange(count)).astype(numpy.int64) % len(table)
+        return numpy.asarray(table, dtype=numpy.float64)[positions] * scale + offset
+
+    period = len(table)
+    return [table[int(phase + step * index) % period] * scale + offset for index in range(count)]
+
+
+class Channel(object):
+    """Length counter and volume envelope shared by all channels."""
+    length_max = 64
+
+    def __init__(self):
+        self.enabled = False
+        self.dac = False
+        self.frequency = 0
+        self.phase = 0.0
+
+        self.length = 0
+        self.length_enabled = False
+
+        self.volume = 0
+        self.initial_volume = 0
+        self.envelope_add = False
+        self.envelope_period = 0
+        self.envelope_timer = 0
+
+    def set_envelope(self, value):
+        self.initial_volume = value >> 4
+        self.envelope_add = bool(value & 0b1000)
+        self.envelope_period = value & 0b111
+        self.dac = bool(value & 0b11111000)
+        if not self.dac:
+            self.enabled = False
+
+    def set_frequency_low(self, value):
+        self.frequency = (self.frequency & 0x700) | value
+
+    def set_control(self, value):
+        self.frequency = (self.frequency & 0xff) | ((value & 0b111) << 8)
+        self.length_enabled = bool(value & 0b01000000)
+        if value & 0b10000000:
+            self.trigger()
+
+    def trigger(self):
+        self.enabled = self.dac
+        if not self.length:
+            self.length = self.length_max
+        self.volume = self.initial_volume
+        self.envelope_timer = self.envelope_period
+
+    def clock_length(self):
+        if self.length_enabled and self.length:
+            self.length -= 1
+            if not self.length:
+                self.enabled = False
+
+    def clock_envelope(self):
+        if not self.envelope_period:
+            return
+
+        self.envelope_timer -= 1
+        if self.envelope_timer <= 0:
+            self.envelope_timer = self.envelope_period
+            if self.envelope_add and self.volume < 15:
+                self.volume += 1
+            elif not self.envelope_add and self.volume > 0:
+                self.volume -= 1
+
+
+class SquareChannel(Channel):
+    """Channels 1 and 2. Only channel 1 has a frequency sweep."""
+    def __init__(self):
+        super(SquareChannel, self).__init__()
+        self.duty = 0
+
+        self.sweep_period = 0
+        self.sweep_negate = False
+        self.sweep_shift = 0
+        self.sweep_timer = 0
+        self.sweep_enabled = False
+        self.shadow_frequency = 0
+
+    def set_duty_length(self, value):
+        self.duty = value >> 6
+        self.length = 64 - (value & 0b111111)
+
+    def set_sweep(self, value):
+        self.sweep_period = (value >> 4) & 0b111
+        self.sweep_negate = bool(value & 0b1000)
+        self.sweep_shift = value & 0b111
+
+    def trigger(self):
+        super(SquareChannel, self).trigger()
+        self.shadow_frequency = self.frequency
+        self.sweep_timer = self.sweep_period or 8
+        self.sweep_enabled = bool(self.sweep_period or self.sweep_shift)
+        if self.sweep_shift:
+            self._sweep_frequency()
+
+    def clock_sweep(self):
+        if not self.sweep_enabled:
+            return
+
+        self.sweep_timer -= 1
+        if self.sweep_timer <= 0:
+            self.sweep_timer = self.sweep_period or 8
+            if self.sweep_period:
+                frequency = self._sweep_frequency()
+                if frequency <= 2047 and self.sweep_shift:
+                    self.frequency = self.shadow_frequency = frequency
+                    self._sweep_frequency()
+
+    def _sweep_frequency(self):
+        delta = self.shadow_frequency >> self.sweep_shift
+        frequency = self.shadow_frequency + (-delta if self.sweep_negate else delta)
+        if frequency > 2047:
+            self.enabled = False
+        return frequency
+
+    def render(self, count, sample_rate):
+        step = 131072.0 / (2048 - self.frequency) * 8 / sample_rate
+        samples = _lookup(DUTY_PATTERNS[self.duty], self.phase, step, count,
+                          self.volume * 2, -self.volume)
+        self.phase = (self.phase + step * count) % 8
+        return samples
+
+
+class WaveChannel(Channel):
+    """Channel 3, playing 32 4-bit samples from wave pattern RAM."""
+    length_max = 256
+
+    def __init__(self):
+        super(WaveChannel, self).__init__()
+        self.level = 0
+        self.table = bytearray(32)
+
+    def set_dac(self, value):
+        self.dac = bool(value & 0b10000000)
+        if not self.dac:
+            self.enabled = False
+
+    def set_length(self, value):
+        self.length = 256 - value
+
+    def set_level(self, value):
+        self.level = (value >> 5) & 0b11
+
+    def set_table(self, wave_ram):
+        table = bytearray()
+        for byte in bytearray(wave_ram):
+            table.append(byte >> 4)
+            table.append(byte & 0x0f)
+        self.table = table
+
+    def trigger(self):
+        super(WaveChannel, self).trigger()
+        self.phase = 0.0
+
+    def render(self, count, sample_rate):
+        step = 65536.0 / (2048 - self.frequency) * 32 / sample_rate
+        level = WAVE_LEVELS[self.level]
+        samples = _lookup(self.table, self.phase, step, count, 2 * level, -15 * level)
+        self.phase = (self.phase + step * count) % 32
+        return samples
+
+
+class NoiseChannel(Channel):
+    """Channel 4, played from precomputed LFSR sequences."""
+    def __init__(self):
+        super(NoiseChannel, self).__init__()
+        self.shift = 0
+        self.short = False
+        self.divisor = 0
+
+    def set_length(self, value):
+        self.length = 64 - (value & 0b111111)
+
+    def set_polynomial(self, value):
+        self.shift = value >> 4
+        self.short = bool(value & 0b1000)
+        self.divisor = value & 0b111
+
+    def trigger(self):
+        super(NoiseChannel, self).trigger()
+        self.phase = 0.0
+
+    def render(self, count, sample_rate):
+        step = 524288.0 / (self.divisor or 0.5) / (2 << self.shift) / sample_rate
+        table = LFSR_SHORT if self.short else LFSR_LONG
+        samples = _lookup(table, self.phase, step, count, self.volume * 2, -self.volume)
+        self.phase = (self.phase + step * count) % len(table)
+        return samples
+
+
+class Synthesizer(object):
+    """Turns logged register writes into 16-bit stereo samples."""
+    def __init__(self, sample_rate=44100):
+        self.sample_rate = sample_rate
+        self.square1 = SquareChannel()
+        self.square2 = SquareChannel()
+        self.wave = WaveChannel()
+        self.noise = NoiseChannel()
+        self.channels = (self.square1, self.square2, self.wave, self.noise)
+
+        self.power = True
+        self.master_volume = 0x77
+        self.panning = 0xf3
+        self.cycle = None
+        self.sequencer_step = 0
+
+        self.handlers = {
+            'nr10': self.square1.set_sweep,
+            'nr11': self.square1.set_duty_length,
+            'nr12': self.square1.set_envelope,
+            'nr13': self.square1.set_frequency_low,
+            'nr14': self.square1.set_control,
+            'nr21': self.square2.set_duty_length,
+            'nr22': self.square2.set_envelope,
+            'nr23': self.square2.set_frequency_low,
+            'nr24': self.square2.set_control,
+            'nr30': self.wave.set_dac,
+            'nr31': self.wave.set_length,
+            'nr32': self.wave.set_level,
+            'nr33': self.wave.set_frequency_low,
+            'nr34': self.wave.set_control,
+            'nr41': self.noise.set_length,
+            'nr42': self.noise.set_envelope,
+            'nr43': self.noise.set_polynomial,
+            'nr44': self.noise.set_control,
+            'nr50': self._set_master_volume,
+            'nr51': self._set_panning,
+            'nr52': self._set_power,
+        }
+
+    def synthesize(self, start, end, writes, wave_ram):
+        """
+        Render the cycles from start to end, applying each (cycle, name,
+        value) register write when it happened. Returns interleaved
+        little-endian 16-bit stereo samples.
+        """
+        if self.cycle is None:
+            self.cycle = start
+        self.wave.set_table(wave_ram)
+
+        runs = []
+        for cycle, name, value in writes:
+            self._render_until(cycle, runs)
+            self.handlers[name](value)
+        self._render_until(end, runs)
+
+        if numpy is not None:
+            if not runs:
+                return b''
+            samples = numpy.concatenate(runs).clip(-32768, 32767).astype('<i2')
+            return samples.tobytes()
+
+        samples = array.array('h', [max(-32768, min(32767, int(sample)))
+                                    for run in runs for sample in run])
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        return samples.tostring() if hasattr(samples, 'tostring') else samples.tobytes()
+
+    def _render_until(self, cycle, runs):
+        while True:
+            tick = (self.cycle // SEQUENCER_CYCLES + 1) * SEQUENCER_CYCLES
+            if tick > cycle:
+                break
+            self._render(tick, runs)
+            self._clock_sequencer()
+        self._render(cycle, runs)
+
+    def _render(self, cycle, runs):
+        rate = self.sample_rate
+        count = cycle * rate // CLOCK_SPEED - self.cycle * rate // CLOCK_SPEED
+        self.cycle = max(self.cycle, cycle)
+        if count <= 0:
+            return
+
+        if numpy is not None:
+            left = numpy.zeros(count)
+            right = numpy.zeros(count)
+        else:
+            left = [0.0] * count
+            right = [0.0] * count
+
+        if self.power:
+            for index, channel in enumerate(self.channels):
+                if not channel.enabled:
+                    continue
+                samples = channel.render(count, rate)
+                if self.panning & (0x10 << index):
+                    left = self._add(left, samples)
+                if self.panning & (0x01 << index):
+                    right = self._add(right, samples)
+
+        left_scale = (((self.master_volume >> 4) & 0b111) + 1) * OUTPUT_SCALE
+        right_scale = ((self.master_volume & 0b111) + 1) * OUTPUT_SCALE
+        if numpy is not None:
+            run = numpy.empty(count * 2)
+            run[0::2] = left * left_scale
+            run[1::2] = right * right_scale
+        else:
+            run = []
+            for left_sample, right_sample in zip(left, right):
+                run.append(left_sample * left_scale)
+                run.append(right_sample * right_scale)
+        runs.append(run)
+
+    def _add(self, mix, samples):
+        if numpy is not None:
+            mix += samples
+            return mix
+        return [a + b for a, b in zip(mix, samples)]
+
+    def _clock_sequencer(self):
+        step = self.sequencer_step
+        self.sequencer_step = (step + 1) % 8
+        if step % 2 == 0:
+            for channel in self.channels:
+                channel.clock_length()
+        if step in (2, 6):
+            self.square1.clock_sweep()
+        if step == 7:
+            for channel in (self.square1, self.square2, self.noise):
+                channel.clock_envelope()
+
+    def _set_master_volume(self, value):
+        self.master_volume = value
+
+    def _set_panning(self, value):
+        self.panning = value
+
+    def _set_power(self, value):
+        self.power = bool(value & 0b10000000)
+        if not self.power:
+            for channel in self.channels:
+                channel.enabled = False
+
+
+class APU(object):
+    """
+    Logs sound register writes on the emulation thread and hands them to
+    sink.push_chunk once per frame.
+    """
+    def __init__(self, cpu, sink):
+        self.cpu = cpu
+        self.sink = sink
+        self.registers = sorted(
+            (address, register) for address, register in cpu.memory.io_ports.registers.items()
+            if isinstance(register, SoundRegister)
+        )
+
+        # Start the synthesizer from the current register values, minus
+        # trigger bits.
+        self.chunk_start = cpu.cycles
+        self.writes = []
+        for address, register in self.registers:
+            value = register.value
+            if register.name in ('nr14', 'nr24', 'nr34', 'nr44'):
+                value &= 0b01111111
+            self.writes.append((cpu.cycles, register.name, value))
+            register.apu = self
+
+        cpu.graphics.add_frame_callback(self.frame_ended)
+
+    def register_written(self, register, value):
+        self.writes.append((self.cpu.cycles, register.name, value))
+
+    def frame_ended(self, graphics):
+        end = self.cpu.cycles
+        self.sink.push_chunk(self.chunk_start, end, self.writes,
+                             bytes(self.cpu.memory.wave_pattern_ram.raw_data))
+        self.chunk_start = end
+        self.writes = []
+
+    def close(self):
+        """Flush the partial frame, detach from the emulator and close the sink."""
+        self.frame_ended(self.cpu.graphics)
+        self.cpu.graphics.remove_frame_callback(self.frame_ended)
+        for address, register in self.registers:
+            register.apu = None
+        self.sink.close()
+
+
+class AudioSink(object):
+    """
+    Synthesizes queued chunks and writes them to a WAV file on a
+    background thread. Up to `chunks` chunks wait in the queue; past
+    that, push_chunk blocks or drops the chunk depending on `block`.
+    """
+    def __init__(self, path, sample_rate=44100, chunks=60, block=True):
+        self.block = block
+        self.synthesizer = Synthesizer(sample_rate)
+
+        self.output = wave.open(path, 'wb')
+        self.output.setnchannels(2)
+        self.output.setsampwidth(2)
+        self.output.setframerate(sample_rate)
+
+        self.chunks_queued = 0
+        self.chunks_dropped = 0
+        self.samples_written = 0
+        self.error = None
+
+        self.pending = Queue(maxsize=chunks)
+        self.thread = threading.Thread(target=self._write_chunks, name='gamegirl-audio-sink')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def push_chunk(self, start, end, writes, wave_ram):
+        try:
+            self.pending.put((start, end, writes, wave_ram), block=self.block)
+        except Full:
+            self.chunks_dropped += 1
+            return
+        self.chunks_queued += 1
+
+    def close(self):
+        """
+        Wait for queued chunks to be written and finish the WAV file,
+        then raise the error that stopped the writer thread, if any.
+        """
+        self.pending.put(None)
+        self.thread.join()
+        try:
+            self.output.close()
+        finally:
+            if self.error is not None:
+                raise self.error
+
+    @property
+    def stats(self):
+        return {
+            'queued': self.chunks_queued,
+            'dropped': self.chunks_dropped,
+            'samples': self.samples_written,
+            'seconds': float(self.samples_written) / self.synthesizer.sample_rate,
+        }
+
+    def _write_chunks(self):
+        while True:
+            chunk = self.pending.get()
+            if chunk is None:
+                break
+
+            if self.error is None:
+                try:
+                    data = self.synthesizer.synthesize(*chunk)
+                    self.output.writeframes(data)
+                    self.samples_written += len(data) // 4
+                except Exception as error:
+                    # Keep draining so the emulator never blocks forever.
+                    self.error = error
@@ -5,20 +5,98 @@ Execute a GameBoy ROM.
 Usage: gamegirl FILENAME [options]
 
 Options:
-  --help           Show this screen.
-  --version        Show version.
-  --bios FILENAME  Path to Gameboy BIOS ROM. [default: bios.gb]
-  --debug          Output logging for debugging.
+  --help              Show this screen.
+  --version           Show version.
+  --bios FILENAME     Path to Gameboy BIOS ROM. [default: bios.gb]
+  --debug             Output logging for debugging.
+  --render POLICY     Frame rendering policy: always, every_n, on_request or
+                      never. [default: always]
+  --render-every N    Render one frame in N with the every_n policy.
+                      [default: 1]
+  --frames N          Stop after N frames and print frame statistics.
+  --speed X           Run at X times real time (59.73 fps). Defaults to 1,
+                      except with --frames, --serial-stop or --gdb.
+  --turbo             Run as fast as possible, only measuring frame times.
+                      The default with --frames, --serial-stop or --gdb.
+  --record PATH       Record rendered frames to PATH ('-' for stdout). For
+                      PNG recordings PATH is a directory.
+  --record-format FMT Recording format: raw, y4m, png or ggr (deduplicated
+                      delta recording). [default: y4m]
+  --pipeline          Render frames in a separate process, overlapping
+                      rendering with emulation (Python 3.8+).
+  --audio-out PATH    Write sound output to a WAV file.
+  --rewind MEGABYTES  Keep a rewind history of up to this many megabytes
+                      ((R)ewind in the debugger).
+  --record-movie PATH Record input and checkpoints to a movie file.
+  --play-movie PATH   Play back a movie file recorded with --record-movie.
+  --seek FRAME        Start movie playback at FRAME.
+  --serial-out PATH   Write bytes sent over the serial port to PATH ('-' for
+                      stdout).
+  --serial-stop TEXT  Stop once the serial output ends with TEXT; separate
+                      several patterns with commas.
+  --gdb ADDRESS       Wait for a GDB remote protocol client on ADDRESS
+                      (host:port, or a path for a Unix socket).
+  --trace PATH        Record a binary trace of every instruction to PATH
+                      (decode it with gamegirl-trace).
+  --input PATH        Joypad input script ('-' for stdin), with lines like
+                      "120 a+right" holding buttons from a frame on.
+  --profile-startup   Report the time from process start to the first
+                      instruction.
+
+Modules for optional features, the debugger's urwid in particular, are
+only imported when the option that needs them is given, which keeps
+startup short for scripts that run many short emulator processes.
 """
+from gamegirl.pacing import clock
+
+# Taken before the rest of the imports, for --profile-startup.
+IMPORT_START = clock()
+
+import os
+import sys
+import traceback
+from functools import partial
+
 from docopt import docopt
 
 import gamegirl
 from gamegirl.cpu import CPU
-from gamegirl.debugger import DebuggerInterface
 from gamegirl.memory import Memory, Ram, Rom
+from gamegirl.pacing import Pacer
+
+
+def process_age():
+    """
+    Seconds since the process started, to the nearest clock tick, or
+    None if the platform doesn't say.
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # The command name can contain spaces; fields resume after ')'.
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - float(start_ticks) / os.sysconf('SC_CLK_TCK')
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def report_startup(times):
+    """Print where startup time went, given clock() readings."""
+    now = clock()
+    age = process_age()
+    parts = ['imports {0:.1f}ms'.format((times['main'] - IMPORT_START) * 1000),
+             'setup {0:.1f}ms'.format((now - times['main']) * 1000)]
+    if age is not None:
+        parts.insert(0, 'interpreter {0:.0f}ms'.format((age - (now - IMPORT_START)) * 1000))
+        total = '{0:.0f}ms'.format(age * 1000)
+    else:
+        total = '{0:.1f}ms since gamegirl.cmd was imported'.format((now - IMPORT_START) * 1000)
+    sys.stderr.write('Startup: {0} to first instruction ({1})\n'.format(total, ', '.join(parts)))
 
 
 def main():
+    times = {'main': clock()}
     args = docopt(__doc__, version=gamegirl.__version__)
     with open(args['FILENAME'], 'rb') as f:
         rom = Rom(f.read())
@@ -30,13 +108,169 @@ def main():
     memory = Memory(rom=rom, bios=bios)
     cpu = CPU(memory=memory, debug=debug)
     cpu.PC = 0
+    cpu.graphics.set_render_policy(args['--render'], int(args['--render-every']))
+
+    sink = None
+    if args['--record']:
+        from gamegirl.sinks import FrameSink, open_writer
+        sink = FrameSink(open_writer(args['--record'], args['--record-format']))
+        cpu.graphics.add_sink(sink)
+
+    pipeline = None
+    if args['--pipeline']:
+        from gamegirl.pipeline import PipelinedRenderer
+        pipeline = PipelinedRenderer()
+        cpu.graphics.set_pipeline(pipeline)
+
+    apu = None
+    if args['--audio-out']:
+        from gamegirl.apu import APU, AudioSink
+        apu = APU(cpu, AudioSink(args['--audio-out']))
+
+    rewinder = None
+    if args['--rewind']:
+        from gamegirl.rewind import Rewinder
+        rewinder = Rewinder(cpu, max_bytes=int(float(args['--rewind']) * 1024 * 1024))
+
+    player = None
+    if args['--play-movie']:
+        from gamegirl.movie import MoviePlayer
+        player = MoviePlayer(cpu, open(args['--play-movie'], 'rb'))
+        player.play()
+        if args['--seek']:
+            player.seek(int(args['--seek']))
+
+    serial_out = None
+    if args['--serial-out']:
+        if args['--serial-out'] == '-':
+            cpu.serial.stream = getattr(sys.stdout, 'buffer', sys.stdout)
+        else:
+            serial_out = cpu.serial.stream = open(args['--serial-out'], 'wb')
+    if args['--serial-stop']:
+        cpu.serial.capture = True
+        cpu.serial.stop_patterns = [pattern.encode('utf8')
+                                    for pattern in args['--serial-stop'].split(',')]
+
+    joypad = None
+    if args['--input']:
+        from gamegirl.joypad import Joypad, ScriptSource
+        stream = sys.stdin if args['--input'] == '-' else open(args['--input'])
+        joypad = Joypad(cpu, ScriptSource(stream))
+
+    movie = None
+    if args['--record-movie']:
+        from gamegirl.movie import MovieRecorder
+        movie = MovieRecorder(cpu, open(args['--record-movie'], 'wb'), close_stream=True)
+
+    tracer = None
+    if args['--trace']:
+        from gamegirl.trace import Tracer
+        tracer = Tracer(cpu, open(args['--trace'], 'wb'), close_stream=True)
 
-    if debug:
-        interface = DebuggerInterface(cpu)
+    pacer = None
+    if not debug:
+        # Batch jobs and test ROMs shouldn't wait on the clock unless
+        # asked to with --speed.
+        bounded = args['--frames'] or args['--serial-stop'] or args['--gdb']
+        turbo = args['--turbo'] or bool(bounded and not args['--speed'])
+        pacer = Pacer(cpu, speed=float(args['--speed'] or 1), turbo=turbo)
+
+    if args['--profile-startup']:
+        report_startup(times)
+
+    try:
+        run(cpu, args, rewinder)
+    finally:
+        # Everything gets closed even if an earlier close fails, so one
+        # broken output can't truncate the others.
+        closers = []
+        if pacer:
+            closers.append(partial(close_pacer, pacer))
+        if pipeline:
+            # Deliver the frames still in flight before the sinks close.
+            closers += [partial(cpu.graphics.set_pipeline, None), pipeline.close]
+        if tracer:
+            closers.append(partial(close_tracer, tracer))
+        if serial_out:
+            closers.append(serial_out.close)
+        if joypad:
+            closers.append(joypad.close)
+        if movie:
+            closers.append(movie.close)
+        if player:
+            closers += [player.stop, player.stream.close]
+        if apu:
+            closers.append(partial(close_apu, apu))
+        if sink:
+            closers.append(partial(close_sink, sink))
+        close_all(closers)
+
+
+def close_all(closers):
+    """
+    Call every closer, even if some raise. The first error is raised
+    once they've all run; any others are printed.
+    """
+    error = None
+    for close in closers:
+        try:
+            close()
+        except Exception as close_error:
+            if error is None:
+                error = close_error
+            else:
+                traceback.print_exc()
+    if error is not None:
+        raise error
+
+
+def close_pacer(pacer):
+    pacer.close()
+    sys.stderr.write(
+        'Pacing: {fps:.2f}/{target_fps:.2f} fps, {late} late, headroom {headroom:.2f}x, '
+        'jitter p50/p90/p99/max {jitter_p50:.2f}/{jitter_p90:.2f}/{jitter_p99:.2f}/'
+        '{jitter_max:.2f}ms\n'.format(**pacer.stats)
+    )
+
+
+def close_tracer(tracer):
+    tracer.close()
+    sys.stderr.write('Traced {0} instructions\n'.format(tracer.count))
+
+
+def close_apu(apu):
+    apu.close()
+    sys.stderr.write('Wrote {seconds:.2f}s of audio, dropped {dropped} chunks\n'
+                     .format(**apu.sink.stats))
+
+
+def close_sink(sink):
+    sink.close()
+    sys.stderr.write('Recorded {written} frames, dropped {dropped}\n'.format(**sink.stats))
+
+
+def run(cpu, args, rewinder=None):
+    if args['--debug']:
+        from gamegirl.debugger import DebuggerInterface
+        interface = DebuggerInterface(cpu, rewinder=rewinder)
         interface.start()
+    elif args['--gdb']:
+        from gamegirl.gdbstub import GDBServer
+        GDBServer(cpu, args['--gdb']).serve()
+    elif args['--frames']:
+        frames = int(args['--frames'])
+        while cpu.graphics.frame_count < frames and not cpu.serial.matched:
+            cpu.read_and_execute()
+
+        stats = cpu.graphics.stats
+        sys.stderr.write('Frames: {frames}, rendered: {frames_rendered}, '
+                         'skipped: {frames_skipped}\n'.format(**stats))
     else:
-        while True:
+        while not cpu.serial.matched:
             cpu.read_and_execute()
 
+    if cpu.serial.matched:
+        sys.stderr.write('Serial output matched "{0}"\n'.format(cpu.serial.matched.decode('utf8')))
+
 if __name__ == 'main':
     main()
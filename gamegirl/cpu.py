@@ -1,5 +1,9 @@
+from gamegirl import savestate
 from gamegirl.graphics import Graphics
+from gamegirl.interrupts import Interrupts
 from gamegirl.opcodes import OPCODES
+from gamegirl.scheduler import Scheduler
+from gamegirl.serial import Serial
 
 
 def register_pair(hi, lo):
@@ -59,6 +63,7 @@ class CPU(object):
         self.debug_string = ''
         self.debug_kwargs = {}
         self.debug_last_bytes = []
+        self.tracer = None
 
         self.memory = memory
         self.stack = Stack(self)
@@ -76,7 +81,10 @@ class CPU(object):
         self.PC = 0
         self.SP = 0
 
+        self.scheduler = Scheduler()
+        self.interrupts = Interrupts(self)
         self.graphics = Graphics(self)
+        self.serial = Serial(self)
 
     def __setattr__(self, name, value):
         # Keep registers limited to the right size.
@@ -88,19 +96,28 @@ class CPU(object):
         return super(CPU, self).__setattr__(name, value)
 
     def read_and_execute(self):
+        if self.interrupts.pending and not self.interrupts.handle():
+            # Halted; time skipped ahead instead of running an instruction.
+            if self.debug:
+                return 'HALT (sleeping)', {}, []
+            return
+
         opcode = self.read_next_byte()
+        if self.tracer is not None:
+            self.tracer.record(self, opcode)
         return self.execute(opcode)
 
     def read_next_byte(self, signed=False):
         value = self.memory.read_byte(self.PC, signed=signed)
         self.PC += 1
-        self.debug_last_bytes.append(value)
+        if self.debug:
+            self.debug_last_bytes.append(value)
         return value
 
     def read_next_short(self):
-        byte1 = self.memory.read_byte(self.PC)
-        byte2 = self.memory.read_byte(self.PC + 1)
-        self.debug_last_bytes += [byte1, byte2]
+        if self.debug:
+            self.debug_last_bytes += [self.memory.read_byte(self.PC),
+                                      self.memory.read_byte(self.PC + 1)]
 
         value = self.memory.read_short(self.PC)
         self.PC += 2
@@ -115,14 +132,27 @@ class CPU(object):
             self.debug_string = 'UNKNOWN'
             self.debug_kwargs = {}
 
-        instruction(cpu=self)
+        # Count the instruction up front so snapshots taken by scheduled
+        # events during its final cycle() see it as complete.
         self.instruction_count += 1
+        instruction(cpu=self)
 
+        # In debug mode, return the debug string unformatted so callers
+        # that keep a log only pay for formatting the lines they show.
         if self.debug:
             debug_bytes = self.debug_last_bytes
             self.debug_last_bytes = []
-            return self.debug_string.format(**self.debug_kwargs), debug_bytes
+            return self.debug_string, self.debug_kwargs, debug_bytes
+
+    def save_state(self):
+        """Return a compact binary snapshot of the emulator."""
+        return savestate.save_state(self)
+
+    def load_state(self, data):
+        """Restore a snapshot returned by save_state."""
+        savestate.load_state(self, data)
 
     def cycle(self, cycles):
         self.cycles += cycles
-        self.graphics.cycle(cycles)
+        if self.cycles >= self.scheduler.next_cycle:
+            self.scheduler.run(self.cycles)
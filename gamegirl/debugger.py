@@ -1,10 +1,15 @@
 import logging
 import logging.config
+import string
 import traceback
+from bisect import bisect_left
+from collections import deque
 
 import urwid
 
+from gamegirl import disassembler
 from gamegirl.memory import Rom
+from gamegirl.pacing import clock
 
 
 # This code is meant to work, not meant to be pretty.
@@ -35,20 +40,271 @@ def sidebar_value(text):
                          width=('relative', 100), right=2, left=4)
 
 
+def parse_address(text):
+    """Parse a hex address like $c000, 0xc000 or c000."""
+    text = text.strip().lower()
+    if text.startswith('$'):
+        text = text[1:]
+    elif text.startswith('0x'):
+        text = text[2:]
+
+    address = int(text, 16)
+    if not 0 <= address <= 0xffff:
+        raise ValueError('Address out of range: {0}'.format(text))
+    return address
+
+
+def log_row(text, lineno='', bytes=None):
+    gutter_length = max(9, len(lineno))
+    gutter = block_text(lineno, style='gutter', right=1, align='right')
+    columns = [(gutter_length, gutter), urwid.Text(text)]
+
+    if bytes:
+        byte_gutter_length = max(6, len(bytes) * 2) + 3
+        byte_string = '$' + ''.join(['{0:02x}'.format(b) for b in bytes])
+        byte_gutter = block_text(byte_string, style='gutter', left=1, align='left')
+        columns.append((byte_gutter_length, byte_gutter))
+
+    return urwid.Columns(columns, dividechars=1)
+
+
+_template_fields = {}
+
+
+def log_record(pc, template, kwargs, debug_bytes):
+    """
+    Build an instruction log record, keeping only the debug kwargs the
+    template formats. The rest (the CPU, operand accessors) would stay
+    alive for as long as the record does.
+    """
+    fields = _template_fields.get(template)
+    if fields is None:
+        fields = _template_fields[template] = tuple(
+            field for text, field, spec, conversion in string.Formatter().parse(template)
+            if field)
+    return pc, template, dict((field, kwargs[field]) for field in fields), debug_bytes
+
+
+class InstructionLog(urwid.ListWalker):
+    """
+    Fixed-size ring buffer of executed instructions, shown as a list.
+
+    Records are (PC, debug string template, template fields, opcode
+    bytes) tuples built by log_record(); a None PC marks a plain message
+    and a None record a divider. Rows are only formatted into widgets
+    when urwid asks for them, which is just the rows on screen.
+    Positions are absolute record numbers, so they stay valid as old
+    records fall off.
+    """
+    def __init__(self, size=10000):
+        self.size = size
+        self.records = [None] * size
+        self.start = 0
+        self.end = 0
+        self.focus = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def append(self, record):
+        """Add a record. Call refresh() to update the display."""
+        self.records[self.end % self.size] = record
+        self.end += 1
+        if self.end - self.start > self.size:
+            self.start += 1
+
+    def refresh(self):
+        self._modified()
+
+    def focus_bottom(self):
+        self.set_focus(self.end - 1)
+
+    def get_focus(self):
+        self.focus = max(self.focus, self.start)
+        return self._row(self.focus)
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def get_next(self, position):
+        return self._row(position + 1)
+
+    def get_prev(self, position):
+        return self._row(position - 1)
+
+    def _row(self, position):
+        if not self.start <= position < self.end:
+            return None, None
+
+        record = self.records[position % self.size]
+        if record is None:
+            return urwid.Divider(div_char='-'), position
+
+        pc, template, kwargs, debug_bytes = record
+        if pc is None:
+            return log_row(template), position
+        return log_row(template.format(**kwargs), lineno='${0:04x}'.format(pc),
+                       bytes=debug_bytes), position
+
+
+class MemoryView(urwid.ListWalker):
+    """
+    The whole address space as 4096 rows of 16 bytes, one position per
+    row. Rows are read and rendered when first shown and cached until
+    refresh() finds their page was written. I/O registers change without
+    being written to, so their page is always re-read.
+    """
+    ROWS = 0x1000
+    VOLATILE_PAGES = (0xff,)
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.rows = {}
+        self.focus = 0
+        self.bios_enabled = memory.bios_enabled
+        memory.track_writes()
+
+    def refresh(self):
+        """Drop rows on pages written since the last refresh."""
+        pages = self.memory.dirty_pages
+        pages.update(self.VOLATILE_PAGES)
+        if self.memory.bios_enabled != self.bios_enabled:
+            self.bios_enabled = self.memory.bios_enabled
+            pages.add(0)
+
+        for position in [position for position in self.rows if position >> 4 in pages]:
+            del self.rows[position]
+        pages.clear()
+        self._modified()
+
+    def invalidate(self):
+        """Drop every row, for when memory was replaced wholesale."""
+        self.rows.clear()
+        self.memory.dirty_pages.clear()
+        self._modified()
+
+    def get_focus(self):
+        return self._row(self.focus)
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def get_next(self, position):
+        return self._row(position + 1)
+
+    def get_prev(self, position):
+        return self._row(position - 1)
+
+    def _row(self, position):
+        if not 0 <= position < self.ROWS:
+            return None, None
+
+        widget = self.rows.get(position)
+        if widget is None:
+            address = position << 4
+            text = ' '.join(['--' if value is None else '{0:02x}'.format(value)
+                             for value in self._read(address)])
+            widget = self.rows[position] = log_row(text, lineno='${0:04x}'.format(address))
+        return widget, position
+
+    def _read(self, address):
+        try:
+            return self.memory.read_bytes(address, address + 16)
+        except ValueError:
+            # The row spans regions or has unmapped bytes in it.
+            values = []
+            for offset in range(16):
+                try:
+                    values.append(self.memory.read_byte(address + offset))
+                except ValueError:
+                    values.append(None)
+            return values
+
+
 class DebuggerLogHandler(logging.Handler):
+    """
+    Buffers log records for the debugger's log view, which drains them
+    in before redrawing. Repeats of the same message are shown once with
+    a count. Records beyond `rate_limit` a second, or that overflow the
+    buffer before a drain, are dropped and counted instead.
+
+    Draining isn't done in flush(), since logging calls that at
+    shutdown, when the view may be gone.
+    """
     def __init__(self, *args, **kwargs):
         self.debugger = kwargs.pop('debugger')
+        self.rate_limit = kwargs.pop('rate_limit', 200)
+        self.max_rows = kwargs.pop('max_rows', 1000)
+        capacity = kwargs.pop('capacity', 1000)
         super(DebuggerLogHandler, self).__init__(*args, **kwargs)
 
+        self.pending = deque(maxlen=capacity)
+        self.dropped = 0
+        self.window_start = clock()
+        self.window_count = 0
+        self.last_key = None
+        self.last_count = 0
+        self.debugger.log_handler = self
+
     def emit(self, record):
-        self.debugger.log(record.getMessage(), lineno=record.levelname,
-                          walker=self.debugger.log_walker)
+        now = clock()
+        if now - self.window_start >= 1:
+            self.window_start = now
+            self.window_count = 0
+        self.window_count += 1
+
+        key = (record.levelname, record.getMessage())
+        if self.pending and self.pending[-1][0] == key:
+            self.pending[-1][1] += 1
+        elif self.window_count > self.rate_limit:
+            self.dropped += 1
+        else:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += self.pending[0][1]
+            self.pending.append([key, 1])
+
+    def drain(self):
+        """Move buffered records into the log view."""
+        walker = self.debugger.log_walker
+        while self.pending:
+            key, count = self.pending.popleft()
+            if key == self.last_key and walker:
+                walker.pop()
+                count += self.last_count
+            self.last_key, self.last_count = key, count
+            walker.append(self._row(key, count))
+
+        if self.dropped:
+            walker.append(log_row('{0} log messages dropped'.format(self.dropped),
+                                  lineno='LOG'))
+            self.last_key = None
+            self.dropped = 0
+
+        if len(walker) > self.max_rows:
+            del walker[:len(walker) - self.max_rows]
+
+    def _row(self, key, count):
+        levelname, message = key
+        if count > 1:
+            message = '{0} (x{1})'.format(message, count)
+        return log_row(message, lineno=levelname)
 
 
 class DebuggerInterface(object):
-    def __init__(self, cpu):
+    # Continue and Watch run instructions in batches of about this many
+    # seconds, handling input and redrawing in between.
+    BATCH_SECONDS = 0.016
+
+    def __init__(self, cpu, rewinder=None):
         self.cpu = cpu
+        self.rewinder = rewinder
         self.mode = None
+        self.log_handler = None
+        self.breakpoints = set()
+        self.watchpoints = set()
+        self.prompt_callback = None
         cpu.debug = True
         rom = cpu.memory.rom
 
@@ -74,16 +330,21 @@ class DebuggerInterface(object):
         self.helpbar = urwid.AttrMap(self.help_text, 'helpbar')
 
         # Instruction log
-        self.instruction_walker = urwid.SimpleFocusListWalker([])
-        self.instruction_list = urwid.ListBox(self.instruction_walker)
+        self.instruction_log = InstructionLog()
+        self.instruction_list = urwid.ListBox(self.instruction_log)
 
         # Debug log
         self.log_walker = urwid.SimpleFocusListWalker([])
         self.log_list = urwid.ListBox(self.log_walker)
 
         # Memory view
-        self.memory_walker = urwid.SimpleFocusListWalker([])
-        self.memory_list = urwid.ListBox(self.memory_walker)
+        self.memory_view = MemoryView(cpu.memory)
+        self.memory_list = urwid.ListBox(self.memory_view)
+
+        # Disassembly, built from the ROM the first time it's shown.
+        self.disassembly = None
+        self.disassembly_walker = urwid.SimpleFocusListWalker([])
+        self.disassembly_list = urwid.ListBox(self.disassembly_walker)
 
         # Sidebar
         register_grid = []
@@ -100,6 +361,9 @@ class DebuggerInterface(object):
             flag_grid.append(block_text(flag, align='center', style='register_name'))
             flag_grid.append(block_text(text_widget, style='register_value'))
 
+        self.breakpoint_text = urwid.Text('')
+        self.watchpoint_text = urwid.Text('')
+
         if rom.gbc_compatible == Rom.GBC_INCOMPATIBLE:
             gbc_status = 'Incompatible'
         elif rom.gbc_compatible == Rom.GBC_COMPATIBLE:
@@ -155,6 +419,15 @@ class DebuggerInterface(object):
             sidebar_title('Checksum'),
             sidebar_value('${0:04x}'.format(rom.checksum)),
             blank_divider,
+
+            urwid.Text('Breakpoints', align='center'),
+            line_divider,
+            sidebar_title('Breakpoints'),
+            self.breakpoint_text,
+            blank_divider,
+            sidebar_title('Watchpoints'),
+            self.watchpoint_text,
+            blank_divider,
         ]))
 
         # Main layout and loop
@@ -185,29 +458,43 @@ class DebuggerInterface(object):
         })
 
     def start(self):
+        self.flush_log()
         self.loop.run()
 
+    def flush_log(self):
+        """
+        Show buffered log records. Call before anything that redraws the
+        screen.
+        """
+        if self.log_handler:
+            self.log_handler.drain()
+
     def enter_instruction_mode(self):
         self.set_main(self.instruction_list)
-        self.set_help(
-            '(N)ext instruction',
-            '(C)ontinue',
-            '(W)atch',
-            '(M)emory mode',
-            '(L)og mode',
-            '(Q)uit'
-        )
+        help_items = ['(N)ext instruction', '(C)ontinue', '(W)atch',
+                      '(B)reakpoint', 'Watch(X)']
+        if self.rewinder:
+            help_items.append('(R)ewind 1s')
+        help_items += ['(A)ssembly mode', '(M)emory mode', '(L)og mode', '(Q)uit']
+        self.set_help(*help_items)
         self.mode = 'instruction'
 
     def enter_memory_mode(self):
-        self.update_memory_view()
+        self.memory_view.refresh()
         self.set_main(self.memory_list)
-        self.set_help('(I)nstruction mode', '(L)og mode', '(Q)uit')
+        self.set_help('(I)nstruction mode', '(A)ssembly mode', '(L)og mode', '(Q)uit')
         self.mode = 'memory'
 
+    def enter_disassembly_mode(self):
+        self.update_disassembly_view()
+        self.set_main(self.disassembly_list)
+        self.set_help('(I)nstruction mode', '(M)emory mode', '(L)og mode', '(Q)uit')
+        self.mode = 'disassembly'
+
     def enter_log_mode(self):
+        self.flush_log()
         self.set_main(self.log_list)
-        self.set_help('(I)nstruction mode', '(M)emory mode', '(Q)uit')
+        self.set_help('(I)nstruction mode', '(A)ssembly mode', '(M)emory mode', '(Q)uit')
         self.log_focus_bottom(walker=self.log_walker)
         self.mode = 'log'
 
@@ -217,6 +504,48 @@ class DebuggerInterface(object):
     def set_help(self, *items):
         self.help_text.set_text('   ' + ', '.join(items))
 
+    def prompt(self, caption, callback, default=''):
+        """
+        Ask for a line of text in the footer. callback is called with it
+        when Enter is hit; Esc cancels.
+        """
+        self.prompt_callback = callback
+        self.top_frame.footer = urwid.AttrMap(urwid.Edit(caption, default), 'helpbar')
+        self.top_frame.focus_position = 'footer'
+
+    def end_prompt(self, submit):
+        text = self.top_frame.footer.original_widget.edit_text
+        callback = self.prompt_callback
+        self.prompt_callback = None
+        self.top_frame.footer = self.helpbar
+        self.top_frame.focus_position = 'body'
+
+        if submit:
+            try:
+                callback(parse_address(text))
+            except ValueError as error:
+                self.log(str(error))
+                self.log_focus_bottom()
+            self.update_sidebar()
+
+    def toggle_breakpoint(self, address):
+        if address in self.breakpoints:
+            self.breakpoints.remove(address)
+            self.log('Removed breakpoint at ${0:04x}'.format(address))
+        else:
+            self.breakpoints.add(address)
+            self.log('Added breakpoint at ${0:04x}'.format(address))
+        self.log_focus_bottom()
+
+    def toggle_watchpoint(self, address):
+        if address in self.watchpoints:
+            self.watchpoints.remove(address)
+            self.log('Removed watchpoint on ${0:04x}'.format(address))
+        else:
+            self.watchpoints.add(address)
+            self.log('Added watchpoint on ${0:04x}'.format(address))
+        self.log_focus_bottom()
+
     def update_sidebar(self):
         for register in ('A', 'B', 'C', 'D', 'E', 'F', 'H', 'L', 'SP', 'PC'):
             if len(register) == 1:
@@ -229,45 +558,152 @@ class DebuggerInterface(object):
 
         for flag in ('Z', 'N', 'H', 'C'):
             widget = getattr(self, 'flag_' + flag)
-            widget.set_text(unicode(getattr(self.cpu, 'flag_' + flag)))
+            widget.set_text(str(getattr(self.cpu, 'flag_' + flag)))
 
-    def log(self, text, lineno='', bytes=None, walker=None, limit=None):
-        gutter_length = max(9, len(lineno))
-        gutter = block_text(lineno, style='gutter', right=1, align='right')
-        columns = [(gutter_length, gutter), urwid.Text(text)]
+        self.breakpoint_text.set_text(self._address_list(self.breakpoints))
+        self.watchpoint_text.set_text(self._address_list(self.watchpoints))
 
-        if bytes:
-            byte_gutter_length = max(6, len(bytes) * 2) + 3
-            byte_string = '$' + ''.join(['{0:02x}'.format(b) for b in bytes])
-            byte_gutter = block_text(byte_string, style='gutter', left=1, align='left')
-            columns.append((byte_gutter_length, byte_gutter))
+    def _address_list(self, addresses):
+        return '    ' + (' '.join(['${0:04x}'.format(address) for address in sorted(addresses)])
+                         or '-')
 
-        walker = walker if walker is not None else self.instruction_walker
-        walker.append(urwid.Columns(columns, dividechars=1))
-        if limit and len(walker) > limit:
-            walker.pop(0)
+    def log(self, text, lineno='', bytes=None, walker=None):
+        if walker is None:
+            self.instruction_log.append((None, text, None, None))
+            self.instruction_log.refresh()
+        else:
+            walker.append(log_row(text, lineno=lineno, bytes=bytes))
 
     def log_divider(self):
-        self.instruction_walker.append(urwid.Divider(div_char='-'))
+        self.instruction_log.append(None)
+        self.instruction_log.refresh()
 
     def log_focus_bottom(self, walker=None):
-        walker = walker if walker is not None else self.instruction_walker
-        walker.set_focus(len(walker) - 1)
+        if walker is None:
+            self.instruction_log.focus_bottom()
+        else:
+            walker.set_focus(len(walker) - 1)
 
     def execute(self):
         if self.stopped:
             self.log('Execution has stopped, cannot continue.')
         else:
             try:
-                lineno = '${0:04x}'.format(self.cpu.PC)
-                result, debug_bytes = self.cpu.read_and_execute()
-                self.log(result, lineno=lineno, bytes=debug_bytes, limit=1000)
+                pc = self.cpu.PC
+                template, kwargs, debug_bytes = self.cpu.read_and_execute()
+                self.instruction_log.append(log_record(pc, template, kwargs, debug_bytes))
                 self.log_focus_bottom()
             except Exception:
                 self.log(traceback.format_exc())
                 self.stopped = True
 
+    def run_batch(self, seconds):
+        """
+        Run instructions for about the given number of seconds, stopping
+        early at a breakpoint, a change to a watched address or an
+        error. Returns a message saying why it stopped early, or None.
+        """
+        cpu = self.cpu
+        instruction_log = self.instruction_log
+        breakpoints = self.breakpoints
+        watched = [(address, self._peek(address)) for address in sorted(self.watchpoints)]
+        deadline = clock() + seconds
+        count = 0
+
+        try:
+            while True:
+                pc = cpu.PC
+                template, kwargs, debug_bytes = cpu.read_and_execute()
+                instruction_log.append(log_record(pc, template, kwargs, debug_bytes))
+
+                if cpu.PC in breakpoints:
+                    return 'Breakpoint at ${0:04x}'.format(cpu.PC)
+                for address, value in watched:
+                    new_value = self._peek(address)
+                    if new_value != value:
+                        return 'Watchpoint on ${0:04x}: {1} -> {2}'.format(
+                            address, self._format_byte(value), self._format_byte(new_value))
+
+                # Checking the clock is slow compared to an instruction.
+                count += 1
+                if not count & 0xff and clock() >= deadline:
+                    return None
+        except Exception:
+            self.stopped = True
+            return traceback.format_exc()
+
+    def _peek(self, address):
+        try:
+            return self.cpu.memory.read_byte(address)
+        except ValueError:
+            return None
+
+    def _format_byte(self, value):
+        return '--' if value is None else '${0:02x}'.format(value)
+
+    def update_disassembly_view(self, before=16, after=48):
+        """
+        Show the code around PC without running it: instructions leading
+        up to PC come from the static disassembly of the ROM, and PC
+        onwards is decoded from memory as it is now.
+        """
+        memory = self.cpu.memory
+        pc = self.cpu.PC
+        rows = []
+
+        in_bios = memory.bios_enabled and pc < 0x100
+        if pc < 0x8000 and not in_bios:
+            if self.disassembly is None:
+                self.disassembly = disassembler.disassemble(memory.rom.raw_data)
+            bank = 0 if pc < disassembler.BANK_SIZE else 1
+            addresses = self.disassembly.addresses(bank)
+            index = bisect_left(addresses, pc)
+            for address in addresses[max(0, index - before):index]:
+                instruction = self.disassembly.instructions[(bank, address)]
+                if address + len(instruction.bytes) <= pc:
+                    rows.append((address, instruction.bytes, instruction.text))
+
+        address = pc
+        for count in range(after):
+            try:
+                data, text, flow, target = disassembler.decode(memory.read_byte, address)
+            except ValueError:
+                break
+            rows.append((address, data, text))
+            address = (address + len(data)) & 0xffff
+
+        del self.disassembly_walker[:]
+        for address, data, text in rows:
+            marker = '> ' if address == pc else '  '
+            self.disassembly_walker.append(log_row(marker + text, lineno='${0:04x}'.format(address),
+                                                   bytes=data))
+            if address == pc:
+                self.disassembly_walker.set_focus(len(self.disassembly_walker) - 1)
+
+    def rewind(self):
+        try:
+            frame = self.rewinder.rewind(60)
+        except ValueError as error:
+            self.log(str(error))
+        else:
+            self.stopped = False
+            self.memory_view.invalidate()
+            self.log_divider()
+            self.log('Rewound to frame {0} (${1:04x})'.format(frame, self.cpu.PC))
+            self.log_focus_bottom()
+        self.update_sidebar()
+
     def unhandled_input(self, key):
+        self.handle_key(key)
+        # The main loop redraws after handling input.
+        self.flush_log()
+
+    def handle_key(self, key):
+        if self.prompt_callback:
+            if key in ('enter', 'esc'):
+                self.end_prompt(submit=key == 'enter')
+            return
+
         if key in ('q', 'Q'):
             raise urwid.ExitMainLoop()
 
@@ -282,13 +718,21 @@ class DebuggerInterface(object):
                 watch = key in ('w', 'W')
 
                 self.set_help('Running instructions, hit S to (S)top')
+                self.flush_log()
                 self.loop.draw_screen()
 
-                self.execute()
+                if self.stopped:
+                    self.log('Execution has stopped, cannot continue.')
                 while not self.stopped and not user_stop:
-                    self.execute()
+                    message = self.run_batch(self.BATCH_SECONDS)
+                    if message:
+                        self.log(message)
+                        break
+
                     if watch:
+                        self.log_focus_bottom()
                         self.update_sidebar()
+                        self.flush_log()
                         self.loop.draw_screen()
 
                     # Since we're not running the main loop during this
@@ -298,9 +742,23 @@ class DebuggerInterface(object):
                         if key in ('s', 'S'):
                             user_stop = True
 
+                self.log_focus_bottom()
                 self.update_sidebar()
                 self.enter_instruction_mode()
 
+            if key in ('r', 'R') and self.rewinder:
+                self.rewind()
+
+            if key in ('b', 'B'):
+                self.prompt('Toggle breakpoint at: $', self.toggle_breakpoint,
+                            '{0:04x}'.format(self.cpu.PC))
+
+            if key in ('x', 'X'):
+                self.prompt('Toggle watchpoint on: $', self.toggle_watchpoint)
+
+        if key in ('a', 'A'):
+            self.enter_disassembly_mode()
+
         if key in ('m', 'M'):
             self.enter_memory_mode()
 
@@ -313,17 +771,3 @@ class DebuggerInterface(object):
         if key in ('d', 'D'):
             import pudb
             pudb.set_trace()
-
-    def update_memory_view(self):
-        del self.memory_walker[:]
-        memory_string = ''
-        for addr in range(0x10000):
-            try:
-                memory_string += '{0:02x} '.format(self.cpu.memory.read_byte(addr))
-            except ValueError:
-                memory_string += '-- '
-
-            if addr % 16 == 15:
-                self.log(memory_string, walker=self.memory_walker,
-                         lineno='${0:04x}'.format(addr - 15))
-                memory_string = ''
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+"""
+Check an alternate CPU engine against the reference interpreter.
+
+Usage:
+  gamegirl-difftest [options]
+  gamegirl-difftest --rom FILENAME [options]
+  gamegirl-difftest --trace TRACE --rom FILENAME [options]
+
+Options:
+  --help              Show this screen.
+  --engine SPEC       Engine to check, as module:callable taking a Memory
+                      and returning a CPU. [default: gamegirl.cpu:CPU]
+  --reference SPEC    Engine to check against. [default: gamegirl.cpu:CPU]
+  --programs N        Number of synthetic programs to run. [default: 100]
+  --length N          Instructions per synthetic program. [default: 1000]
+  --seed N            Seed for the first synthetic program. [default: 0]
+  --exclude OPCODES   Opcodes to leave out of synthetic programs, as
+                      comma-separated hex, with cbXX for CB-prefixed ones.
+                      The default leaves out the opcodes that fault in the
+                      reference: DEC (HL), RL (HL) and SLA (HL).
+                      [default: 35,cb16,cb26]
+  --rom FILENAME      Run this ROM instead of synthetic programs.
+  --bios FILENAME     Path to Gameboy BIOS ROM. [default: bios.gb]
+  --instructions N    Instructions to run the ROM for. [default: 1000000]
+  --trace TRACE       Compare the engine with a trace recorded by
+                      `gamegirl --trace` instead of with another engine.
+  --block N           Compare state every N instructions, narrowing down
+                      to the instruction when they differ. [default: 64]
+  --registers-only    Don't compare memory.
+  --processes N       Worker processes for synthetic programs.
+  --context N         Instructions to show before a difference. [default: 5]
+
+Both engines run in lockstep from the same state. Their registers,
+cycle counts and RAM are compared every `block` instructions; after a
+mismatch both are restored to the last matching point and stepped one
+instruction at a time to find the first one that differs. Synthetic
+programs are straight-line runs of random instructions the reference
+implements, with addresses and the stack pointed at working RAM.
+
+A run that stops early because both engines raised the same error
+hasn't been checked to the end, so it fails too.
+"""
+import importlib
+import multiprocessing
+import random
+import sys
+from collections import deque
+
+from docopt import docopt
+
+from gamegirl import disassembler
+from gamegirl import opcodes
+from gamegirl.memory import Memory, Ram, Rom
+from gamegirl.savestate import RAM_BUFFERS
+from gamegirl.trace import FIELDS, format_record, read_trace
+
+
+REGISTER_FIELDS = ('PC', 'SP', 'A', 'F', 'B', 'C', 'D', 'E', 'H', 'L', 'cycles')
+PROGRAM_START = 0x0150
+
+
+def load_engine(spec):
+    """Return the callable named by a module:callable spec."""
+    module_name, _, name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), name)
+
+
+def trace_record(cpu):
+    """The CPU's current state as a gamegirl.trace record."""
+    try:
+        opcode = cpu.memory.read_byte(cpu.PC)
+    except ValueError:
+        opcode = 0
+    return (cpu.PC, opcode, cpu.A, cpu.F, cpu.B, cpu.C, cpu.D, cpu.E, cpu.H, cpu.L,
+            cpu.SP, cpu.cycles)
+
+
+def differences(reference, candidate, compare_memory=True):
+    """Names of the registers and RAM buffers that differ between two CPUs."""
+    fields = [name for name in REGISTER_FIELDS
+              if getattr(reference, name) != getattr(candidate, name)]
+    if compare_memory:
+        fields += [name for name in RAM_BUFFERS
+                   if getattr(reference.memory, name).raw_data !=
+                   getattr(candidate.memory, name).raw_data]
+    return fields
+
+
+def step(cpu):
+    """Run one instruction, returning the exception it raised, if any."""
+    try:
+        cpu.read_and_execute()
+    except Exception as error:
+        return '{0}: {1}'.format(type(error).__name__, error)
+    return None
+
+
+class Divergence(object):
+    """The first instruction after which two runs disagree."""
+    def __init__(self, index, fields, history, reference, candidate):
+        self.index = index
+        self.fields = fields
+        self.history = history
+        self.reference = reference
+        self.candidate = candidate
+
+    def format(self):
+        lines = ['  ' + format_record(index, record) for index, record in self.history]
+        lines.append('- ' + format_record(self.index, self.reference))
+        lines.append('+ ' + format_record(self.index, self.candidate))
+        lines.append('Differs after instruction {0} in: {1}'.format(
+            self.index - 1, ', '.join(self.fields)))
+        return '\n'.join(lines)
+
+
+def run_lockstep(reference, candidate, instructions, block=64, compare_memory=True, context=5):
+    """
+    Run two CPUs that start in the same state side by side. Returns
+    (instructions run, Divergence or None, error or None). A run ends
+    early, without a divergence, when both engines raise the same
+    error, which is returned.
+    """
+    history = deque(maxlen=context)
+    executed = 0
+
+    while executed < instructions:
+        count = min(block, instructions - executed)
+        checkpoint = None
+        if count > 1:
+            checkpoint = (reference.save_state(), candidate.save_state(),
+                          deque(history, context))
+
+        outcome = _run_block(reference, candidate, count, executed, history, compare_memory)
+        if outcome is None:
+            executed += count
+            continue
+
+        if checkpoint:
+            # Step from the last matching state to find the instruction.
+            reference.load_state(checkpoint[0])
+            candidate.load_state(checkpoint[1])
+            history = checkpoint[2]
+            for index in range(executed, executed + count):
+                narrowed = _run_block(reference, candidate, 1, index, history, compare_memory)
+                if narrowed is not None:
+                    return narrowed
+        return outcome
+
+    return executed, None, None
+
+
+def _run_block(reference, candidate, count, executed, history, compare_memory):
+    """
+    Step both CPUs count times and compare them at the end. Returns None
+    if they match, or the (instructions run, Divergence or None, error
+    or None) result for run_lockstep.
+    """
+    for index in range(executed, executed + count):
+        history.append((index, trace_record(reference)))
+        reference_error = step(reference)
+        candidate_error = step(candidate)
+        if reference_error or candidate_error:
+            if reference_error == candidate_error:
+                return index, None, reference_error
+            fields = ['error: {0} / {1}'.format(reference_error, candidate_error)]
+            return index + 1, Divergence(index + 1, fields, list(history),
+                                         trace_record(reference), trace_record(candidate)), None
+
+    fields = differences(reference, candidate, compare_memory)
+    if fields:
+        index = executed + count
+        return index, Divergence(index, fields, list(history),
+                                 trace_record(reference), trace_record(candidate)), None
+    return None
+
+
+def compare_with_trace(cpu, records, instructions=None, context=5):
+    """
+    Run cpu, checking its state before each instruction against the
+    records of a gamegirl.trace trace. Returns (instructions run,
+    Divergence or None).
+    """
+    history = deque(maxlen=context)
+    executed = 0
+    for index, expected in enumerate(records):
+        if instructions is not None and index >= instructions:
+            break
+
+        actual = trace_record(cpu)
+        if actual != expected:
+            fields = [name for name, value, other in zip(FIELDS, expected, actual)
+                      if value != other]
+            return index, Divergence(index, fields, list(history), expected, actual)
+
+        history.append((index, actual))
+        error = step(cpu)
+        if error:
+            return index + 1, Divergence(index + 1, ['error: ' + error], list(history),
+                                         expected, trace_record(cpu))
+        executed = index + 1
+    return executed, None
+
+
+## Synthetic Programs ##################################################
+
+# Straight-line code only: no jumps, calls, returns or HALT.
+SYNTHETIC_OPCODES = sorted(opcode for opcode in opcodes.OPCODES
+                           if disassembler.OPCODES[opcode][2] == disassembler.FLOW_NEXT and
+                           opcode not in (0x76, 0x10))
+SYNTHETIC_CB_OPCODES = sorted(opcodes.CB_OPCODES)
+
+# Instructions whose immediate short is an address or pointer.
+ADDRESS_OPCODES = (0x01, 0x11, 0x21, 0x31, 0xea, 0xfa, 0x08)
+
+# Loads that point a register pair at working RAM, emitted before
+# instructions that access memory through it so pointers don't drift
+# into ROM or unmapped space. SP is reloaded the same way before PUSH
+# and POP.
+POINTER_LOADS = (('(BC)', 0x01), ('(DE)', 0x11), ('(HL', 0x21), ('PUSH', 0x31), ('POP', 0x31))
+
+# Opcodes that raise errors in the reference interpreter, because the
+# result doesn't fit in a byte written to memory: DEC (HL) when (HL) is
+# 0, and RL (HL) and SLA (HL) when bit 7 of (HL) is set. CB-prefixed
+# opcodes are numbered 0xcbXX.
+REFERENCE_FAULTS = (0x35, 0xcb16, 0xcb26)
+
+
+def synthetic_program(seed, length, exclude=REFERENCE_FAULTS):
+    """
+    Return (ROM image, register values) for a program of `length`
+    random instructions starting at PROGRAM_START, followed by an
+    endless loop. Opcodes in exclude, including CB-prefixed ones as
+    0xcbXX, aren't used.
+    """
+    rng = random.Random(seed)
+    choices = [opcode for opcode in SYNTHETIC_OPCODES if opcode not in exclude]
+    cb_choices = [opcode for opcode in SYNTHETIC_CB_OPCODES if 0xcb00 | opcode not in exclude]
+    if not cb_choices:
+        choices.remove(0xcb)
+    code = bytearray()
+    count = 0
+
+    def address():
+        value = rng.randrange(0xc100, 0xdf00)
+        return bytearray([value & 0xff, value >> 8])
+
+    while count < length:
+        opcode = rng.choice(choices)
+        operands = bytearray()
+        if opcode == 0xcb:
+            operands.append(rng.choice(cb_choices))
+            text = disassembler.CB_OPCODES[operands[0]]
+        else:
+            template, size, flow = disassembler.OPCODES[opcode]
+            text = template
+            if opcode in ADDRESS_OPCODES:
+                operands = address()
+            elif opcode in (0xe0, 0xf0):
+                operands.append(rng.randrange(0x80, 0xfe))
+            else:
+                operands = bytearray(rng.randrange(0x100) for index in range(size - 1))
+
+        if '($ff00+C)' in text:
+            code += bytearray([0x0e, rng.randrange(0x80, 0xfe)])
+            count += 1
+        for pointer, load in POINTER_LOADS:
+            if pointer in text:
+                code += bytearray([load]) + address()
+                count += 1
+        code += bytearray([opcode]) + operands
+        count += 1
+    code += bytearray([0x18, 0xfe])
+
+    rom = bytearray(0x8000)
+    rom[PROGRAM_START:PROGRAM_START + len(code)] = code
+    registers = dict((name, rng.randrange(0x100)) for name in 'AFBCDEHL')
+    registers['SP'] = 0xdff0
+    registers['PC'] = PROGRAM_START
+    return bytes(rom), registers
+
+
+def build_cpu(engine, rom_data, bios_data=None, registers=None):
+    memory = Memory(rom=Rom(rom_data), bios=Ram(bios_data or bytes(bytearray(0x100))))
+    cpu = engine(memory=memory)
+    if registers:
+        memory.bios_enabled = False
+        for name in ('A', 'F', 'B', 'C', 'D', 'E', 'H', 'L', 'BC', 'DE', 'HL', 'SP', 'PC'):
+            if name in registers:
+                setattr(cpu, name, registers[name])
+    return cpu
+
+
+def run_program(args):
+    """Run one synthetic program on both engines; used by pool workers."""
+    reference_spec, candidate_spec, seed, length, exclude, block, compare_memory, context = args
+    rom_data, registers = synthetic_program(seed, length, exclude)
+    reference = build_cpu(load_engine(reference_spec), rom_data, registers=registers)
+    candidate = build_cpu(load_engine(candidate_spec), rom_data, registers=registers)
+    executed, divergence, error = run_lockstep(reference, candidate, length, block,
+                                               compare_memory, context)
+    return seed, executed, divergence and divergence.format(), error
+
+
+def main():
+    args = docopt(__doc__)
+    block = int(args['--block'])
+    context = int(args['--context'])
+    compare_memory = not args['--registers-only']
+
+    if args['--rom']:
+        with open(args['--rom'], 'rb') as f:
+            rom_data = f.read()
+        with open(args['--bios'], 'rb') as f:
+            bios_data = f.read()
+        instructions = int(args['--instructions'])
+        candidate = build_cpu(load_engine(args['--engine']), rom_data, bios_data)
+
+        if args['--trace']:
+            with open(args['--trace'], 'rb') as stream:
+                executed, divergence = compare_with_trace(candidate, read_trace(stream),
+                                                          instructions, context)
+        else:
+            reference = build_cpu(load_engine(args['--reference']), rom_data, bios_data)
+            executed, divergence, error = run_lockstep(reference, candidate, instructions, block,
+                                                       compare_memory, context)
+            if error:
+                print('Both engines stopped after {0} of {1} instructions: {2}'.format(
+                    executed, instructions, error))
+                sys.exit(1)
+
+        if divergence:
+            print(divergence.format())
+            sys.exit(1)
+        print('Matched for {0} instructions.'.format(executed))
+        return
+
+    seed = int(args['--seed'])
+    length = int(args['--length'])
+    exclude = [int(opcode, 16) for opcode in args['--exclude'].split(',')] if args['--exclude'] else []
+    jobs = [(args['--reference'], args['--engine'], seed + index, length, exclude, block,
+             compare_memory, context) for index in range(int(args['--programs']))]
+
+    processes = int(args['--processes']) if args['--processes'] else None
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.imap(run_program, jobs)
+        total = 0
+        stopped = 0
+        for program_seed, executed, divergence, error in results:
+            if divergence:
+                print('Program with seed {0}:'.format(program_seed))
+                print(divergence)
+                sys.exit(1)
+            if executed < length:
+                print('Program with seed {0} stopped after {1} of {2} instructions: {3}'.format(
+                    program_seed, executed, length, error))
+                stopped += 1
+                continue
+            total += executed
+    finally:
+        pool.terminate()
+        pool.join()
+
+    print('{0} programs matched for {1} instructions.'.format(len(jobs) - stopped, total))
+    if stopped:
+        print('{0} programs stopped early.'.format(stopped))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+"""
+Static disassembler.
+
+Walks a ROM by recursive descent from the entry point, the RST vectors
+and the interrupt vectors, following jumps, calls and branches, so only
+bytes reachable as code are disassembled. Locations are (bank, address)
+pairs: bank 0 is fixed at $0000-$3fff and bank n >= 1 is mapped at
+$4000-$7fff. There's no way to know statically which bank is mapped, so
+code in a switchable bank is assumed to stay in it, and targets in
+$4000-$7fff from bank 0 are resolved only for 32KB ROMs (always bank 1)
+or after a `LD A,n` / `LD ($2000-$3fff),A` bank switch on the same
+path. Anything else is recorded as an unresolved reference.
+
+Results are cached on disk, keyed by the SHA-1 of the ROM, as a pickled
+(CACHE_VERSION, Disassembly) tuple.
+"""
+import hashlib
+import os
+from collections import namedtuple
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+CACHE_VERSION = 1
+BANK_SIZE = 0x4000
+
+# Control flow kinds.
+FLOW_NEXT = 'next'  # Falls through to the next instruction.
+FLOW_JUMP = 'jump'  # Unconditional jump.
+FLOW_BRANCH = 'branch'  # Conditional jump; also falls through.
+FLOW_CALL = 'call'  # Calls target, then falls through.
+FLOW_RETURN = 'return'  # Ends the path.
+FLOW_RETURN_CONDITION = 'return_condition'  # Conditional return; falls through.
+FLOW_INDIRECT = 'indirect'  # JP (HL): target unknown, ends the path.
+FLOW_INVALID = 'invalid'  # Not an instruction; ends the path.
+
+ENTRY_POINTS = (0x0100,)
+RST_VECTORS = tuple(range(0x00, 0x40, 0x08))
+INTERRUPT_VECTORS = (0x40, 0x48, 0x50, 0x58, 0x60)
+
+
+# target is the (bank, address) jumped or called to, with a bank of None
+# if it's unknown, or None for other instructions.
+Instruction = namedtuple('Instruction', 'bank address bytes text flow target')
+Block = namedtuple('Block', 'bank start addresses successors')
+
+
+## Opcode Table ########################################################
+
+# Operand placeholders: {n} immediate byte, {nn} immediate short, {e}
+# relative jump target and {s} signed immediate byte.
+REGISTERS = ('B', 'C', 'D', 'E', 'H', 'L', '(HL)', 'A')
+PAIRS = ('BC', 'DE', 'HL', 'SP')
+STACK_PAIRS = ('BC', 'DE', 'HL', 'AF')
+CONDITIONS = ('NZ', 'Z', 'NC', 'C')
+ALU = ('ADD A,', 'ADC A,', 'SUB ', 'SBC A,', 'AND ', 'XOR ', 'OR ', 'CP ')
+CB_OPERATIONS = ('RLC', 'RRC', 'RL', 'RR', 'SLA', 'SRA', 'SWAP', 'SRL')
+
+
+def _build_opcodes():
+    """Return {opcode: (template, size, flow)} for the unprefixed opcodes."""
+    opcodes = {
+        0x00: ('NOP', 1, FLOW_NEXT),
+        0x10: ('STOP', 2, FLOW_NEXT),
+        0x08: ('LD (${nn}),SP', 3, FLOW_NEXT),
+        0x18: ('JR ${e}', 2, FLOW_JUMP),
+        0x02: ('LD (BC),A', 1, FLOW_NEXT),
+        0x12: ('LD (DE),A', 1, FLOW_NEXT),
+        0x22: ('LD (HL+),A', 1, FLOW_NEXT),
+        0x32: ('LD (HL-),A', 1, FLOW_NEXT),
+        0x0a: ('LD A,(BC)', 1, FLOW_NEXT),
+        0x1a: ('LD A,(DE)', 1, FLOW_NEXT),
+        0x2a: ('LD A,(HL+)', 1, FLOW_NEXT),
+        0x3a: ('LD A,(HL-)', 1, FLOW_NEXT),
+        0x07: ('RLCA', 1, FLOW_NEXT),
+        0x0f: ('RRCA', 1, FLOW_NEXT),
+        0x17: ('RLA', 1, FLOW_NEXT),
+        0x1f: ('RRA', 1, FLOW_NEXT),
+        0x27: ('DAA', 1, FLOW_NEXT),
+        0x2f: ('CPL', 1, FLOW_NEXT),
+        0x37: ('SCF', 1, FLOW_NEXT),
+        0x3f: ('CCF', 1, FLOW_NEXT),
+        0x76: ('HALT', 1, FLOW_NEXT),
+        0xc3: ('JP ${nn}', 3, FLOW_JUMP),
+        0xcd: ('CALL ${nn}', 3, FLOW_CALL),
+        0xc9: ('RET', 1, FLOW_RETURN),
+        0xd9: ('RETI', 1, FLOW_RETURN),
+        0xcb: ('PREFIX CB', 2, FLOW_NEXT),
+        0xe0: ('LD ($ff00+${n}),A', 2, FLOW_NEXT),
+        0xf0: ('LD A,($ff00+${n})', 2, FLOW_NEXT),
+        0xe2: ('LD ($ff00+C),A', 1, FLOW_NEXT),
+        0xf2: ('LD A,($ff00+C)', 1, FLOW_NEXT),
+        0xe8: ('ADD SP,{s}', 2, FLOW_NEXT),
+        0xf8: ('LD HL,SP{s}', 2, FLOW_NEXT),
+        0xe9: ('JP (HL)', 1, FLOW_INDIRECT),
+        0xf9: ('LD SP,HL', 1, FLOW_NEXT),
+        0xea: ('LD (${nn}),A', 3, FLOW_NEXT),
+        0xfa: ('LD A,(${nn})', 3, FLOW_NEXT),
+        0xf3: ('DI', 1, FLOW_NEXT),
+        0xfb: ('EI', 1, FLOW_NEXT),
+    }
+
+    for index, pair in enumerate(PAIRS):
+        opcodes[0x01 + index * 0x10] = ('LD {0},${{nn}}'.format(pair), 3, FLOW_NEXT)
+        opcodes[0x03 + index * 0x10] = ('INC {0}'.format(pair), 1, FLOW_NEXT)
+        opcodes[0x09 + index * 0x10] = ('ADD HL,{0}'.format(pair), 1, FLOW_NEXT)
+        opcodes[0x0b + index * 0x10] = ('DEC {0}'.format(pair), 1, FLOW_NEXT)
+
+    for index, pair in enumerate(STACK_PAIRS):
+        opcodes[0xc1 + index * 0x10] = ('POP {0}'.format(pair), 1, FLOW_NEXT)
+        opcodes[0xc5 + index * 0x10] = ('PUSH {0}'.format(pair), 1, FLOW_NEXT)
+
+    for index, register in enumerate(REGISTERS):
+        opcodes[0x04 + index * 8] = ('INC {0}'.format(register), 1, FLOW_NEXT)
+        opcodes[0x05 + index * 8] = ('DEC {0}'.format(register), 1, FLOW_NEXT)
+        opcodes[0x06 + index * 8] = ('LD {0},${{n}}'.format(register), 2, FLOW_NEXT)
+        for source_index, source in enumerate(REGISTERS):
+            opcode = 0x40 + index * 8 + source_index
+            if opcode != 0x76:
+                opcodes[opcode] = ('LD {0},{1}'.format(register, source), 1, FLOW_NEXT)
+            opcodes[0x80 + index * 8 + source_index] = (ALU[index] + source, 1, FLOW_NEXT)
+        opcodes[0xc6 + index * 8] = (ALU[index] + '${n}', 2, FLOW_NEXT)
+        opcodes[0xc7 + index * 8] = ('RST ${0:02x}'.format(index * 8), 1, FLOW_CALL)
+
+    for index, condition in enumerate(CONDITIONS):
+        opcodes[0x20 + index * 8] = ('JR {0},${{e}}'.format(condition), 2, FLOW_BRANCH)
+        opcodes[0xc0 + index * 8] = ('RET {0}'.format(condition), 1, FLOW_RETURN_CONDITION)
+        opcodes[0xc2 + index * 8] = ('JP {0},${{nn}}'.format(condition), 3, FLOW_BRANCH)
+        opcodes[0xc4 + index * 8] = ('CALL {0},${{nn}}'.format(condition), 3, FLOW_CALL)
+
+    return opcodes
+
+
+def _build_cb_opcodes():
+    opcodes = {}
+    for index, register in enumerate(REGISTERS):
+        for operation_index, operation in enumerate(CB_OPERATIONS):
+            opcodes[operation_index * 8 + index] = '{0} {1}'.format(operation, register)
+        for bit in range(8):
+            opcodes[0x40 + bit * 8 + index] = 'BIT {0},{1}'.format(bit, register)
+            opcodes[0x80 + bit * 8 + index] = 'RES {0},{1}'.format(bit, register)
+            opcodes[0xc0 + bit * 8 + index] = 'SET {0},{1}'.format(bit, register)
+    return opcodes
+
+
+OPCODES = _build_opcodes()
+CB_OPCODES = _build_cb_opcodes()
+
+
+def decode(read_byte, address):
+    """
+    Decode the instruction at address, reading memory with
+    read_byte(address). Returns (bytes, text, flow, target) where target
+    is the jump or call address, or None. Unknown opcodes decode as a
+    one byte FLOW_INVALID instruction.
+    """
+    opcode = read_byte(address)
+    if opcode not in OPCODES:
+        return [opcode], 'DB ${0:02x}'.format(opcode), FLOW_INVALID, None
+
+    template, size, flow = OPCODES[opcode]
+    data = [opcode] + [read_byte((address + offset) & 0xffff) for offset in range(1, size)]
+    target = None
+
+    if opcode == 0xcb:
+        text = CB_OPCODES[data[1]]
+    elif size == 1:
+        text = template
+        if template.startswith('RST'):
+            target = opcode & 0x38
+    else:
+        n = data[1]
+        nn = data[1] | (data[2] << 8) if size == 3 else None
+        signed = n - 0x100 if n & 0x80 else n
+        fields = {'n': '{0:02x}'.format(n), 's': '{0:+d}'.format(signed)}
+        if nn is not None:
+            fields['nn'] = '{0:04x}'.format(nn)
+            if flow != FLOW_NEXT:
+                target = nn
+        if '{e}' in template:
+            target = (address + 2 + signed) & 0xffff
+            fields['e'] = '{0:04x}'.format(target)
+        text = template.format(**fields)
+
+    return data, text, flow, target
+
+
+## Recursive Descent ###################################################
+
+class Disassembly(object):
+    """
+    The result of disassembling a ROM: instructions keyed by (bank,
+    address), basic blocks keyed by their first location, and
+    references that couldn't be followed, as (from, to) location pairs
+    where the target bank is None when it couldn't be determined.
+    """
+    def __init__(self, digest, bank_count):
+        self.digest = digest
+        self.bank_count = bank_count
+        self.instructions = {}
+        self.blocks = {}
+        self.unresolved = []
+        self._sorted = {}
+
+    def addresses(self, bank):
+        """Sorted addresses of the instructions in a bank."""
+        if bank not in self._sorted:
+            self._sorted[bank] = sorted(address for (instruction_bank, address)
+                                        in self.instructions if instruction_bank == bank)
+        return self._sorted[bank]
+
+    def listing(self):
+        """Yield lines of the whole disassembly, bank by bank."""
+        for bank in range(self.bank_count):
+            for address in self.addresses(bank):
+                instruction = self.instructions[(bank, address)]
+                label = '' if (bank, address) not in self.blocks else '{0:02x}:{1:04x}'.format(
+                    bank, address)
+                yield '{0:<8} {1:<12} {2}'.format(
+                    label, ''.join('{0:02x}'.format(b) for b in instruction.bytes),
+                    instruction.text)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_sorted'] = {}
+        return state
+
+
+class Disassembler(object):
+    def __init__(self, rom_data):
+        self.data = bytearray(rom_data)
+        self.bank_count = max(1, (len(self.data) + BANK_SIZE - 1) // BANK_SIZE)
+        self.digest = hashlib.sha1(bytes(self.data)).hexdigest()
+
+    def offset(self, bank, address):
+        """File offset of a location, or None if it's outside the ROM."""
+        if bank == 0 and address < BANK_SIZE:
+            offset = address
+        elif bank >= 1 and BANK_SIZE <= address < BANK_SIZE * 2:
+            offset = bank * BANK_SIZE + address - BANK_SIZE
+        else:
+            return None
+        return offset if offset < len(self.data) else None
+
+    def target_bank(self, bank, address, switched_bank):
+        """The bank a jump from bank to address lands in, or None."""
+        if address < BANK_SIZE:
+            return 0
+        if address >= BANK_SIZE * 2:
+            return None
+        if bank:
+            return bank
+        if self.bank_count <= 2:
+            return 1
+        return switched_bank
+
+    def disassemble(self):
+        disassembly = Disassembly(self.digest, self.bank_count)
+        instructions = disassembly.instructions
+        targets = set()
+        starts = list(ENTRY_POINTS) + list(RST_VECTORS) + list(INTERRUPT_VECTORS)
+        worklist = [(0, address, None) for address in reversed(starts)]
+        targets.update((0, address) for address in starts)
+
+        while worklist:
+            bank, address, switched_bank = worklist.pop()
+            loaded_a = None
+
+            while (bank, address) not in instructions:
+                if self.offset(bank, address) is None:
+                    break
+
+                region_end = BANK_SIZE if bank == 0 else BANK_SIZE * 2
+                data, text, flow, target = decode(
+                    lambda a: self._read(bank, a, region_end), address)
+                if address + len(data) > region_end:
+                    break
+
+                # Track `LD A,n` / `LD ($2000-$3fff),A` bank switches.
+                opcode = data[0]
+                if opcode == 0x3e:
+                    loaded_a = data[1]
+                elif opcode == 0xea and loaded_a is not None:
+                    if 0x2000 <= data[1] | (data[2] << 8) < 0x4000:
+                        switched_bank = loaded_a or 1
+                elif opcode != 0xe0:
+                    loaded_a = None
+
+                location = None
+                if target is not None:
+                    location = (self.target_bank(bank, target, switched_bank), target)
+                    if location[0] is None or self.offset(*location) is None:
+                        disassembly.unresolved.append(((bank, address), location))
+                    else:
+                        targets.add(location)
+                        worklist.append(location + (switched_bank,))
+                instructions[(bank, address)] = Instruction(bank, address, data, text,
+                                                            flow, location)
+
+                if flow in (FLOW_JUMP, FLOW_RETURN, FLOW_INDIRECT, FLOW_INVALID):
+                    break
+                address += len(data)
+
+        disassembly.blocks = self._blocks(instructions, targets)
+        return disassembly
+
+    def _read(self, bank, address, region_end):
+        if address >= region_end:
+            return 0
+        return self.data[self.offset(bank, address)]
+
+    def _blocks(self, instructions, targets):
+        """Split the instructions into basic blocks."""
+        leaders = set(location for location in targets if location in instructions)
+        for (bank, address), instruction in instructions.items():
+            if instruction.flow != FLOW_NEXT:
+                leaders.add((bank, address + len(instruction.bytes)))
+
+        blocks = {}
+        for bank, start in leaders:
+            if (bank, start) not in instructions:
+                continue
+            addresses = []
+            address = start
+            while True:
+                instruction = instructions[(bank, address)]
+                addresses.append(address)
+                following = (bank, address + len(instruction.bytes))
+                if (instruction.flow != FLOW_NEXT or following in leaders or
+                        following not in instructions):
+                    break
+                address = following[1]
+
+            successors = []
+            if instruction.target is not None:
+                successors.append(instruction.target)
+            if instruction.flow in (FLOW_NEXT, FLOW_BRANCH, FLOW_CALL, FLOW_RETURN_CONDITION):
+                if following in instructions:
+                    successors.append(following)
+            blocks[(bank, start)] = Block(bank, start, addresses, successors)
+        return blocks
+
+
+## Caching #############################################################
+
+def cache_directory():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'gamegirl', 'disassembly')
+
+
+def disassemble(rom_data, cache_dir=None):
+    """
+    Return the Disassembly of a ROM image, from the cache if possible.
+    Pass cache_dir=False to skip the cache.
+    """
+    disassembler = Disassembler(rom_data)
+    if cache_dir is False:
+        return disassembler.disassemble()
+
+    cache_dir = cache_dir or cache_directory()
+    path = os.path.join(cache_dir, disassembler.digest + '.pickle')
+    try:
+        with open(path, 'rb') as cache_file:
+            version, disassembly = pickle.load(cache_file)
+        if version == CACHE_VERSION and disassembly.digest == disassembler.digest:
+            return disassembly
+    except Exception:
+        pass
+
+    disassembly = disassembler.disassemble()
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as cache_file:
+            pickle.dump((CACHE_VERSION, disassembly), cache_file, 2)
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        # A cache that can't be written just means disassembling again.
+        pass
+    return disassembly
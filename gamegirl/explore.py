@@ -0,0 +1,174 @@
+"""
+Parallel state-space exploration.
+
+Every branch starts from the same emulator state, holds the buttons
+from its input script for a number of frames and reports hashes of the
+RAM and framebuffer it ended on. Branches run in worker processes:
+with `fork` each worker is forked from the running emulator and shares
+its memory copy-on-write, so nothing is serialized on the way in; with
+`pool` a multiprocessing pool rebuilds the emulator in each worker
+from the ROM, BIOS and a save state.
+"""
+import hashlib
+import multiprocessing
+import os
+import pickle
+import traceback
+
+from gamegirl.graphics import Graphics
+
+
+class ExplorationError(Exception):
+    pass
+
+
+def _hash(*buffers):
+    digest = hashlib.sha1()
+    for buf in buffers:
+        digest.update(buf)
+    return digest.hexdigest()
+
+
+def run_branch(cpu, script, frames):
+    """
+    Run cpu for the given number of frames, holding script[n] (a
+    gamegirl.joypad button mask) during the nth frame and nothing once
+    the script runs out. Only the last frame is rendered. Returns a dict
+    of the final frame number and the RAM and framebuffer hashes.
+
+    This mutates cpu; explore() calls it in a worker process.
+    """
+    graphics = cpu.graphics
+    memory = cpu.memory
+    p1 = memory.p1
+
+    # Sinks, pipelines and callbacks belong to the parent emulator.
+    graphics.sinks = []
+    graphics.frame_callbacks = []
+    graphics.pipeline = None
+    graphics.set_render_policy(Graphics.RENDER_ON_REQUEST)
+
+    start = graphics.frame_count
+    for index in range(frames):
+        p1.set_pressed(script[index] if index < len(script) else 0)
+        if index == frames - 1:
+            graphics.request_frame()
+
+        while graphics.frame_count == start + index:
+            cpu.read_and_execute()
+
+    return {
+        'frame': graphics.frame_count,
+        'ram': _hash(memory.wram.raw_data, memory.stack.raw_data),
+        'framebuffer': _hash(graphics.framebuffer),
+    }
+
+
+def explore(cpu, scripts, frames, processes=None, method=None):
+    """
+    Run one branch per input script from cpu's current state and return
+    their results from run_branch, in script order. cpu itself is left
+    untouched.
+
+    method is 'fork' (the default where os.fork exists) or 'pool'.
+    processes defaults to the number of CPUs.
+    """
+    scripts = list(scripts)
+    processes = min(processes or multiprocessing.cpu_count(), len(scripts)) or 1
+    if method is None:
+        method = 'fork' if hasattr(os, 'fork') else 'pool'
+
+    if method == 'fork':
+        return _explore_fork(cpu, scripts, frames, processes)
+    elif method == 'pool':
+        return _explore_pool(cpu, scripts, frames, processes)
+    else:
+        raise ValueError('Unknown exploration method: {0}'.format(method))
+
+
+def _explore_fork(cpu, scripts, frames, processes):
+    # Each worker runs several branches, and every one of them has to
+    # start from here rather than from where the last one ended.
+    state = cpu.save_state()
+    children = []
+    for worker in range(processes):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Child: run every processes-th script and report back.
+            os.close(read_fd)
+            status = 0
+            try:
+                try:
+                    results = []
+                    for index in range(worker, len(scripts), processes):
+                        cpu.load_state(state)
+                        results.append((index, run_branch(cpu, scripts[index], frames)))
+                    payload = pickle.dumps((True, results), 2)
+                except Exception:
+                    payload = pickle.dumps((False, traceback.format_exc()), 2)
+                with os.fdopen(write_fd, 'wb') as output:
+                    output.write(payload)
+            except BaseException:
+                status = 1
+            finally:
+                os._exit(status)
+
+        os.close(write_fd)
+        children.append((pid, read_fd))
+
+    results = [None] * len(scripts)
+    errors = []
+    for pid, read_fd in children:
+        with os.fdopen(read_fd, 'rb') as output:
+            payload = output.read()
+        os.waitpid(pid, 0)
+
+        if not payload:
+            errors.append('Worker {0} exited without results.'.format(pid))
+            continue
+
+        ok, value = pickle.loads(payload)
+        if not ok:
+            errors.append(value)
+            continue
+        for index, result in value:
+            results[index] = result
+
+    if errors:
+        raise ExplorationError('Exploration failed:\n' + '\n'.join(errors))
+    return results
+
+
+# Emulator rebuilt once per pool worker by _init_worker.
+_worker_cpu = None
+_worker_state = None
+
+
+def _init_worker(rom_data, bios_data, state):
+    global _worker_cpu, _worker_state
+    from gamegirl.cpu import CPU
+    from gamegirl.memory import Memory, Ram, Rom
+
+    memory = Memory(rom=Rom(rom_data), bios=Ram(bios_data))
+    _worker_cpu = CPU(memory=memory)
+    _worker_state = state
+
+
+def _run_pool_branch(args):
+    script, frames = args
+    _worker_cpu.load_state(_worker_state)
+    return run_branch(_worker_cpu, script, frames)
+
+
+def _explore_pool(cpu, scripts, frames, processes):
+    memory = cpu.memory
+    initargs = (bytes(memory.rom.raw_data), bytes(memory.bios.raw_data), cpu.save_state())
+
+    pool = multiprocessing.Pool(processes, _init_worker, initargs)
+    try:
+        chunksize = max(1, len(scripts) // (processes * 4))
+        return pool.map(_run_pool_branch, [(script, frames) for script in scripts], chunksize)
+    finally:
+        pool.close()
+        pool.join()
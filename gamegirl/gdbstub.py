@@ -0,0 +1,309 @@
+"""
+Remote debugging over the GDB remote serial protocol.
+
+The server listens on a localhost TCP port or a Unix socket and serves
+one client at a time. While the target is stopped it handles packets;
+on continue it runs the emulator in batches, checking breakpoints after
+each instruction and only looking at the socket between batches for a
+break (Ctrl-C) from the client.
+
+Supported packets: `?`, `g`/`G` and `p`/`P` (registers), `m`/`M`
+(memory), `Z0`/`z0` and `Z1`/`z1` (breakpoints), `c`, `s`, `D`, `k`
+and the queries GDB sends while connecting. Anything else gets an empty
+reply, which tells the client it isn't supported.
+
+There's no SM83 target in GDB, so the register layout is this stub's
+own: A, F, B, C, D, E, H, L as single bytes, then SP and PC as
+little-endian shorts, numbered 0 to 9 in that order.
+"""
+import os
+import select
+import socket
+import traceback
+
+
+REGISTERS = (('A', 1), ('F', 1), ('B', 1), ('C', 1), ('D', 1), ('E', 1), ('H', 1), ('L', 1),
+             ('SP', 2), ('PC', 2))
+
+SIGINT = 2
+SIGILL = 4
+SIGTRAP = 5
+INTERRUPT = b'\x03'
+
+
+def checksum(data):
+    return sum(bytearray(data)) & 0xff
+
+
+def to_hex(values):
+    return ''.join('{0:02x}'.format(value) for value in values)
+
+
+def from_hex(text):
+    return [int(text[index:index + 2], 16) for index in range(0, len(text), 2)]
+
+
+class GDBServer(object):
+    """
+    Serves GDB remote debugging for cpu on address, which is host:port
+    or a path for a Unix socket.
+    """
+    # Instructions to run between checks for a break from the client.
+    BATCH = 4096
+
+    def __init__(self, cpu, address):
+        self.cpu = cpu
+        self.address = address
+        self.breakpoints = set()
+        self.connection = None
+        self.buffer = b''
+
+    @property
+    def unix_socket(self):
+        return ':' not in self.address
+
+    def listen(self):
+        if not self.unix_socket:
+            host, port = self.address.rsplit(':', 1)
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((host or '127.0.0.1', int(port)))
+        else:
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(self.address)
+        server.listen(1)
+        return server
+
+    def serve(self):
+        """Wait for a client and serve it until it detaches or kills the target."""
+        server = self.listen()
+        try:
+            self.connection, client_address = server.accept()
+            if not self.unix_socket:
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            while self.connection:
+                packet = self.read_packet()
+                if packet is None:
+                    break
+                reply = self.handle(packet)
+                if reply is not None:
+                    self.send_packet(reply)
+        finally:
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+            server.close()
+            if self.unix_socket:
+                os.unlink(self.address)
+
+    ## Packets ##########################################################
+
+    def read_packet(self):
+        """Return the next packet's data as a str, or None on disconnect."""
+        while True:
+            start = self.buffer.find(b'$')
+            end = self.buffer.find(b'#', start)
+            if start >= 0 and end >= 0 and len(self.buffer) >= end + 3:
+                data = self.buffer[start + 1:end]
+                expected = int(self.buffer[end + 1:end + 3], 16)
+                self.buffer = self.buffer[end + 3:]
+                if checksum(data) == expected:
+                    self.connection.sendall(b'+')
+                    return data.decode('latin-1')
+                self.connection.sendall(b'-')
+                continue
+
+            received = self.connection.recv(4096)
+            if not received:
+                return None
+            self.buffer += received
+
+    def send_packet(self, data):
+        data = data.encode('latin-1')
+        self.connection.sendall(b'$' + data + '#{0:02x}'.format(checksum(data)).encode('ascii'))
+
+    def handle(self, packet):
+        command, arguments = packet[:1], packet[1:]
+        handler = getattr(self, 'handle_' + {
+            '?': 'status', 'g': 'read_registers', 'G': 'write_registers',
+            'p': 'read_register', 'P': 'write_register', 'm': 'read_memory',
+            'M': 'write_memory', 'Z': 'add_breakpoint', 'z': 'remove_breakpoint',
+            'c': 'continue', 's': 'step', 'q': 'query', 'H': 'thread', 'D': 'detach',
+            'k': 'kill',
+        }.get(command, 'unsupported'))
+        try:
+            return handler(arguments)
+        except (ValueError, IndexError):
+            return 'E01'
+
+    def handle_unsupported(self, arguments):
+        return ''
+
+    def handle_status(self, arguments):
+        return 'S{0:02x}'.format(SIGTRAP)
+
+    def handle_query(self, arguments):
+        if arguments.startswith('Supported'):
+            return 'PacketSize=4000'
+        if arguments == 'Attached':
+            return '1'
+        if arguments == 'C':
+            return 'QC1'
+        if arguments == 'fThreadInfo':
+            return 'm1'
+        if arguments == 'sThreadInfo':
+            return 'l'
+        return ''
+
+    def handle_thread(self, arguments):
+        return 'OK'
+
+    def handle_detach(self, arguments):
+        self.send_packet('OK')
+        self.connection.close()
+        self.connection = None
+
+    def handle_kill(self, arguments):
+        self.connection.close()
+        self.connection = None
+
+    ## Registers ########################################################
+
+    def handle_read_registers(self, arguments):
+        values = []
+        for name, size in REGISTERS:
+            value = getattr(self.cpu, name)
+            values += [value & 0xff, value >> 8] if size == 2 else [value]
+        return to_hex(values)
+
+    def handle_write_registers(self, arguments):
+        values = from_hex(arguments)
+        for name, size in REGISTERS:
+            value, values = values[:size], values[size:]
+            if len(value) < size:
+                raise ValueError('Register data too short.')
+            setattr(self.cpu, name, value[0] | (value[1] << 8) if size == 2 else value[0])
+        return 'OK'
+
+    def handle_read_register(self, arguments):
+        name, size = REGISTERS[int(arguments, 16)]
+        value = getattr(self.cpu, name)
+        return to_hex([value & 0xff, value >> 8] if size == 2 else [value])
+
+    def handle_write_register(self, arguments):
+        number, data = arguments.split('=')
+        name, size = REGISTERS[int(number, 16)]
+        value = from_hex(data)
+        setattr(self.cpu, name, value[0] | (value[1] << 8) if size == 2 else value[0])
+        return 'OK'
+
+    ## Memory ###########################################################
+
+    def handle_read_memory(self, arguments):
+        address, length = [int(value, 16) for value in arguments.split(',')]
+        memory = self.cpu.memory
+        end = min(address + length, 0x10000)
+        try:
+            return to_hex(memory.read_bytes(address, end))
+        except ValueError:
+            pass
+
+        # The range crosses regions or unmapped memory; return what can
+        # be read up to the first gap.
+        values = []
+        for byte_address in range(address, end):
+            try:
+                values.append(memory.read_byte(byte_address))
+            except ValueError:
+                break
+        if not values:
+            return 'E14'
+        return to_hex(values)
+
+    def handle_write_memory(self, arguments):
+        location, data = arguments.split(':')
+        address, length = [int(value, 16) for value in location.split(',')]
+        values = from_hex(data)[:length]
+        try:
+            for offset, value in enumerate(values):
+                self.cpu.memory.write_byte(address + offset, value)
+        except (ValueError, AttributeError):
+            # AttributeError: ROM can't be written.
+            return 'E14'
+        return 'OK'
+
+    ## Breakpoints ######################################################
+
+    def _breakpoint_address(self, arguments):
+        kind, address = arguments.split(',')[:2]
+        if kind not in ('0', '1'):
+            return None
+        return int(address, 16)
+
+    def handle_add_breakpoint(self, arguments):
+        address = self._breakpoint_address(arguments)
+        if address is None:
+            return ''
+        self.breakpoints.add(address)
+        return 'OK'
+
+    def handle_remove_breakpoint(self, arguments):
+        address = self._breakpoint_address(arguments)
+        if address is None:
+            return ''
+        self.breakpoints.discard(address)
+        return 'OK'
+
+    ## Execution ########################################################
+
+    def handle_step(self, arguments):
+        if arguments:
+            self.cpu.PC = int(arguments, 16)
+        try:
+            self.cpu.read_and_execute()
+        except Exception:
+            traceback.print_exc()
+            return 'S{0:02x}'.format(SIGILL)
+        return 'S{0:02x}'.format(SIGTRAP)
+
+    def handle_continue(self, arguments):
+        if arguments:
+            self.cpu.PC = int(arguments, 16)
+        signal = self.run()
+        if signal is not None:
+            return 'S{0:02x}'.format(signal)
+
+    def run(self):
+        """
+        Run until a breakpoint, a break from the client or an error from
+        the emulator, returning the signal to report, or None if the
+        client went away. Errors are printed to stderr, since all the
+        client gets to see is SIGILL.
+        """
+        cpu = self.cpu
+        breakpoints = self.breakpoints
+        connection = self.connection
+
+        while True:
+            try:
+                for index in range(self.BATCH):
+                    cpu.read_and_execute()
+                    if cpu.PC in breakpoints:
+                        return SIGTRAP
+            except Exception:
+                traceback.print_exc()
+                return SIGILL
+
+            readable, writable, errors = select.select([connection], [], [], 0)
+            if readable:
+                data = connection.recv(4096)
+                if not data:
+                    connection.close()
+                    self.connection = None
+                    return None
+                if INTERRUPT in data:
+                    self.buffer += data.replace(INTERRUPT, b'')
+                    return SIGINT
+                self.buffer += data
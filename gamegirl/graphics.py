@@ -1,67 +1,207 @@
-from gamegirl.utils import get_bit
+import struct
 
+from gamegirl import interrupts
+from gamegirl.utils import import_numpy
 
-class TilePatternTable(object):
-    """Table of bitmap data for BG tiles."""
-    def __init__(self, data, signed):
-        self.data = data
-        self.signed = signed
 
-        self.tiles = []
-        for index in range(256):
-            start = index * 16
-            self.tiles.append(Tile(data[start:start+16]))
+SCREEN_WIDTH = 160
+SCREEN_HEIGHT = 144
 
-    def get_tile(self, index):
-        if self.signed:
-            index += 127
-        return self.tiles[index]
+# Framebuffer bytes hold raw color numbers tagged with the palette they
+# should be looked up in: (palette << 2) | color.
+PALETTE_BGP = 0
+PALETTE_OBP0 = 1
+PALETTE_OBP1 = 2
 
+# LCDC bits
+LCDC_BG_DISPLAY = 0b1
+LCDC_OBJ_DISPLAY = 0b10
+LCDC_OBJ_SIZE = 0b100
+LCDC_BG_TILEMAP = 0b1000
+LCDC_TILE_DATA = 0b10000
+LCDC_WINDOW_DISPLAY = 0b100000
+LCDC_WINDOW_TILEMAP = 0b1000000
+LCDC_LCD_ON = 0b10000000
 
-class Tile(object):
-    """Bitmap data for a BG tile."""
-    def __init__(self, data):
-        self.data = data
+# STAT interrupt source bits.
+STAT_HBLANK_INTERRUPT = 0b1000
+STAT_VBLANK_INTERRUPT = 0b10000
+STAT_OAM_INTERRUPT = 0b100000
+STAT_LYC_INTERRUPT = 0b1000000
 
-    def get_pixel(self, x, y):
-        start = y * 2
-        bytes = self.data[start:start+1]
-        return get_bit(bytes[0], x) & (get_bit(bytes[1], x) << 1)
+# Tilemap offsets within LCD RAM.
+TILEMAP_1 = 0x1800
+TILEMAP_2 = 0x1c00
 
+BLANK_LINE = bytes(bytearray(SCREEN_WIDTH))
 
-class Background(object):
-    def __init__(self, cpu):
-        self.cpu = cpu
-        self.unsigned_tiles = TilePatternTable(cpu.memory.get_view(0x8000, 0x9000), signed=False)
-        self.signed_tiles = TilePatternTable(cpu.memory.get_view(0x8800, 0x9800), signed=True)
-        self.bg_tilemap_1 = cpu.memory.get_view(0x9800, 0x9c00)
-        self.bg_tilemap_2 = cpu.memory.get_view(0x9c00, 0xa000)
+# PPU timing, in CPU cycles.
+OAM_CYCLES = 80
+VRAM_CYCLES = 172
+LINE_CYCLES = 456
+VBLANK_START = SCREEN_HEIGHT * LINE_CYCLES
+FRAME_CYCLES = 70224
 
-    @property
-    def tiles(self):
-        if self.cpu.memory.lcdc.bg_window_tile_data:
-            return self.unsigned_tiles
-        else:
-            return self.signed_tiles
 
-    @property
-    def tilemap(self):
-        if self.cpu.memory.lcdc.bg_tilemap_display:
-            return self.bg_tilemap_2
+def _spread_bits(byte):
+    """
+    Spread the bits of a byte into the low bit of each byte of a 64-bit
+    integer, with bit 7 (the leftmost pixel) in the most significant
+    byte.
+    """
+    value = 0
+    for bit in range(8):
+        value |= ((byte >> bit) & 0x1) << (bit * 8)
+    return value
+
+
+SPREAD_BITS = [_spread_bits(byte) for byte in range(256)]
+PIXEL_ROW = struct.Struct('>Q')
+
+
+def tile_row(vram, address):
+    """Decode the 8 color numbers of the tile row at the given address."""
+    return PIXEL_ROW.pack(SPREAD_BITS[vram[address]] | (SPREAD_BITS[vram[address + 1]] << 1))
+
+
+def tilemap_row(vram, tilemap, unsigned_tiles, x, y, width):
+    """
+    Return width color numbers from a 256x256 tilemap starting at the
+    given coordinates, wrapping horizontally.
+    """
+    map_row = tilemap + (y >> 3) * 32
+    row_offset = (y & 7) * 2
+    first_tile = x >> 3
+    tile_count = ((x & 7) + width + 7) >> 3
+
+    rows = []
+    for tile_x in range(first_tile, first_tile + tile_count):
+        tile = vram[map_row + (tile_x & 31)]
+        if unsigned_tiles:
+            address = tile * 16
         else:
-            return self.bg_tilemap_1
+            address = 0x1000 + ((tile ^ 0x80) - 0x80) * 16
+        rows.append(tile_row(vram, address + row_offset))
+
+    start = x & 7
+    return b''.join(rows)[start:start + width]
+
+
+def render_scanline(framebuffer, line, vram, oam, lcdc, scy, scx, wy, wx, window_line):
+    """
+    Render a single line of raw color numbers into the framebuffer.
+    Returns True if the window was drawn on this line, so the caller can
+    advance its internal window line counter.
+    """
+    start = line * SCREEN_WIDTH
+    if not lcdc & LCDC_LCD_ON:
+        framebuffer[start:start + SCREEN_WIDTH] = BLANK_LINE
+        return False
+
+    unsigned_tiles = lcdc & LCDC_TILE_DATA
+    if lcdc & LCDC_BG_DISPLAY:
+        tilemap = TILEMAP_2 if lcdc & LCDC_BG_TILEMAP else TILEMAP_1
+        pixels = bytearray(tilemap_row(vram, tilemap, unsigned_tiles, scx,
+                                       (line + scy) & 0xff, SCREEN_WIDTH))
+    else:
+        pixels = bytearray(SCREEN_WIDTH)
+
+    window_drawn = False
+    window_x = wx - 7
+    if lcdc & LCDC_WINDOW_DISPLAY and wy <= line and window_x < SCREEN_WIDTH:
+        tilemap = TILEMAP_2 if lcdc & LCDC_WINDOW_TILEMAP else TILEMAP_1
+        skip = max(0, -window_x)
+        window_x = max(0, window_x)
+        width = SCREEN_WIDTH - window_x
+        pixels[window_x:] = tilemap_row(vram, tilemap, unsigned_tiles, skip,
+                                        window_line & 0xff, width)
+        window_drawn = True
+
+    if lcdc & LCDC_OBJ_DISPLAY:
+        render_sprites(pixels, line, vram, oam, 16 if lcdc & LCDC_OBJ_SIZE else 8)
+
+    framebuffer[start:start + SCREEN_WIDTH] = pixels
+    return window_drawn
+
+
+def render_sprites(pixels, line, vram, oam, height):
+    """Draw the sprites visible on the given line over the BG pixels."""
+    sprites = []
+    for index in range(0, 160, 4):
+        top = oam[index] - 16
+        if top <= line < top + height:
+            sprites.append((oam[index + 1], index))
+            if len(sprites) == 10:
+                break
 
-    def get_pixel(self, x, y):
-        x = (x + self.cpu.memory.scx) % 256
-        y = (y + self.cpu.memory.scy) % 256
-        tile_x, pixel_x_offset = divmod(x, 8)
-        tile_y, pixel_y_offset = divmod(y, 8)
+    if not sprites:
+        return
 
-        # TODO: Ensure that tile_x and tile_y are signed when
-        # bg_window_tile_data is false.
-        tile_index = self.tilemap[tile_x + (tile_y * 32)]
-        tile = self.tiles[tile_index]
-        return tile.get_pixel(pixel_x_offset, pixel_y_offset)
+    # Lower X coordinates (then lower OAM indexes) win, so draw from the
+    # lowest priority up.
+    background = pixels[:]
+    sprites.sort(reverse=True)
+    for x, index in sprites:
+        x -= 8
+        tile = oam[index + 2]
+        flags = oam[index + 3]
+
+        row = line - (oam[index] - 16)
+        if flags & 0x40:
+            row = height - 1 - row
+        if height == 16:
+            tile &= 0xfe
+
+        colors = bytearray(tile_row(vram, tile * 16 + row * 2))
+        if flags & 0x20:
+            colors.reverse()
+
+        palette = (PALETTE_OBP1 if flags & 0x10 else PALETTE_OBP0) << 2
+        behind_background = flags & 0x80
+        for offset in range(max(0, -x), min(8, SCREEN_WIDTH - x)):
+            color = colors[offset]
+            if not color:
+                continue
+            if behind_background and background[x + offset] & 0x3:
+                continue
+            pixels[x + offset] = palette | color
+
+
+class PaletteTables(object):
+    """
+    Lookup tables translating framebuffer bytes into shades and RGBA
+    channels for a particular set of palette register values.
+    """
+    def __init__(self, palettes, colors):
+        self.palettes = palettes
+
+        shades = bytearray(256)
+        for palette, palette_shades in enumerate(palettes):
+            for color, shade in enumerate(palette_shades):
+                shades[(palette << 2) | color] = shade
+
+        self.shades = bytes(shades)
+        self.channels = [bytes(bytearray(colors[shade][channel] for shade in shades))
+                         for channel in range(4)]
+
+        self.numpy = numpy = import_numpy()
+        if numpy is not None:
+            self.rgba = numpy.array([colors[shade] for shade in shades], dtype=numpy.uint8)
+
+    def expand(self, frame, channel_count):
+        """
+        Translate a frame of raw color numbers into packed RGB (3
+        channels) or RGBA (4 channels) bytes.
+        """
+        numpy = self.numpy
+        if numpy is not None:
+            indexes = numpy.frombuffer(frame, dtype=numpy.uint8)
+            return self.rgba[:, :channel_count].take(indexes, axis=0).tobytes()
+
+        output = bytearray(len(frame) * channel_count)
+        for channel in range(channel_count):
+            output[channel::channel_count] = frame.translate(self.channels[channel])
+        return bytes(output)
 
 
 class Graphics(object):
@@ -70,32 +210,291 @@ class Graphics(object):
     MODE_OAM = 2
     MODE_VRAM = 3
 
-    def __init__(self, cpu):
+    # Rendering policies. Skipped frames still run LY/STAT timing.
+    RENDER_ALWAYS = 'always'
+    RENDER_EVERY_N = 'every_n'
+    RENDER_ON_REQUEST = 'on_request'
+    RENDER_NEVER = 'never'
+    RENDER_POLICIES = (RENDER_ALWAYS, RENDER_EVERY_N, RENDER_ON_REQUEST, RENDER_NEVER)
+
+    # RGBA output colors for shades 0-3.
+    COLORS = (
+        (0xff, 0xff, 0xff, 0xff),
+        (0xaa, 0xaa, 0xaa, 0xff),
+        (0x55, 0x55, 0x55, 0xff),
+        (0x00, 0x00, 0x00, 0xff),
+    )
+
+    def __init__(self, cpu, render_policy=RENDER_ALWAYS, render_every=1):
         self.cpu = cpu
-        self.background = Background(cpu)
-        self.cycles = 0
+        self.window_line = 0
+        self.framebuffer = bytearray(SCREEN_WIDTH * SCREEN_HEIGHT)
+
+        self.frame_count = 0
+        self.frames_rendered = 0
+        self.frames_skipped = 0
+        self.frame_requested = False
+
+        self.sinks = []
+        self.frame_callbacks = []
+        self.pipeline = None
+
+        self._palette_key = None
+        self._palette_tables = None
+        # Shades the framebuffer is output with when they aren't the
+        # current palette registers' (pipelined frames arrive late).
+        self.framebuffer_palettes = None
 
-    def cycle(self, cycles):
-        self.cycles += cycles
+        # LY and STAT are computed from the cycle the current frame
+        # started on when they're read.
+        cpu.memory.ly.graphics = self
+        cpu.memory.stat.graphics = self
+        cpu.memory.lyc.graphics = self
 
-        if self.cpu.memory.stat.mode == self.MODE_OAM and self.cycles >= 80:
-            self.cpu.memory.stat.mode = self.MODE_VRAM
-            self.cycles -= 80
+        # The LCD powers on at the start of HBlank on line 0.
+        self.frame_start = cpu.cycles - (OAM_CYCLES + VRAM_CYCLES)
+
+        scheduler = cpu.scheduler
+        scheduler.register('ppu_line', self.line_event)
+        scheduler.register('ppu_vblank', self.vblank_event)
+        scheduler.register('ppu_frame', self.frame_event)
+        scheduler.register('ppu_stat', self.stat_event)
+        scheduler.schedule('ppu_vblank', self.frame_start + VBLANK_START)
+        scheduler.schedule('ppu_frame', self.frame_start + FRAME_CYCLES)
+
+        self.set_render_policy(render_policy, render_every)
+
+    @property
+    def ly(self):
+        position = self.cpu.cycles - self.frame_start
+        if position >= VBLANK_START:
+            return SCREEN_HEIGHT
+        return position // LINE_CYCLES
+
+    @property
+    def mode(self):
+        position = self.cpu.cycles - self.frame_start
+        if position >= VBLANK_START:
+            return self.MODE_VBLANK
+
+        dot = position % LINE_CYCLES
+        if dot < OAM_CYCLES:
+            return self.MODE_OAM
+        elif dot < OAM_CYCLES + VRAM_CYCLES:
+            return self.MODE_VRAM
+        else:
+            return self.MODE_HBLANK
+
+    @property
+    def coincidence(self):
+        return self.ly == self.cpu.memory.lyc.value
+
+    def line_event(self, cycle):
+        """End of mode 3: render the line."""
+        line = (cycle - self.frame_start) // LINE_CYCLES
+        self.render_line(line)
+        if line + 1 < SCREEN_HEIGHT:
+            self.cpu.scheduler.schedule('ppu_line', cycle + LINE_CYCLES)
+
+    def vblank_event(self, cycle):
+        self.cpu.interrupts.request(interrupts.VBLANK)
+        self.end_frame()
+
+    def frame_event(self, cycle):
+        self.frame_start = cycle
+        self.cpu.scheduler.schedule('ppu_vblank', cycle + VBLANK_START)
+        self.cpu.scheduler.schedule('ppu_frame', cycle + FRAME_CYCLES)
+        self.start_frame()
+
+    def stat_event(self, cycle):
+        self.cpu.interrupts.request(interrupts.STAT)
+        self.update_stat_event(cycle)
+
+    def update_stat_event(self, now=None):
+        """
+        Schedule the STAT interrupt for the next point after now that
+        one of the sources enabled in STAT fires at, or cancel it if
+        none are enabled. Called when STAT or LYC are written.
+        """
+        memory = self.cpu.memory
+        stat = memory.stat._value
+        if now is None:
+            now = self.cpu.cycles
+
+        # Offsets within the frame that `now` falls in.
+        base = self.frame_start + (now - self.frame_start) // FRAME_CYCLES * FRAME_CYCLES
+        position = now - base
+        line_start = position // LINE_CYCLES * LINE_CYCLES
+
+        points = []
+        if stat & STAT_LYC_INTERRUPT and memory.lyc.value <= SCREEN_HEIGHT:
+            points.append(memory.lyc.value * LINE_CYCLES)
+        if stat & STAT_VBLANK_INTERRUPT:
+            points.append(VBLANK_START)
+        if stat & STAT_OAM_INTERRUPT:
+            oam = line_start + LINE_CYCLES
+            points.append(oam if oam < VBLANK_START else 0)
+        if stat & STAT_HBLANK_INTERRUPT:
+            hblank = line_start + OAM_CYCLES + VRAM_CYCLES
+            if hblank <= position:
+                hblank += LINE_CYCLES
+            points.append(hblank if hblank < VBLANK_START else OAM_CYCLES + VRAM_CYCLES)
+
+        if not points:
+            self.cpu.scheduler.cancel('ppu_stat')
+            return
+
+        # Points at or before now come around again next frame.
+        self.cpu.scheduler.schedule('ppu_stat', base + min(
+            point if point > position else point + FRAME_CYCLES for point in points
+        ))
+
+    def set_render_policy(self, policy, every=1):
+        if policy not in self.RENDER_POLICIES:
+            raise ValueError('Unknown render policy: {0}'.format(policy))
+        if every < 1:
+            raise ValueError('Render interval must be at least 1, got {0}'.format(every))
+
+        self.render_policy = policy
+        self.render_every = every
+        self._update_rendering()
+
+    def request_frame(self):
+        """Ask for the next full frame to be rendered."""
+        self.frame_requested = True
+
+    def start_frame(self):
+        self.window_line = 0
+        self._update_rendering()
+        if self.rendering and self.render_policy == self.RENDER_ON_REQUEST:
+            self.frame_requested = False
+
+    def end_frame(self):
+        self.frame_count += 1
+        for callback in self.frame_callbacks:
+            callback(self)
+
+        if not self.rendering:
+            self.frames_skipped += 1
+            return
+
+        self.frames_rendered += 1
+        if self.pipeline is not None:
+            palettes = self.pipeline.submit_frame(self.current_palettes(), self.framebuffer)
+            if palettes is None:
+                return
+            self.framebuffer_palettes = palettes
+
+        for sink in self.sinks:
+            sink.push_frame(self)
+
+    def add_sink(self, sink):
+        """Feed every rendered frame to sink.push_frame at VBlank."""
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+
+    def add_frame_callback(self, callback):
+        """Call callback(graphics) at VBlank of every frame, rendered or not."""
+        self.frame_callbacks.append(callback)
+
+    def remove_frame_callback(self, callback):
+        self.frame_callbacks.remove(callback)
+
+    def set_pipeline(self, pipeline):
+        """
+        Render frames in a PipelinedRenderer's worker process, or in
+        this process again if pipeline is None. Frames still in flight
+        in the previous pipeline are delivered first.
+        """
+        if self.pipeline is not None:
+            for palettes in self.pipeline.drain(self.framebuffer):
+                self.framebuffer_palettes = palettes
+                for sink in self.sinks:
+                    sink.push_frame(self)
+        self.pipeline = pipeline
+        if pipeline is None:
+            self.framebuffer_palettes = None
+
+    def _update_rendering(self):
+        """
+        Decide whether the current frame renders, and schedule the next
+        line render event (whose end of mode 3 is still ahead) if so.
+        """
+        self.rendering = self._should_render()
+        if not self.rendering:
+            self.cpu.scheduler.cancel('ppu_line')
+            return
+
+        line = (self.cpu.cycles - self.frame_start - OAM_CYCLES - VRAM_CYCLES) // LINE_CYCLES + 1
+        if line < SCREEN_HEIGHT:
+            self.cpu.scheduler.schedule(
+                'ppu_line', self.frame_start + line * LINE_CYCLES + OAM_CYCLES + VRAM_CYCLES
+            )
+
+    def _should_render(self):
+        policy = self.render_policy
+        if policy == self.RENDER_ALWAYS:
+            return True
+        elif policy == self.RENDER_EVERY_N:
+            return self.frame_count % self.render_every == 0
+        elif policy == self.RENDER_ON_REQUEST:
+            return self.frame_requested
+        else:
+            return False
+
+    @property
+    def stats(self):
+        return {
+            'frames': self.frame_count,
+            'frames_rendered': self.frames_rendered,
+            'frames_skipped': self.frames_skipped,
+        }
+
+    def render_line(self, line):
+        memory = self.cpu.memory
+        if self.pipeline is not None:
+            self.pipeline.record_line(line, memory.lcd_ram.raw_data, memory.oam.raw_data,
+                                      memory.lcdc.value, memory.scy.value, memory.scx.value,
+                                      memory.wy.value, memory.wx.value)
+            return
+
+        window_drawn = render_scanline(
+            self.framebuffer, line, memory.lcd_ram.raw_data, memory.oam.raw_data,
+            memory.lcdc.value, memory.scy.value, memory.scx.value,
+            memory.wy.value, memory.wx.value, self.window_line
+        )
+        if window_drawn:
+            self.window_line += 1
+
+    @property
+    def palette_tables(self):
+        """
+        Lookup tables for the palettes the framebuffer is output with:
+        the current ones, or the ones a pipelined frame was drawn with.
+        The palette registers decode their shades when written, so the
+        tables are only rebuilt after one of them changes.
+        """
+        key = self.framebuffer_palettes or self.current_palettes()
+        if key != self._palette_key:
+            self._palette_tables = PaletteTables(key, self.COLORS)
+            self._palette_key = key
+        return self._palette_tables
 
-        if self.cpu.memory.stat.mode == self.MODE_VRAM and self.cycles >= 172:
-            self.cpu.memory.stat.mode = self.MODE_HBLANK
-            self.cycles -= 172
+    def current_palettes(self):
+        """The (BGP, OBP0, OBP1) shades currently in the palette registers."""
+        memory = self.cpu.memory
+        return (memory.bgp.shades, memory.obp0.shades, memory.obp1.shades)
 
-        if self.cpu.memory.stat.mode == self.MODE_HBLANK and self.cycles >= 204:
-            self.cpu.memory.ly.value += 1
-            self.cycles -= 204
+    def frame_shades(self):
+        """Return the current frame as one shade (0-3) per pixel."""
+        return self.framebuffer.translate(self.palette_tables.shades)
 
-            if self.cpu.memory.ly.value >= 144:
-                self.cpu.memory.stat.mode = self.MODE_VBLANK
-            else:
-                self.cpu.memory.stat.mode = self.MODE_OAM
+    def frame_rgb(self):
+        """Return the current frame as packed 24-bit RGB."""
+        return self.palette_tables.expand(self.framebuffer, 3)
 
-        if self.cpu.memory.stat.mode == self.MODE_VBLANK and self.cycles >= 4560:
-            self.cpu.memory.ly.value = 0
-            self.cpu.memory.stat.mode = self.MODE_OAM
-            self.cycles -= 4560
+    def frame_rgba(self):
+        """Return the current frame as packed 32-bit RGBA."""
+        return self.palette_tables.expand(self.framebuffer, 4)
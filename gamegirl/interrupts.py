@@ -0,0 +1,132 @@
+"""
+Interrupt controller.
+
+The CPU checks a single integer, `pending`, before every instruction.
+It's recomputed only when IE, IF or IME change, and is non-zero only if
+an enabled interrupt is requested while IME is set, or while the CPU is
+halted or waiting out the instruction after EI.
+"""
+from gamegirl.scheduler import NEVER
+
+
+VBLANK = 0b00001
+STAT = 0b00010
+TIMER = 0b00100
+SERIAL = 0b01000
+JOYPAD = 0b10000
+
+# In priority order.
+VECTORS = (
+    (VBLANK, 0x40),
+    (STAT, 0x48),
+    (TIMER, 0x50),
+    (SERIAL, 0x58),
+    (JOYPAD, 0x60),
+)
+
+# Extra bits in `pending` for CPU states that need a look before the
+# next instruction even when no interrupt can be serviced.
+PENDING_EI = 0b0100000
+PENDING_HALT = 0b1000000
+
+DISPATCH_CYCLES = 20
+
+
+class Interrupts(object):
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.enabled = cpu.memory.ie
+        self.flags = cpu.memory.io_ports.named_registers['if']
+
+        self.ime = False
+        self.ei_delay = 0
+        self.halted = False
+        self.requested = 0
+        self.pending = 0
+
+        self.enabled.interrupts = self
+        self.flags.interrupts = self
+        cpu.memory.p1.interrupts = self
+
+    def update(self):
+        requested = self.enabled.value & self.flags.value & 0x1f
+        pending = requested if self.ime else 0
+        if self.ei_delay:
+            pending |= PENDING_EI
+        if self.halted:
+            pending |= PENDING_HALT
+
+        self.requested = requested
+        self.pending = pending
+
+    def request(self, interrupt):
+        self.flags.value |= interrupt
+
+    def enable(self):
+        """EI: set IME once the next instruction has run."""
+        if not self.ime:
+            self.ei_delay = 2
+            self.update()
+
+    def disable(self):
+        self.ime = False
+        self.ei_delay = 0
+        self.update()
+
+    def set_master_enable(self, value):
+        self.ime = bool(value)
+        self.ei_delay = 0
+        self.update()
+
+    def halt(self):
+        # With IME off and an interrupt already waiting, HALT falls
+        # straight through.
+        if not self.requested:
+            self.halted = True
+            self.update()
+
+    def handle(self):
+        """
+        Called by the CPU before an instruction while `pending` is set.
+        Services the highest priority interrupt if there is one. Returns
+        False if the CPU is still halted, after skipping ahead to the
+        next scheduled event.
+        """
+        if self.ei_delay:
+            self.ei_delay -= 1
+            if not self.ei_delay:
+                self.ime = True
+
+        if self.halted:
+            if self.requested:
+                self.halted = False
+            else:
+                self._sleep()
+                self.update()
+                return False
+
+        self.update()
+        if self.pending & 0x1f:
+            self._dispatch()
+        return True
+
+    def _sleep(self):
+        cpu = self.cpu
+        next_cycle = cpu.scheduler.next_cycle
+        if next_cycle == NEVER:
+            raise Exception('CPU halted with no events scheduled to wake it.')
+
+        # Stay on a 4-cycle boundary, like instructions do.
+        cycles = -(-(next_cycle - cpu.cycles) // 4) * 4
+        cpu.cycle(max(cycles, 4))
+
+    def _dispatch(self):
+        cpu = self.cpu
+        for interrupt, vector in VECTORS:
+            if self.requested & interrupt:
+                self.ime = False
+                self.flags.value &= ~interrupt & 0xff
+                cpu.stack.push_short(cpu.PC)
+                cpu.PC = vector
+                cpu.cycle(DISPATCH_CYCLES)
+                return
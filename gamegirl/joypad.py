@@ -0,0 +1,131 @@
+"""
+Joypad buttons and input sources.
+
+Button state is a single byte with one bit per button, set while the
+button is held. The low nibble holds the direction keys and the high
+nibble the action buttons, matching the two lines the P1 register
+multiplexes between.
+
+Input sources have a `buttons(frame)` method returning the state for a
+frame, and optionally `close()`.
+"""
+
+
+RIGHT = 0b00000001
+LEFT = 0b00000010
+UP = 0b00000100
+DOWN = 0b00001000
+A = 0b00010000
+B = 0b00100000
+SELECT = 0b01000000
+START = 0b10000000
+
+BUTTONS = {
+    'right': RIGHT,
+    'left': LEFT,
+    'up': UP,
+    'down': DOWN,
+    'a': A,
+    'b': B,
+    'select': SELECT,
+    'start': START,
+}
+
+
+def parse_buttons(text):
+    """Parse a button mask from names like 'a+right'; '' or '-' is none."""
+    pressed = 0
+    for name in text.lower().replace(',', '+').split('+'):
+        name = name.strip()
+        if not name or name == '-':
+            continue
+        try:
+            pressed |= BUTTONS[name]
+        except KeyError:
+            raise ValueError('Unknown button: {0}'.format(name))
+    return pressed
+
+
+class Joypad(object):
+    """
+    Drives P1 from an input source. At the start of every frame the
+    source is asked for the buttons held during that frame; the joypad
+    interrupt is requested when a newly pressed button pulls a selected
+    line low.
+    """
+    def __init__(self, cpu, source):
+        self.cpu = cpu
+        self.source = source
+        self.p1 = cpu.memory.p1
+
+        self.p1.set_pressed(source.buttons(cpu.graphics.frame_count))
+        cpu.graphics.add_frame_callback(self.frame_ended)
+
+    def close(self):
+        self.cpu.graphics.remove_frame_callback(self.frame_ended)
+        close = getattr(self.source, 'close', None)
+        if close:
+            close()
+
+    def frame_ended(self, graphics):
+        self.p1.set_pressed(self.source.buttons(graphics.frame_count))
+
+
+class CallableSource(object):
+    """Input from a function called with each frame number."""
+    def __init__(self, function):
+        self.function = function
+
+    def buttons(self, frame):
+        return self.function(frame)
+
+
+class ScriptSource(object):
+    """
+    Input from a script of lines like `120 a+right`: from frame 120 on,
+    hold A and Right until the next line's frame. Blank lines and lines
+    starting with # are ignored, and `-` releases everything.
+
+    Lines are only read once the emulator reaches the previous line's
+    frame, so the stream can be a pipe fed by another program; reads
+    block until it writes the next line or closes the pipe.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.pressed = 0
+        self.next_line = None
+        self.finished = False
+
+    def buttons(self, frame):
+        while True:
+            if self.next_line is None and not self.finished:
+                self.next_line = self._read_line()
+            if self.next_line is None or self.next_line[0] > frame:
+                return self.pressed
+            self.pressed = self.next_line[1]
+            self.next_line = None
+
+    def close(self):
+        self.stream.close()
+
+    def _read_line(self):
+        # readline rather than iteration, which reads ahead on pipes.
+        while True:
+            line = self.stream.readline()
+            if not line:
+                break
+            if not isinstance(line, str):
+                line = line.decode('utf8')
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+
+            parts = line.split(None, 1)
+            try:
+                frame = int(parts[0])
+            except ValueError:
+                raise ValueError('Invalid input script line: {0!r}'.format(line))
+            return frame, parse_buttons(parts[1] if len(parts) > 1 else '')
+
+        self.finished = True
+        return None
@@ -1,5 +1,9 @@
 import struct
-from collections import MutableSequence
+
+try:
+    from collections.abc import MutableSequence
+except ImportError:
+    from collections import MutableSequence
 
 
 class ReadableMemory(object):
@@ -49,6 +53,10 @@ class Rom(ReadableMemory):
         0x05: (8 * 1024 * 1024 / 8, '8 MBit'),
         0x06: (16 * 1024 * 1024 / 8, '16 MBit'),
         0x07: (32 * 1024 * 1024 / 8, '32 MBit'),
+        0x08: (64 * 1024 * 1024 / 8, '64 MBit'),
+        0x52: (9 * 1024 * 1024 / 8, '9 MBit'),
+        0x53: (10 * 1024 * 1024 / 8, '10 MBit'),
+        0x54: (12 * 1024 * 1024 / 8, '12 MBit'),
     }
 
     def __init__(self, rom_data):
@@ -61,15 +69,34 @@ class Rom(ReadableMemory):
         self.gbc_compatible = self.read_byte(0x143)
         self.maker_code = self.read_string(0x144, 2)
         self.super_gameboy = bool(self.read_byte(0x146))
+        self.cartridge_type = self.read_byte(0x147)
         self.rom_size = self.ROM_SIZES[self.read_byte(0x148)]
+        self.ram_size_code = self.read_byte(0x149)
         self.destination = self.read_byte(0x14a)
         self.mask_rom_version = self.read_byte(0x14c)
-        self.checksum = self.read_short(0x14e)
+        # Unlike everything else, the global checksum is big-endian.
+        self.checksum = self.unpack('>H', 0x14e, 2)[0]
 
         # Run complement check on header data.
         complement_check_sum = sum(self.read_bytes(0x134, 0x14d)) + 0x19
         self.passed_complement_check = (complement_check_sum + self.read_byte(0x14d)) & 0xFF == 0
 
+    def global_checksum(self):
+        """
+        Sum of every byte in the ROM except the checksum itself, as
+        stored at $014e. Real hardware never checks it, so a mismatch
+        usually means a bad dump or a patched ROM rather than one that
+        won't run.
+        """
+        # bytearray iterates as ints on Python 2 and 3 alike, and summing
+        # it beats iterating a memoryview even with the copy.
+        total = sum(bytearray(self.rom_data))
+        return (total - self.read_byte(0x14e) - self.read_byte(0x14f)) & 0xffff
+
+    @property
+    def passed_global_checksum(self):
+        return self.global_checksum() == self.checksum
+
     @property
     def raw_data(self):
         return self.rom_data
@@ -146,11 +173,13 @@ class MappedRegisterMemory(object):
             raise ValueError('Missing register: ${0:02x}'.format(address))
 
     def read_bytes(self, start_address, end_address):
-        try:
-            return [self.registers[address].read()
-                    for address in range(start_address, end_address)]
-        except KeyError:
-            raise ValueError('Missing register: ${0:02x}'.format(address))
+        values = []
+        for address in range(start_address, end_address):
+            register = self.registers.get(address)
+            if register is None:
+                raise ValueError('Missing register: ${0:02x}'.format(address))
+            values.append(register.read())
+        return values
 
     def write_short(self, address, value):
         try:
@@ -177,10 +206,15 @@ class Memory(object):
         self.wram = Ram(8 * 1024)
         self.stack = Ram(127)
         self.lcd_ram = Ram(8 * 1024)
+        self.oam = Ram(160)
         self.wave_pattern_ram = Ram(16)
 
         self.io_ports = MappedRegisterMemory(register_map)
 
+        # Set of 256-byte pages written since the set was last cleared,
+        # or None when writes aren't being tracked.
+        self.dirty_pages = None
+
     def read_string(self, address, length):
         memory, offset = self._get_memory(address, address + length)
         return memory.read_string(address - offset, length)
@@ -192,6 +226,9 @@ class Memory(object):
     def write_short(self, address, value):
         memory, offset = self._get_memory(address, address + 2)
         memory.write_short(address - offset, value)
+        if self.dirty_pages is not None:
+            self._mark_dirty(address)
+            self._mark_dirty(address + 1)
 
     def read_byte(self, address, signed=False):
         memory, offset = self._get_memory(address, address + 1)
@@ -199,7 +236,23 @@ class Memory(object):
 
     def write_byte(self, address, value):
         memory, offset = self._get_memory(address, address + 1)
-        return memory.write_byte(address - offset, value)
+        memory.write_byte(address - offset, value)
+        if self.dirty_pages is not None:
+            self._mark_dirty(address)
+
+    def track_writes(self):
+        """Start recording which pages are written, in dirty_pages."""
+        if self.dirty_pages is None:
+            self.dirty_pages = set()
+
+    def _mark_dirty(self, address):
+        page = address >> 8
+        self.dirty_pages.add(page)
+        # Working RAM and its mirror are the same bytes.
+        if 0xc0 <= page < 0xde:
+            self.dirty_pages.add(page + 0x20)
+        elif 0xe0 <= page < 0xfe:
+            self.dirty_pages.add(page - 0x20)
 
     def read_bytes(self, start_address, end_address):
         memory, offset = self._get_memory(start_address, end_address)
@@ -230,6 +283,10 @@ class Memory(object):
         if 0xe000 <= start_address < end_address <= 0xfe00:
             return self.wram, 0xe000
 
+        # Sprite Attribute Memory
+        if 0xfe00 <= start_address < end_address <= 0xfea0:
+            return self.oam, 0xfe00
+
         # I/O Ports
         if 0xff00 <= start_address < end_address <= 0xff30:
             return self.io_ports, 0
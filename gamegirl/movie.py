@@ -0,0 +1,236 @@
+"""
+Movies: deterministic input logs with save-state checkpoints.
+
+A movie is a header identifying the ROM, followed by records:
+
+- Inputs store the joypad state held from a frame onwards, written only
+  when it changes.
+- Checkpoints store a zlib-compressed save state taken at the start of
+  a frame, every `checkpoint_interval` frames. The first record is
+  always a checkpoint, so a movie doesn't depend on how the emulator
+  got to where recording started.
+- An end record stores the frame recording stopped at.
+
+Frame numbers are the emulator's own frame count. Input is sampled per
+frame, so it should only change between frames. Seeking loads the
+nearest checkpoint at or before the target and replays the logged input
+headless from there.
+"""
+import hashlib
+import struct
+import zlib
+from bisect import bisect_right
+
+from gamegirl.graphics import Graphics
+
+
+MAGIC = b'GGMV'
+# Version 3 checkpoints hold version 4 save states, with event sequence numbers.
+VERSION = 3
+
+HEADER = struct.Struct('<4sB20sH')
+INPUT = struct.Struct('<IB')
+CHECKPOINT = struct.Struct('<II')
+END = struct.Struct('<I')
+
+RECORD_INPUT = b'I'
+RECORD_CHECKPOINT = b'C'
+RECORD_END = b'E'
+
+
+class MovieError(Exception):
+    pass
+
+
+def rom_digest(rom):
+    return hashlib.sha1(bytes(rom.raw_data)).digest()
+
+
+class MovieRecorder(object):
+    """Records the input and periodic checkpoints of a running emulator."""
+    def __init__(self, cpu, stream, close_stream=False, checkpoint_interval=600, compression=6):
+        self.cpu = cpu
+        self.stream = stream
+        self.close_stream = close_stream
+        self.checkpoint_interval = checkpoint_interval
+        self.compression = compression
+
+        self.start_frame = cpu.graphics.frame_count
+        self.buttons = None
+        self.checkpoint_count = 0
+        self.input_count = 0
+        self.offset = 0
+
+        self._write(HEADER.pack(MAGIC, VERSION, rom_digest(cpu.memory.rom), checkpoint_interval))
+        self._checkpoint()
+
+        # Run before anything else that changes the buttons at the end
+        # of a frame, so the logged state is the one the frame saw.
+        cpu.graphics.frame_callbacks.insert(0, self.frame_ended)
+
+    def frame_ended(self, graphics):
+        frame = graphics.frame_count - 1
+        buttons = self.cpu.memory.p1.pressed
+        if buttons != self.buttons:
+            self.buttons = buttons
+            self._write(RECORD_INPUT + INPUT.pack(frame, buttons))
+            self.input_count += 1
+
+        if (graphics.frame_count - self.start_frame) % self.checkpoint_interval == 0:
+            self._checkpoint()
+
+    def close(self):
+        self.cpu.graphics.remove_frame_callback(self.frame_ended)
+        self._write(RECORD_END + END.pack(self.cpu.graphics.frame_count))
+
+        self.stream.flush()
+        if self.close_stream:
+            self.stream.close()
+
+    @property
+    def stats(self):
+        return {
+            'frames': self.cpu.graphics.frame_count - self.start_frame,
+            'inputs': self.input_count,
+            'checkpoints': self.checkpoint_count,
+            'bytes': self.offset,
+        }
+
+    def _checkpoint(self):
+        data = zlib.compress(self.cpu.save_state(), self.compression)
+        self._write(RECORD_CHECKPOINT + CHECKPOINT.pack(self.cpu.graphics.frame_count, len(data)) +
+                    data)
+        self.checkpoint_count += 1
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.offset += len(data)
+
+
+class MoviePlayer(object):
+    """
+    Plays a movie back on cpu, which must have the same ROM loaded.
+    Use seek() to jump to a frame and play() to feed the logged input
+    while the emulator runs normally.
+    """
+    def __init__(self, cpu, stream):
+        self.cpu = cpu
+        self.stream = stream
+        self.playing = False
+
+        magic, version, digest, checkpoint_interval = HEADER.unpack(self._read(HEADER.size))
+        if magic != MAGIC:
+            raise MovieError('Not a GameGirl movie.')
+        if version != VERSION:
+            raise MovieError('Unsupported movie version: {0}'.format(version))
+        if digest != rom_digest(cpu.memory.rom):
+            raise MovieError('Movie was recorded with a different ROM.')
+        self.checkpoint_interval = checkpoint_interval
+
+        self._scan()
+
+    def buttons_at(self, frame):
+        """Return the buttons held during the given frame."""
+        index = bisect_right(self.input_frames, frame) - 1
+        return self.inputs[index][1] if index >= 0 else 0
+
+    def seek(self, frame):
+        """
+        Bring the emulator to the start of the given frame, replaying
+        headless from the nearest checkpoint (or from the current frame
+        if the movie is playing and that's closer). Only the frame before
+        the target is rendered.
+        """
+        if not self.start_frame <= frame <= self.end_frame:
+            raise IndexError('Frame {0} is outside the movie ({1}-{2})'
+                             .format(frame, self.start_frame, self.end_frame))
+
+        graphics = self.cpu.graphics
+        checkpoint_frame, offset, length = self.checkpoints[
+            bisect_right(self.checkpoint_frames, frame) - 1]
+        if not (self.playing and checkpoint_frame <= graphics.frame_count < frame):
+            self.stream.seek(offset)
+            self.cpu.load_state(zlib.decompress(self._read(length)))
+
+        p1 = self.cpu.memory.p1
+        policy, every, sinks = graphics.render_policy, graphics.render_every, graphics.sinks
+        graphics.sinks = []
+        graphics.set_render_policy(Graphics.RENDER_ON_REQUEST)
+        try:
+            while graphics.frame_count < frame:
+                current = graphics.frame_count
+                p1.set_pressed(self.buttons_at(current))
+                if current == frame - 1:
+                    graphics.request_frame()
+                while graphics.frame_count == current:
+                    self.cpu.read_and_execute()
+        finally:
+            graphics.sinks = sinks
+            graphics.frame_requested = False
+            graphics.set_render_policy(policy, every)
+
+        p1.set_pressed(self.buttons_at(frame))
+
+    def play(self):
+        """Start feeding logged input from the start of the movie."""
+        self.seek(self.start_frame)
+        if not self.playing:
+            self.cpu.graphics.add_frame_callback(self.frame_ended)
+            self.playing = True
+
+    def stop(self):
+        if self.playing:
+            self.cpu.graphics.remove_frame_callback(self.frame_ended)
+            self.playing = False
+
+    @property
+    def finished(self):
+        return self.cpu.graphics.frame_count >= self.end_frame
+
+    def frame_ended(self, graphics):
+        self.cpu.memory.p1.set_pressed(self.buttons_at(graphics.frame_count))
+
+    def _scan(self):
+        """Load the input log and checkpoint offsets; checkpoints are read on demand."""
+        self.inputs = []
+        self.checkpoints = []
+        self.end_frame = None
+
+        self.stream.seek(0, 2)
+        end = self.stream.tell()
+        self.stream.seek(HEADER.size)
+
+        while True:
+            record_type = self.stream.read(1)
+            if record_type == RECORD_INPUT and self.stream.tell() + INPUT.size <= end:
+                self.inputs.append(INPUT.unpack(self.stream.read(INPUT.size)))
+            elif record_type == RECORD_CHECKPOINT and self.stream.tell() + CHECKPOINT.size <= end:
+                frame, length = CHECKPOINT.unpack(self.stream.read(CHECKPOINT.size))
+                offset = self.stream.tell()
+                # Ignore a checkpoint cut off by a recording that was
+                # never closed.
+                if offset + length > end:
+                    break
+                self.checkpoints.append((frame, offset, length))
+                self.stream.seek(length, 1)
+            elif record_type == RECORD_END and self.stream.tell() + END.size <= end:
+                self.end_frame, = END.unpack(self.stream.read(END.size))
+                break
+            else:
+                break
+
+        if not self.checkpoints:
+            raise MovieError('Movie has no checkpoints.')
+
+        self.input_frames = [frame for frame, buttons in self.inputs]
+        self.checkpoint_frames = [frame for frame, offset, length in self.checkpoints]
+        self.start_frame = self.checkpoint_frames[0]
+        if self.end_frame is None:
+            last_input = self.input_frames[-1] + 1 if self.inputs else self.start_frame
+            self.end_frame = max(last_input, self.checkpoint_frames[-1])
+
+    def _read(self, length):
+        data = self.stream.read(length)
+        if len(data) < length:
+            raise MovieError('Unexpected end of movie.')
+        return data
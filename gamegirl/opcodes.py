@@ -1,5 +1,3 @@
-import logging
-
 from functools import partial, wraps
 
 
@@ -357,6 +355,27 @@ def op_return_condition(cpu, condition):
         op_return(cpu=cpu)
 
 
+@instruction('RETI')
+def op_return_interrupt(cpu):
+    cpu.PC = cpu.stack.pop_short()
+    cpu.interrupts.set_master_enable(True)
+
+
+@instruction('EI')
+def enable_interrupts(cpu):
+    cpu.interrupts.enable()
+
+
+@instruction('DI')
+def disable_interrupts(cpu):
+    cpu.interrupts.disable()
+
+
+@instruction('HALT')
+def halt(cpu):
+    cpu.interrupts.halt()
+
+
 @instruction('RL {source}')
 def rotate_left(cpu, get, write, rla=False):
     value = get(cpu=cpu)
@@ -552,6 +571,7 @@ OPCODES = {
     0xdc: partial(call_condition, cycles=12, get=get_immediate_short, condition=is_flag_C_set),
 
     0xc9: partial(op_return, cycles=8),
+    0xd9: partial(op_return_interrupt, cycles=8),
 
     0xc0: partial(op_return_condition, cycles=8, condition=is_flag_Z_reset),
     0xc8: partial(op_return_condition, cycles=8, condition=is_flag_Z_set),
@@ -626,6 +646,10 @@ OPCODES = {
     0x95: partial(sub, cycles=4, get=get_register_L),
     0x96: partial(sub, cycles=8, get=get_indirect_byte_HL),
     0xd6: partial(sub, cycles=8, get=get_immediate_byte),
+
+    0xfb: partial(enable_interrupts, cycles=4),
+    0xf3: partial(disable_interrupts, cycles=4),
+    0x76: partial(halt, cycles=4),
 }
 
 
@@ -0,0 +1,113 @@
+"""
+Real-time pacing.
+
+The Pacer runs at the end of every frame and waits until that frame's
+deadline on a monotonic clock: it sleeps until just before the deadline,
+then spins for the rest, since sleeps routinely overshoot by a
+millisecond or more. Deadlines are counted from a fixed start, so small
+errors don't accumulate.
+"""
+import time
+from collections import deque
+
+
+CLOCK_SPEED = 4194304
+FRAME_CYCLES = 70224
+FRAMES_PER_SECOND = float(CLOCK_SPEED) / FRAME_CYCLES
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))
+    return values[index]
+
+
+class Pacer(object):
+    """
+    Paces emulation to `speed` times real time, or just measures it in
+    turbo mode.
+
+    If emulation falls more than `max_lag` frames behind, the schedule
+    restarts from the current time instead of racing to catch up.
+    """
+    def __init__(self, cpu, speed=1.0, turbo=False, spin=0.002, max_lag=4, history=3600):
+        if speed <= 0:
+            raise ValueError('Speed must be positive, got {0}'.format(speed))
+
+        self.cpu = cpu
+        self.speed = speed
+        self.turbo = turbo
+        self.spin = spin
+        self.max_lag = max_lag
+        self.frame_time = 1.0 / (FRAMES_PER_SECOND * speed)
+
+        self.frames = 0
+        self.late_frames = 0
+        self.resyncs = 0
+        self.intervals = deque(maxlen=history)
+        self.busy_times = deque(maxlen=history)
+
+        self.start = self.last_frame = clock()
+        self.deadline = self.start + self.frame_time
+        cpu.graphics.add_frame_callback(self.frame_ended)
+
+    def close(self):
+        self.cpu.graphics.remove_frame_callback(self.frame_ended)
+
+    def frame_ended(self, graphics):
+        now = clock()
+        self.busy_times.append(now - self.last_frame)
+
+        if not self.turbo:
+            if now > self.deadline:
+                self.late_frames += 1
+                if now - self.deadline > self.max_lag * self.frame_time:
+                    self.deadline = now
+                    self.resyncs += 1
+            else:
+                self._wait(self.deadline)
+                now = clock()
+            self.deadline += self.frame_time
+
+        self.intervals.append(now - self.last_frame)
+        self.last_frame = now
+        self.frames += 1
+
+    def _wait(self, deadline):
+        remaining = deadline - clock()
+        if remaining > self.spin:
+            time.sleep(remaining - self.spin)
+        while clock() < deadline:
+            pass
+
+    @property
+    def stats(self):
+        """
+        Achieved frame rate, frame interval jitter against the target
+        and how much of each frame's time budget emulation used. Times
+        are in milliseconds and cover the most recent frames.
+        """
+        target = self.frame_time
+        jitter = sorted(abs(interval - target) * 1000 for interval in self.intervals)
+        busy = sorted(busy * 1000 for busy in self.busy_times)
+        elapsed = self.last_frame - self.start
+        mean_busy = sum(busy) / len(busy) / 1000 if busy else 0.0
+
+        return {
+            'frames': self.frames,
+            'fps': self.frames / elapsed if elapsed else 0.0,
+            'target_fps': 1.0 / target,
+            'late': self.late_frames,
+            'resyncs': self.resyncs,
+            'jitter_p50': percentile(jitter, 0.50),
+            'jitter_p90': percentile(jitter, 0.90),
+            'jitter_p99': percentile(jitter, 0.99),
+            'jitter_max': jitter[-1] if jitter else 0.0,
+            'busy_p50': percentile(busy, 0.50),
+            'busy_p99': percentile(busy, 0.99),
+            'headroom': target / mean_busy if mean_busy else 0.0,
+        }
@@ -0,0 +1,189 @@
+"""
+Pipelined rendering in a separate process.
+
+While pipelined, Graphics doesn't draw scanlines itself. At each line
+it hands the pipeline that line's LCDC, SCY, SCX, WY and WX, and the
+pipeline copies VRAM and OAM into the current slot of a shared memory
+ring whenever they've changed since the previous line, so mid-frame
+updates render exactly as they would in-process. At VBlank the slot is
+stamped with the frame's palettes and a worker process renders it, so
+emulating frame N+1 overlaps rendering frame N. Finished frames are
+copied back into the framebuffer, with their palettes, a frame or two
+later.
+
+Slot layout:
+
+- Header: the number of VRAM/OAM snapshots, then the BGP, OBP0 and
+  OBP1 shades (four bytes each) the frame is output with.
+- Lines: LCDC, SCY, SCX, WY, WX and the snapshot index for each line.
+- The rendered framebuffer.
+- Up to one VRAM+OAM snapshot per line; most games only write VRAM
+  during VBlank, so usually there's just one.
+"""
+import multiprocessing
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+from gamegirl.graphics import SCREEN_HEIGHT, SCREEN_WIDTH, render_scanline
+
+
+VRAM_SIZE = 0x2000
+OAM_SIZE = 160
+SNAPSHOT_SIZE = VRAM_SIZE + OAM_SIZE
+LINE_FIELDS = 6  # LCDC, SCY, SCX, WY, WX, snapshot index
+PALETTES_SIZE = 12
+FRAMEBUFFER_SIZE = SCREEN_WIDTH * SCREEN_HEIGHT
+
+HEADER_OFFSET = 0
+LINES_OFFSET = HEADER_OFFSET + 1 + PALETTES_SIZE
+FRAMEBUFFER_OFFSET = LINES_OFFSET + SCREEN_HEIGHT * LINE_FIELDS
+SNAPSHOTS_OFFSET = FRAMEBUFFER_OFFSET + FRAMEBUFFER_SIZE
+SLOT_SIZE = SNAPSHOTS_OFFSET + SCREEN_HEIGHT * SNAPSHOT_SIZE
+
+
+def render_frame(framebuffer, lines, snapshots):
+    """
+    Render a full frame from per-line registers and a list of
+    (VRAM, OAM) snapshots the lines refer to.
+    """
+    window_line = 0
+    for line in range(SCREEN_HEIGHT):
+        start = line * LINE_FIELDS
+        lcdc, scy, scx, wy, wx, snapshot = lines[start:start + LINE_FIELDS]
+        vram, oam = snapshots[snapshot]
+        if render_scanline(framebuffer, line, vram, oam, lcdc, scy, scx, wy, wx, window_line):
+            window_line += 1
+
+
+def render_worker(name, connection):
+    """Worker process loop: render each slot index received until None."""
+    memory = shared_memory.SharedMemory(name=name)
+    framebuffer = bytearray(FRAMEBUFFER_SIZE)
+    try:
+        while True:
+            slot = connection.recv()
+            if slot is None:
+                break
+
+            base = slot * SLOT_SIZE
+            buf = memory.buf
+            snapshots = []
+            for index in range(buf[base + HEADER_OFFSET]):
+                start = base + SNAPSHOTS_OFFSET + index * SNAPSHOT_SIZE
+                snapshots.append((bytearray(buf[start:start + VRAM_SIZE]),
+                                  bytearray(buf[start + VRAM_SIZE:start + SNAPSHOT_SIZE])))
+            render_frame(framebuffer,
+                         bytearray(buf[base + LINES_OFFSET:base + FRAMEBUFFER_OFFSET]),
+                         snapshots)
+            buf[base + FRAMEBUFFER_OFFSET:base + SNAPSHOTS_OFFSET] = framebuffer
+            del buf
+            connection.send(slot)
+    finally:
+        memory.close()
+
+
+class PipelinedRenderer(object):
+    """
+    Renders frames in a worker process from snapshots in a shared memory
+    ring. Attach it with Graphics.set_pipeline.
+    """
+    def __init__(self, slots=3):
+        if shared_memory is None:
+            raise RuntimeError('Pipelined rendering requires multiprocessing.shared_memory '
+                               '(Python 3.8+).')
+
+        self.slot_count = slots
+        self.lines = bytearray(SCREEN_HEIGHT * LINE_FIELDS)
+        self.vram = bytearray(VRAM_SIZE)
+        self.oam = bytearray(OAM_SIZE)
+        self.snapshot_count = 0
+        self.memory = shared_memory.SharedMemory(create=True, size=SLOT_SIZE * slots)
+
+        self.connection, worker_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=render_worker, args=(self.memory.name, worker_connection),
+            name='gamegirl-renderer'
+        )
+        self.process.daemon = True
+        self.process.start()
+
+        # Lines are written into next_slot as the frame runs, so it's
+        # never one of the slots in flight.
+        self.next_slot = 0
+        self.in_flight = []
+
+    def record_line(self, line, vram, oam, lcdc, scy, scx, wy, wx):
+        """Record a line's registers, snapshotting VRAM and OAM if they changed."""
+        # Comparing against the last snapshot is a memcmp, far cheaper
+        # than copying 8KB every line.
+        if not self.snapshot_count or vram != self.vram or oam != self.oam:
+            self.vram[:] = vram
+            self.oam[:] = oam
+            start = (self.next_slot * SLOT_SIZE + SNAPSHOTS_OFFSET +
+                     self.snapshot_count * SNAPSHOT_SIZE)
+            buf = self.memory.buf
+            buf[start:start + VRAM_SIZE] = vram
+            buf[start + VRAM_SIZE:start + SNAPSHOT_SIZE] = oam
+            del buf
+            self.snapshot_count += 1
+
+        start = line * LINE_FIELDS
+        self.lines[start:start + LINE_FIELDS] = bytearray(
+            (lcdc, scy, scx, wy, wx, self.snapshot_count - 1))
+
+    def submit_frame(self, palettes, framebuffer):
+        """
+        Queue the recorded frame for rendering, to be output with the
+        given (BGP, OBP0, OBP1) shades, and copy the oldest finished
+        frame into framebuffer. Returns that frame's palettes, or None
+        if no frame was delivered. Only blocks if the worker falls a
+        full ring behind.
+        """
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % self.slot_count
+
+        header = bytearray([self.snapshot_count])
+        for shades in palettes:
+            header += bytearray(shades)
+        base = slot * SLOT_SIZE
+        buf = self.memory.buf
+        buf[base + HEADER_OFFSET:base + LINES_OFFSET] = header
+        buf[base + LINES_OFFSET:base + FRAMEBUFFER_OFFSET] = self.lines
+        del buf
+        self.snapshot_count = 0
+
+        self.connection.send(slot)
+        self.in_flight.append(slot)
+
+        if len(self.in_flight) == self.slot_count or self.connection.poll():
+            return self._collect(framebuffer)
+        return None
+
+    def drain(self, framebuffer):
+        """
+        Copy each frame still in flight into framebuffer as it finishes,
+        yielding its palettes.
+        """
+        while self.in_flight:
+            yield self._collect(framebuffer)
+
+    def close(self):
+        self.connection.send(None)
+        self.process.join()
+        self.memory.close()
+        self.memory.unlink()
+
+    def _collect(self, framebuffer):
+        slot = self.connection.recv()
+        expected = self.in_flight.pop(0)
+        assert slot == expected, 'Frames completed out of order'
+
+        base = slot * SLOT_SIZE
+        buf = self.memory.buf
+        framebuffer[:] = buf[base + FRAMEBUFFER_OFFSET:base + SNAPSHOTS_OFFSET]
+        header = bytearray(buf[base + HEADER_OFFSET + 1:base + LINES_OFFSET])
+        del buf
+        return tuple(tuple(header[index:index + 4]) for index in range(0, PALETTES_SIZE, 4))
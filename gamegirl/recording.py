@@ -0,0 +1,300 @@
+"""
+Compact recordings of raw framebuffers.
+
+A recording is a header followed by one record per frame:
+
+- Keyframes store the whole frame (and the current palettes) compressed
+  with zlib, every `keyframe_interval` frames.
+- Deltas store the frame XORed against the previous frame, compressed
+  with zlib. Unchanged pixels XOR to zero, so small changes compress to
+  a few bytes.
+- Repeats reference an earlier frame since the last keyframe with the
+  same hash.
+
+Palette changes between keyframes get their own record. Closing the
+writer appends an index of keyframe offsets so readers can seek to any
+frame by decoding forward from the nearest keyframe.
+"""
+import hashlib
+import struct
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+
+from gamegirl.graphics import SCREEN_HEIGHT, SCREEN_WIDTH
+from gamegirl.utils import xor_bytes
+
+
+MAGIC = b'GGREC'
+INDEX_MAGIC = b'GGIX'
+VERSION = 1
+
+HEADER = struct.Struct('<5sBHHH')
+KEYFRAME = struct.Struct('<I3sI')
+DELTA = struct.Struct('<I')
+REPEAT = struct.Struct('<I')
+PALETTE = struct.Struct('<3s')
+INDEX = struct.Struct('<II')
+INDEX_ENTRY = struct.Struct('<IQ')
+TRAILER = struct.Struct('<Q4s')
+
+RECORD_KEYFRAME = b'K'
+RECORD_DELTA = b'D'
+RECORD_REPEAT = b'R'
+RECORD_PALETTE = b'P'
+RECORD_INDEX = b'X'
+
+# How many distinct frames since the last keyframe repeats can refer
+# to. Readers keep the same window, so it bounds their memory too.
+REPEAT_WINDOW = 16
+
+
+def encode_palettes(palettes):
+    return bytes(bytearray(
+        sum(shade << (color * 2) for color, shade in enumerate(shades))
+        for shades in palettes
+    ))
+
+
+def decode_palettes(data):
+    return tuple(tuple((value >> (color * 2)) & 0b11 for color in range(4))
+                 for value in bytearray(data))
+
+
+class RecordingError(Exception):
+    pass
+
+
+class RecordingWriter(object):
+    """Frame writer (usable with FrameSink) producing a recording."""
+    def __init__(self, stream, close_stream=False, keyframe_interval=300, compression=6):
+        self.stream = stream
+        self.close_stream = close_stream
+        self.keyframe_interval = keyframe_interval
+        self.compression = compression
+
+        self.offset = 0
+        self.frame_number = 0
+        self.keyframes = []
+        self.previous = None
+        self.palettes = None
+        self.recent = OrderedDict()
+
+        self.keyframe_count = 0
+        self.delta_count = 0
+        self.repeat_count = 0
+
+        self._write(HEADER.pack(MAGIC, VERSION, SCREEN_WIDTH, SCREEN_HEIGHT, keyframe_interval))
+
+    def write_frame(self, frame, tables):
+        frame = bytes(frame)
+        digest = hashlib.sha1(frame).digest()
+
+        if self.frame_number % self.keyframe_interval == 0:
+            self.keyframes.append((self.frame_number, self.offset))
+            self.recent.clear()
+            self.palettes = tables.palettes
+
+            data = zlib.compress(frame, self.compression)
+            self._write(RECORD_KEYFRAME + KEYFRAME.pack(
+                self.frame_number, encode_palettes(self.palettes), len(data)
+            ) + data)
+            self._remember(digest)
+            self.keyframe_count += 1
+        else:
+            if tables.palettes != self.palettes:
+                self.palettes = tables.palettes
+                self._write(RECORD_PALETTE + PALETTE.pack(encode_palettes(self.palettes)))
+
+            if digest in self.recent:
+                self._write(RECORD_REPEAT + REPEAT.pack(self.recent[digest]))
+                self.repeat_count += 1
+            else:
+                data = zlib.compress(xor_bytes(frame, self.previous), self.compression)
+                self._write(RECORD_DELTA + DELTA.pack(len(data)) + data)
+                self._remember(digest)
+                self.delta_count += 1
+
+        self.previous = frame
+        self.frame_number += 1
+
+    def close(self):
+        index_offset = self.offset
+        self._write(RECORD_INDEX + INDEX.pack(self.frame_number, len(self.keyframes)))
+        self._write(b''.join(INDEX_ENTRY.pack(*keyframe) for keyframe in self.keyframes))
+        self._write(TRAILER.pack(index_offset, INDEX_MAGIC))
+
+        self.stream.flush()
+        if self.close_stream:
+            self.stream.close()
+
+    @property
+    def stats(self):
+        raw_size = self.frame_number * SCREEN_WIDTH * SCREEN_HEIGHT
+        return {
+            'frames': self.frame_number,
+            'keyframes': self.keyframe_count,
+            'deltas': self.delta_count,
+            'repeats': self.repeat_count,
+            'bytes': self.offset,
+            'ratio': float(raw_size) / self.offset if self.offset else 0.0,
+        }
+
+    def _remember(self, digest):
+        self.recent[digest] = self.frame_number
+        if len(self.recent) > REPEAT_WINDOW:
+            self.recent.popitem(last=False)
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.offset += len(data)
+
+
+class RecordingReader(object):
+    """
+    Random-access reader for recordings. Frames are returned as raw
+    color numbers along with the palette shades that apply to them.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+        magic, version, width, height, keyframe_interval = HEADER.unpack(
+            self._read(HEADER.size))
+        if magic != MAGIC:
+            raise RecordingError('Not a GameGirl recording.')
+        if version != VERSION:
+            raise RecordingError('Unsupported recording version: {0}'.format(version))
+
+        self.width = width
+        self.height = height
+        self.keyframe_interval = keyframe_interval
+
+        if not self._read_index():
+            self._scan()
+
+        self.next_frame = None
+        self.previous = None
+        self.palettes = None
+        self.recent = OrderedDict()
+
+    def __len__(self):
+        return self.frame_count
+
+    def __iter__(self):
+        for number in range(self.frame_count):
+            yield self.read_frame(number)
+
+    def read_frame(self, number):
+        """Return (frame, palettes) for the given frame number."""
+        if not 0 <= number < self.frame_count:
+            raise IndexError('Frame {0} out of range'.format(number))
+
+        # Decode forward from where we are if that's closer than the
+        # nearest keyframe.
+        keyframe_number, offset = self.keyframes[bisect_right(self.keyframe_frames, number) - 1]
+        if self.next_frame is None or not keyframe_number < self.next_frame <= number:
+            self.stream.seek(offset)
+            self.next_frame = keyframe_number
+
+        while True:
+            frame = self._read_frame()
+            if self.next_frame - 1 == number:
+                return frame, self.palettes
+
+    def _read_frame(self):
+        while True:
+            record_type = self._read(1)
+            if record_type == RECORD_PALETTE:
+                self.palettes = decode_palettes(PALETTE.unpack(self._read(PALETTE.size))[0])
+                continue
+
+            if record_type == RECORD_KEYFRAME:
+                frame_number, palettes, length = KEYFRAME.unpack(self._read(KEYFRAME.size))
+                self.palettes = decode_palettes(palettes)
+                self.recent.clear()
+                frame = zlib.decompress(self._read(length))
+                self._remember(frame)
+            elif record_type == RECORD_DELTA:
+                length, = DELTA.unpack(self._read(DELTA.size))
+                frame = xor_bytes(zlib.decompress(self._read(length)), self.previous)
+                self._remember(frame)
+            elif record_type == RECORD_REPEAT:
+                reference, = REPEAT.unpack(self._read(REPEAT.size))
+                frame = self.recent[reference]
+            else:
+                raise RecordingError('Unexpected record type: {0!r}'.format(record_type))
+
+            self.previous = frame
+            self.next_frame += 1
+            return frame
+
+    def _remember(self, frame):
+        self.recent[self.next_frame] = frame
+        if len(self.recent) > REPEAT_WINDOW:
+            self.recent.popitem(last=False)
+
+    def _read_index(self):
+        self.stream.seek(0, 2)
+        end = self.stream.tell()
+        if end < HEADER.size + TRAILER.size:
+            return False
+
+        self.stream.seek(end - TRAILER.size)
+        index_offset, magic = TRAILER.unpack(self._read(TRAILER.size))
+        if magic != INDEX_MAGIC:
+            return False
+
+        self.stream.seek(index_offset)
+        if self._read(1) != RECORD_INDEX:
+            return False
+
+        self.frame_count, keyframe_count = INDEX.unpack(self._read(INDEX.size))
+        data = self._read(keyframe_count * INDEX_ENTRY.size)
+        self._set_keyframes([INDEX_ENTRY.unpack_from(data, index * INDEX_ENTRY.size)
+                             for index in range(keyframe_count)])
+        return True
+
+    def _scan(self):
+        """Rebuild the keyframe index from a recording that was never closed."""
+        self.stream.seek(0, 2)
+        end = self.stream.tell()
+        self.stream.seek(HEADER.size)
+
+        keyframes = []
+        frame_count = 0
+        while True:
+            offset = self.stream.tell()
+            record_type = self.stream.read(1)
+            if record_type == RECORD_KEYFRAME and offset + 1 + KEYFRAME.size <= end:
+                frame_number, palettes, length = KEYFRAME.unpack(self.stream.read(KEYFRAME.size))
+                self.stream.seek(length, 1)
+            elif record_type == RECORD_DELTA and offset + 1 + DELTA.size <= end:
+                length, = DELTA.unpack(self.stream.read(DELTA.size))
+                self.stream.seek(length, 1)
+            elif record_type == RECORD_REPEAT:
+                self.stream.seek(REPEAT.size, 1)
+            elif record_type == RECORD_PALETTE:
+                self.stream.seek(PALETTE.size, 1)
+                continue
+            else:
+                break
+
+            # Drop a truncated final record rather than misreading it.
+            if self.stream.tell() > end:
+                break
+            if record_type == RECORD_KEYFRAME:
+                keyframes.append((frame_number, offset))
+            frame_count += 1
+
+        self.frame_count = frame_count
+        self._set_keyframes(keyframes)
+
+    def _set_keyframes(self, keyframes):
+        self.keyframes = keyframes
+        self.keyframe_frames = [frame_number for frame_number, offset in keyframes]
+
+    def _read(self, length):
+        data = self.stream.read(length)
+        if len(data) < length:
+            raise RecordingError('Unexpected end of recording.')
+        return data
@@ -1,9 +1,91 @@
-from memory import MappedRegister, register_attribute
+from gamegirl.interrupts import JOYPAD
+from gamegirl.memory import MappedRegister, register_attribute
+
+
+class PaletteRegister(MappedRegister):
+    """
+    Base class for palette registers. Writes decode the register into a
+    4-entry tuple mapping color numbers to shades, so renderers never
+    have to unpack the register per pixel.
+    """
+    shades = (0, 0, 0, 0)
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        self.shades = tuple((value >> (color * 2)) & 0b11 for color in range(4))
+
+
+class InterruptRegister(MappedRegister):
+    """
+    Base class for IE and IF. Writes refresh the interrupt controller's
+    cached pending value.
+    """
+    interrupts = None
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        if self.interrupts is not None:
+            self.interrupts.update()
+
+
+class SoundRegister(MappedRegister):
+    """
+    Base class for sound registers. Writes are logged to the APU, if
+    one is attached, with the cycle they happened on.
+    """
+    apu = None
+
+    def write(self, value):
+        super(SoundRegister, self).write(value)
+        if self.apu is not None:
+            self.apu.register_written(self, value)
 
 
 class P1(MappedRegister):
-    """Joypad Info"""
+    """
+    Joypad Info. Games write bit 4 or 5 low to select the direction
+    keys or the action buttons, then read the selected buttons back in
+    the low nibble, active low. `pressed` is the held-button mask from
+    gamegirl.joypad; input should change it through set_pressed so the
+    joypad interrupt is requested.
+    """
     name = 'p1'
+    write_mask = 0b00110000
+    pressed = 0
+    interrupts = None
+
+    def set_pressed(self, pressed):
+        """
+        Hold the given buttons, requesting the joypad interrupt when a
+        newly pressed button pulls a selected line low.
+        """
+        lines = self.value
+        self.pressed = pressed
+        if lines & ~self.value & 0x0f and self.interrupts is not None:
+            self.interrupts.request(JOYPAD)
+
+    @property
+    def value(self):
+        value = self._value | 0b11001111
+        if not self._value & 0b00010000:
+            value &= ~(self.pressed & 0x0f)
+        if not self._value & 0b00100000:
+            value &= ~(self.pressed >> 4)
+        return value
+
+    @value.setter
+    def value(self, value):
+        self._value = value & 0b00110000
 
 
 class SB(MappedRegister):
@@ -14,6 +96,12 @@ class SB(MappedRegister):
 class SC(MappedRegister):
     """Serial I/O Control"""
     name = 'sc'
+    serial = None
+
+    def write(self, value):
+        super(SC, self).write(value)
+        if self.serial is not None and value & 0b10000001 == 0b10000001:
+            self.serial.start_transfer()
 
 
 class DIV(MappedRegister):
@@ -36,17 +124,17 @@ class TAC(MappedRegister):
     name = 'tac'
 
 
-class IF(MappedRegister):
+class IF(InterruptRegister):
     """Interrupt Flag"""
     name = 'if'
 
 
-class NR10(MappedRegister):
+class NR10(SoundRegister):
     """Sound Mode 1"""
     name = 'nr10'
 
 
-class NR11(MappedRegister):
+class NR11(SoundRegister):
     """Sound Mode 1 Length/Wave Duty"""
     name = 'nr11'
     reset_value = 0xbf
@@ -57,100 +145,100 @@ class NR11(MappedRegister):
 
     @property
     def sound_length(self):
-        return (64 - self.t1) * (1 / 256)  # Seconds
+        return (64 - self.t1) / 256.0  # Seconds
 
 
-class NR12(MappedRegister):
+class NR12(SoundRegister):
     """Sound Mode 1 Envelope"""
     name = 'nr12'
 
 
-class NR13(MappedRegister):
+class NR13(SoundRegister):
     """Sound Mode 1 Frequency Lo"""
     name = 'nr13'
 
 
-class NR14(MappedRegister):
+class NR14(SoundRegister):
     """Sound Mode 1 Frequency Hi"""
     name = 'nr14'
 
 
-class NR21(MappedRegister):
+class NR21(SoundRegister):
     """Sound Mode 2 Length/Wave Duty"""
     name = 'nr21'
 
 
-class NR22(MappedRegister):
+class NR22(SoundRegister):
     """Sound Mode 2 Envelope"""
     name = 'nr22'
 
 
-class NR23(MappedRegister):
+class NR23(SoundRegister):
     """Sound Mode 2 Frequency Lo"""
     name = 'nr23'
 
 
-class NR24(MappedRegister):
+class NR24(SoundRegister):
     """Sound Mode 2 Frequency Hi"""
     name = 'nr24'
 
 
-class NR30(MappedRegister):
+class NR30(SoundRegister):
     """Sound Mode 3 On/Off"""
     name = 'nr30'
 
 
-class NR31(MappedRegister):
+class NR31(SoundRegister):
     """Sound Mode 3 Length"""
     name = 'nr31'
 
 
-class NR32(MappedRegister):
+class NR32(SoundRegister):
     """Sound Mode 3 Output Level"""
     name = 'nr32'
 
 
-class NR33(MappedRegister):
+class NR33(SoundRegister):
     """Sound Mode 3 Frequency Lo"""
     name = 'nr33'
 
 
-class NR34(MappedRegister):
+class NR34(SoundRegister):
     """Sound Mode 3 Frequency Hi"""
     name = 'nr34'
 
 
-class NR41(MappedRegister):
+class NR41(SoundRegister):
     """Sound Mode 4 Length"""
     name = 'nr41'
 
 
-class NR42(MappedRegister):
+class NR42(SoundRegister):
     """Sound Mode 4 Envelope"""
     name = 'nr42'
 
 
-class NR43(MappedRegister):
+class NR43(SoundRegister):
     """Sound Mode 4 Polynomial Counter"""
     name = 'nr43'
 
 
-class NR44(MappedRegister):
+class NR44(SoundRegister):
     """Sound Mode 4 Frequency Counter/Consecutive; Initial"""
     name = 'nr44'
 
 
-class NR50(MappedRegister):
+class NR50(SoundRegister):
     """Channel Control / On-Off / Volume"""
     name = 'nr50'
 
 
-class NR51(MappedRegister):
+class NR51(SoundRegister):
     """Sound Output Terminal Selection"""
     name = 'nr51'
 
 
-class NR52(MappedRegister):
+class NR52(SoundRegister):
     """Sound On/Off"""
     name = 'nr52'
     reset_value = 0xf1
@@ -181,8 +269,22 @@ class LCDC(MappedRegister):
 class STAT(MappedRegister):
     """LCDC Status"""
     name = 'stat'
+    graphics = None
+
+    mode = register_attribute(0b11)
+
+    @property
+    def value(self):
+        if self.graphics is None:
+            return self._value
+        return ((self._value & 0b11111000) | (self.graphics.coincidence << 2) |
+                self.graphics.mode)
 
-    mode = register_attribute(0b10)
+    @value.setter
+    def value(self, value):
+        self._value = value
+        if self.graphics is not None:
+            self.graphics.update_stat_event()
 
 
 class SCY(MappedRegister):
@@ -198,11 +300,33 @@ class SCX(MappedRegister):
 class LY(MappedRegister):
     """LCDC Y-Coordinate"""
     name = 'ly'
+    graphics = None
+
+    @property
+    def value(self):
+        if self.graphics is None:
+            return self._value
+        return self.graphics.ly
+
+    @value.setter
+    def value(self, value):
+        self._value = value
 
 
 class LYC(MappedRegister):
     """LY Compare"""
     name = 'lyc'
+    graphics = None
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        if self.graphics is not None:
+            self.graphics.update_stat_event()
 
 
 class DMA(MappedRegister):
@@ -210,17 +334,17 @@ class DMA(MappedRegister):
     name = 'dma'
 
 
-class BGP(MappedRegister):
+class BGP(PaletteRegister):
     """BG & Window Palette Data"""
     name = 'bgp'
 
 
-class OBP0(MappedRegister):
+class OBP0(PaletteRegister):
     """Object Palette 0 Data"""
     name = 'obp0'
 
 
-class OBP1(MappedRegister):
+class OBP1(PaletteRegister):
     """Object Palette 1 Data"""
     name = 'obp1'
 
@@ -235,7 +359,7 @@ class WX(MappedRegister):
     name = 'wx'
 
 
-class IE(MappedRegister):
+class IE(InterruptRegister):
     """Interrupt Enable"""
     name = 'ie'
 
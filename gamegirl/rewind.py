@@ -0,0 +1,135 @@
+"""
+Rewind history kept in a fixed-size ring of compressed save states.
+
+Every `interval` frames the current state is captured at VBlank. Every
+`keyframe_interval` captures a full state is stored as a keyframe; the
+captures in between are stored as an XOR against that keyframe, which
+leaves mostly zeroes for zlib to squash. When the ring grows past
+`max_bytes`, the oldest keyframe and its deltas are dropped together.
+"""
+import zlib
+from collections import deque
+
+from gamegirl.utils import xor_bytes
+
+
+FRAMES_PER_SECOND = 4194304.0 / 70224
+
+
+class Rewinder(object):
+    def __init__(self, cpu, interval=1, keyframe_interval=60, max_bytes=32 * 1024 * 1024,
+                 compression=1):
+        self.cpu = cpu
+        self.interval = interval
+        self.keyframe_interval = keyframe_interval
+        self.max_bytes = max_bytes
+        self.compression = compression
+
+        # Entries are (frame, is_keyframe, compressed data), oldest first.
+        self.entries = deque()
+        self.bytes_used = 0
+        self.keyframe = None
+        self.deltas_since_keyframe = 0
+
+        cpu.graphics.add_frame_callback(self.frame_ended)
+
+    def close(self):
+        self.cpu.graphics.remove_frame_callback(self.frame_ended)
+
+    def frame_ended(self, graphics):
+        if graphics.frame_count % self.interval == 0:
+            self.capture()
+
+    def capture(self):
+        state = self.cpu.save_state()
+        frame = self.cpu.graphics.frame_count
+
+        if (self.keyframe is None or self.deltas_since_keyframe >= self.keyframe_interval - 1 or
+                len(state) != len(self.keyframe)):
+            entry = (frame, True, zlib.compress(state, self.compression))
+            self.keyframe = state
+            self.deltas_since_keyframe = 0
+        else:
+            entry = (frame, False, zlib.compress(xor_bytes(state, self.keyframe), self.compression))
+            self.deltas_since_keyframe += 1
+
+        self.entries.append(entry)
+        self.bytes_used += len(entry[2])
+        self._enforce_limit()
+
+    def rewind(self, frames=1):
+        """
+        Step back the given number of frames. Restores the newest
+        captured state at or before the target frame and replays
+        forward from it. Returns the frame number reached, which is the
+        oldest captured frame if the history doesn't go back that far.
+        """
+        if not self.entries:
+            raise ValueError('No rewind history has been captured.')
+
+        graphics = self.cpu.graphics
+        target = max(graphics.frame_count - frames, self.entries[0][0])
+
+        # Drop history newer than the restore point; replaying captures
+        # it again.
+        while self.entries[-1][0] > target:
+            self._pop(self.entries.pop)
+
+        keyframe_index = max(index for index, entry in enumerate(self.entries) if entry[1])
+        self.keyframe = zlib.decompress(self.entries[keyframe_index][2])
+        self.deltas_since_keyframe = len(self.entries) - 1 - keyframe_index
+
+        frame, is_keyframe, data = self.entries[-1]
+        if is_keyframe:
+            self.cpu.load_state(self.keyframe)
+        else:
+            self.cpu.load_state(xor_bytes(zlib.decompress(data), self.keyframe))
+
+        self._replay(target)
+        return target
+
+    @property
+    def stats(self):
+        """Memory use of the history, including per second of emulated time."""
+        seconds = 0.0
+        if self.entries:
+            seconds = (self.entries[-1][0] - self.entries[0][0] + self.interval) / FRAMES_PER_SECOND
+        return {
+            'entries': len(self.entries),
+            'bytes': self.bytes_used,
+            'seconds': seconds,
+            'bytes_per_second': self.bytes_used / seconds if seconds else 0.0,
+        }
+
+    def _replay(self, target):
+        """Run headless up to the target frame, rendering only the last one."""
+        graphics = self.cpu.graphics
+        if graphics.frame_count >= target:
+            return
+
+        policy, every, sinks = graphics.render_policy, graphics.render_every, graphics.sinks
+        graphics.sinks = []
+        graphics.set_render_policy(graphics.RENDER_ON_REQUEST)
+        try:
+            while graphics.frame_count < target:
+                if graphics.frame_count == target - 1:
+                    graphics.request_frame()
+                self.cpu.read_and_execute()
+        finally:
+            graphics.sinks = sinks
+            graphics.frame_requested = False
+            graphics.set_render_policy(policy, every)
+
+    def _enforce_limit(self):
+        while self.bytes_used > self.max_bytes and self.entries:
+            self._pop(self.entries.popleft)
+            # Deltas are useless without their keyframe.
+            while self.entries and not self.entries[0][1]:
+                self._pop(self.entries.popleft)
+
+        if not self.entries:
+            self.keyframe = None
+
+    def _pop(self, pop):
+        frame, is_keyframe, data = pop()
+        self.bytes_used -= len(data)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+Index the headers of a directory of ROMs and verify their checksums.
+
+Usage:
+  gamegirl-romindex DIRECTORY [options]
+
+Options:
+  --help        Show this screen.
+  --index PATH  Index file to read and update. Defaults to romindex.json
+                in the gamegirl cache directory.
+  --rescan      Read every ROM again, ignoring the index.
+  --bad         Only list ROMs that fail a checksum or can't be read.
+
+The index is a JSON object with a format version and an entry per ROM,
+keyed by absolute path. Each entry holds the file's mtime and size,
+which decide whether it needs reading again, and the header fields:
+title, game code, maker code, cartridge type, ROM and RAM size codes,
+both checksums and whether they passed. ROMs whose headers can't be
+parsed, or files that can't be read at all, get an `error` instead.
+Unreadable files have no mtime or size and are tried again every scan.
+"""
+import json
+import os
+
+from docopt import docopt
+
+from gamegirl.memory import Rom
+
+
+INDEX_VERSION = 1
+ROM_EXTENSIONS = ('.gb', '.gbc', '.sgb')
+HEADER_END = 0x150
+
+
+def index_path():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'gamegirl', 'romindex.json')
+
+
+def header_text(value):
+    return value.rstrip(b'\0').decode('latin-1')
+
+
+def read_entry(path):
+    """Read a ROM and return its index entry, minus mtime and size."""
+    with open(path, 'rb') as f:
+        rom_data = f.read()
+    if len(rom_data) < HEADER_END:
+        return {'error': 'too short'}
+    try:
+        rom = Rom(rom_data)
+    except KeyError as error:
+        return {'error': 'ROM size ${0:02x}'.format(error.args[0])}
+
+    return {
+        'title': header_text(rom.title),
+        'game_code': header_text(rom.game_code),
+        'maker_code': header_text(rom.maker_code),
+        'cartridge_type': rom.cartridge_type,
+        'rom_size_code': rom.read_byte(0x148),
+        'ram_size_code': rom.ram_size_code,
+        'gbc_compatible': rom.gbc_compatible,
+        'header_checksum': rom.read_byte(0x14d),
+        'passed_complement_check': rom.passed_complement_check,
+        'checksum': rom.checksum,
+        'passed_global_checksum': rom.passed_global_checksum,
+    }
+
+
+class RomIndex(object):
+    """
+    Header metadata for ROMs, persisted to a JSON file. Entries are
+    reused as long as the file's mtime and size haven't changed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('version') == INDEX_VERSION:
+            self.entries = data['roms']
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'roms': self.entries}, f, indent=1,
+                      sort_keys=True)
+        os.rename(temp_path, self.path)
+
+    def scan(self, directory, rescan=False):
+        """
+        Update the index for the ROMs under directory, dropping entries
+        for files that are gone. Returns (paths read, paths found).
+        """
+        directory = os.path.abspath(directory)
+        prefix = os.path.join(directory, '')
+        read = []
+        found = set()
+        for root, dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                if not filename.lower().endswith(ROM_EXTENSIONS):
+                    continue
+                path = os.path.join(root, filename)
+                found.add(path)
+
+                try:
+                    stat = os.stat(path)
+                    entry = self.entries.get(path)
+                    if (not rescan and entry and entry['mtime'] == stat.st_mtime and
+                            entry['size'] == stat.st_size):
+                        continue
+                    entry = read_entry(path)
+                    entry['mtime'] = stat.st_mtime
+                    entry['size'] = stat.st_size
+                except (IOError, OSError) as error:
+                    # Broken symlinks and files we may not read.
+                    entry = {'error': error.strerror or str(error), 'mtime': None, 'size': None}
+                self.entries[path] = entry
+                read.append(path)
+
+        for path in list(self.entries):
+            if path.startswith(prefix) and path not in found:
+                del self.entries[path]
+        return read, sorted(found)
+
+
+def is_bad(entry):
+    return ('error' in entry or not entry['passed_complement_check'] or
+            not entry['passed_global_checksum'])
+
+
+def format_entry(path, entry):
+    if 'error' in entry:
+        return '{0:<16} {1:<4} {2:<3}  {3:<12}  {4}'.format('', '', '', entry['error'], path)
+    status = []
+    if not entry['passed_complement_check']:
+        status.append('header')
+    if not entry['passed_global_checksum']:
+        status.append('global')
+    return '{0:<16} {1:<4} ${2:02x}  {3:<12}  {4}'.format(
+        entry['title'], entry['game_code'], entry['cartridge_type'],
+        'bad ' + '+'.join(status) if status else 'ok', path)
+
+
+def main():
+    args = docopt(__doc__)
+    index = RomIndex(args['--index'] or index_path())
+    read, found = index.scan(args['DIRECTORY'], rescan=args['--rescan'])
+    index.save()
+
+    bad = 0
+    for path in found:
+        entry = index.entries[path]
+        if is_bad(entry):
+            bad += 1
+        elif args['--bad']:
+            continue
+        print(format_entry(path, entry))
+    print('{0} ROMs, {1} read, {2} bad.'.format(len(found), len(read), bad))
+
+
+if __name__ == '__main__':
+    main()
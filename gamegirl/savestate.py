@@ -0,0 +1,148 @@
+"""
+Compact binary save states.
+
+A state is a fixed-size header of CPU, memory (including the held
+joypad buttons), interrupt and graphics state, followed by the raw
+contents of every RAM buffer, the I/O register values, the framebuffer
+and the scheduler's pending events with their sequence numbers, so
+events due on the same cycle fire in the same order after a load.
+Nothing is pickled, so saving is a handful of struct packs and
+bytearray copies.
+"""
+import struct
+
+from gamegirl.graphics import SCREEN_HEIGHT, SCREEN_WIDTH
+
+
+MAGIC = b'GGST'
+VERSION = 4
+
+HEADER = struct.Struct('<4sB')
+CPU_STATE = struct.Struct('<8B2HQQ')
+MEMORY_STATE = struct.Struct('<2B')
+INTERRUPT_STATE = struct.Struct('<3B')
+GRAPHICS_STATE = struct.Struct('<qBQQQ2B')
+EVENT_COUNT = struct.Struct('<BQ')
+EVENT = struct.Struct('<BqQ')
+
+BYTE_REGISTERS = ('A', 'B', 'C', 'D', 'E', 'F', 'H', 'L')
+RAM_BUFFERS = ('wram', 'lcd_ram', 'oam', 'stack', 'wave_pattern_ram')
+FRAMEBUFFER_SIZE = SCREEN_WIDTH * SCREEN_HEIGHT
+
+
+class SaveStateError(Exception):
+    pass
+
+
+def _io_registers(memory):
+    return [memory.io_ports.registers[address] for address in sorted(memory.io_ports.registers)]
+
+
+def save_state(cpu):
+    """Return a snapshot of the emulator as a bytes blob."""
+    memory = cpu.memory
+    graphics = cpu.graphics
+    interrupts = cpu.interrupts
+
+    parts = [
+        HEADER.pack(MAGIC, VERSION),
+        CPU_STATE.pack(cpu.A, cpu.B, cpu.C, cpu.D, cpu.E, cpu.F, cpu.H, cpu.L,
+                       cpu.PC, cpu.SP, cpu.cycles, cpu.instruction_count),
+        MEMORY_STATE.pack(memory.bios_enabled, memory.p1.pressed),
+        INTERRUPT_STATE.pack(interrupts.ime, interrupts.ei_delay, interrupts.halted),
+        GRAPHICS_STATE.pack(graphics.frame_start, graphics.window_line, graphics.frame_count,
+                            graphics.frames_rendered, graphics.frames_skipped,
+                            graphics.frame_requested, graphics.rendering),
+    ]
+    for name in RAM_BUFFERS:
+        parts.append(bytes(getattr(memory, name).raw_data))
+    parts.append(bytes(bytearray(register.value for register in _io_registers(memory))))
+    parts.append(bytes(graphics.framebuffer))
+
+    events = sorted(cpu.scheduler.pending.items())
+    parts.append(EVENT_COUNT.pack(len(events), cpu.scheduler.sequence))
+    for name, (cycle, sequence) in events:
+        name = name.encode('ascii')
+        parts.append(EVENT.pack(len(name), cycle, sequence) + name)
+
+    return b''.join(parts)
+
+
+def load_state(cpu, data):
+    """Restore a snapshot produced by save_state onto cpu."""
+    memory = cpu.memory
+    graphics = cpu.graphics
+    registers = _io_registers(memory)
+    rams = [getattr(memory, name).raw_data for name in RAM_BUFFERS]
+    view = memoryview(data)
+
+    if len(data) < HEADER.size:
+        raise SaveStateError('Save state is truncated.')
+    magic, version = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise SaveStateError('Not a GameGirl save state.')
+    if version != VERSION:
+        raise SaveStateError('Unsupported save state version: {0}'.format(version))
+
+    # Validate the variable-length tail before touching any state.
+    offset = (HEADER.size + CPU_STATE.size + MEMORY_STATE.size + INTERRUPT_STATE.size +
+              GRAPHICS_STATE.size + sum(len(ram) for ram in rams) + len(registers) +
+              FRAMEBUFFER_SIZE)
+    if len(data) < offset + EVENT_COUNT.size:
+        raise SaveStateError('Save state is truncated.')
+
+    event_count, sequence = EVENT_COUNT.unpack_from(data, offset)
+    offset += EVENT_COUNT.size
+    events = []
+    for index in range(event_count):
+        if len(data) < offset + EVENT.size:
+            raise SaveStateError('Save state is truncated.')
+        length, cycle, event_sequence = EVENT.unpack_from(data, offset)
+        offset += EVENT.size
+        name = view[offset:offset + length].tobytes().decode('ascii')
+        offset += length
+        if name not in cpu.scheduler.handlers:
+            raise SaveStateError('Unknown scheduler event: {0}'.format(name))
+        events.append((name, cycle, event_sequence))
+
+    if offset != len(data):
+        raise SaveStateError('Save state has {0} unexpected trailing bytes.'
+                             .format(len(data) - offset))
+
+    offset = HEADER.size
+    values = CPU_STATE.unpack_from(data, offset)
+    offset += CPU_STATE.size
+    for register, value in zip(BYTE_REGISTERS, values):
+        setattr(cpu, register, value)
+    cpu.PC, cpu.SP, cpu.cycles, cpu.instruction_count = values[8:]
+
+    bios_enabled, memory.p1.pressed = MEMORY_STATE.unpack_from(data, offset)
+    memory.bios_enabled = bool(bios_enabled)
+    offset += MEMORY_STATE.size
+
+    interrupts = cpu.interrupts
+    ime, interrupts.ei_delay, halted = INTERRUPT_STATE.unpack_from(data, offset)
+    interrupts.ime = bool(ime)
+    interrupts.halted = bool(halted)
+    offset += INTERRUPT_STATE.size
+
+    (graphics.frame_start, graphics.window_line, graphics.frame_count, graphics.frames_rendered,
+     graphics.frames_skipped, frame_requested, rendering) = GRAPHICS_STATE.unpack_from(data, offset)
+    graphics.frame_requested = bool(frame_requested)
+    graphics.rendering = bool(rendering)
+    offset += GRAPHICS_STATE.size
+
+    for ram in rams:
+        ram[:] = view[offset:offset + len(ram)]
+        offset += len(ram)
+
+    for register, value in zip(registers, bytearray(view[offset:offset + len(registers)])):
+        register.value = value
+    offset += len(registers)
+
+    graphics.framebuffer[:] = view[offset:offset + FRAMEBUFFER_SIZE]
+
+    cpu.scheduler.clear()
+    for name, cycle, event_sequence in events:
+        cpu.scheduler.restore(name, cycle, event_sequence)
+    cpu.scheduler.sequence = sequence
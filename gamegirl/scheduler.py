@@ -0,0 +1,67 @@
+import heapq
+
+
+NEVER = float('inf')
+
+
+class Scheduler(object):
+    """
+    Runs named events at absolute CPU cycle counts.
+
+    Components register a handler per event name once, then schedule
+    that name whenever they know when it should next fire; scheduling a
+    name again replaces its pending time. The CPU compares its cycle
+    count against `next_cycle` after each instruction, so nothing runs
+    between events.
+    """
+    def __init__(self):
+        self.handlers = {}
+        self.pending = {}
+        self.queue = []
+        self.sequence = 0
+        self.next_cycle = NEVER
+
+    def register(self, name, handler):
+        """Register handler(cycle) to run when the named event fires."""
+        self.handlers[name] = handler
+
+    def schedule(self, name, cycle):
+        self.sequence += 1
+        self.pending[name] = (cycle, self.sequence)
+        heapq.heappush(self.queue, (cycle, self.sequence, name))
+        if cycle < self.next_cycle:
+            self.next_cycle = cycle
+
+    def restore(self, name, cycle, sequence):
+        """
+        Queue an event with the sequence number it had when saved, so
+        events due on the same cycle keep firing in their saved order.
+        """
+        self.sequence = max(self.sequence, sequence)
+        self.pending[name] = (cycle, sequence)
+        heapq.heappush(self.queue, (cycle, sequence, name))
+        if cycle < self.next_cycle:
+            self.next_cycle = cycle
+
+    def cancel(self, name):
+        # Cancelled entries stay queued and are skipped when they come up.
+        self.pending.pop(name, None)
+
+    def clear(self):
+        """Drop every pending event, keeping registered handlers."""
+        self.pending.clear()
+        del self.queue[:]
+        self.next_cycle = NEVER
+
+    def run(self, now):
+        """Fire every event due at or before now, in cycle order."""
+        queue = self.queue
+        while queue and queue[0][0] <= now:
+            cycle, sequence, name = heapq.heappop(queue)
+            if self.pending.get(name) != (cycle, sequence):
+                continue
+
+            del self.pending[name]
+            self.handlers[name](cycle)
+
+        self.next_cycle = queue[0][0] if queue else NEVER
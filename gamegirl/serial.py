@@ -0,0 +1,65 @@
+"""
+Serial port.
+
+Nothing is ever plugged into the link port, so a transfer clocked by the
+GameBoy itself shifts out SB and shifts in 0xFF from the empty line.
+Transfers waiting on an external clock never finish, like on hardware.
+Test ROMs print their results this way, so outgoing bytes can be
+captured, mirrored to a stream and matched against stop patterns. With
+stop patterns set, only as much output as the longest one is kept.
+"""
+from gamegirl import interrupts
+
+
+SC_START = 0b10000000
+SC_INTERNAL_CLOCK = 0b00000001
+
+# 8 bits at 8192Hz.
+TRANSFER_CYCLES = 4096
+
+
+class Serial(object):
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.sb = cpu.memory.sb
+        self.sc = cpu.memory.sc
+
+        self.instant = False
+        self.capture = False
+        self.output = bytearray()
+        self.stream = None
+        self.stop_patterns = []
+        self.matched = None
+        self.transfer_count = 0
+
+        self.sc.serial = self
+        cpu.scheduler.register('serial', self.transfer_event)
+
+    def start_transfer(self):
+        if self.instant:
+            self.complete_transfer()
+        else:
+            self.cpu.scheduler.schedule('serial', self.cpu.cycles + TRANSFER_CYCLES)
+
+    def transfer_event(self, cycle):
+        self.complete_transfer()
+
+    def complete_transfer(self):
+        byte = self.sb.value
+        self.sb.value = 0xff
+        self.sc.value &= ~SC_START & 0xff
+        self.cpu.interrupts.request(interrupts.SERIAL)
+        self.transfer_count += 1
+
+        if self.stream is not None:
+            self.stream.write(bytes(bytearray((byte,))))
+            self.stream.flush()
+
+        if self.capture:
+            self.output.append(byte)
+            if self.stop_patterns:
+                del self.output[:-max(len(pattern) for pattern in self.stop_patterns)]
+            for pattern in self.stop_patterns:
+                if self.output.endswith(pattern):
+                    self.matched = pattern
+                    break
@@ -0,0 +1,203 @@
+import os
+import struct
+import sys
+import threading
+import zlib
+
+try:
+    from queue import Empty, Queue
+except ImportError:
+    from Queue import Empty, Queue
+
+from gamegirl.graphics import SCREEN_HEIGHT, SCREEN_WIDTH
+from gamegirl.recording import RecordingWriter
+
+
+# Cycles per second and per frame, for frame rate headers.
+CLOCK_SPEED = 4194304
+FRAME_CYCLES = 70224
+
+
+class FrameSink(object):
+    """
+    Hands rendered frames to a writer running on a background thread.
+
+    Frames are copied into a fixed pool of reusable buffers at VBlank,
+    so the emulation thread only pays for one 23KB copy per frame. If
+    every buffer is still waiting on the writer, the sink either blocks
+    until one frees up or drops the frame, depending on `block`.
+    """
+    def __init__(self, writer, buffers=8, block=True):
+        self.writer = writer
+        self.block = block
+
+        self.frames_queued = 0
+        self.frames_dropped = 0
+        self.frames_written = 0
+        self.error = None
+
+        self.free_buffers = Queue()
+        for index in range(buffers):
+            self.free_buffers.put(bytearray(SCREEN_WIDTH * SCREEN_HEIGHT))
+        self.pending = Queue()
+
+        self.thread = threading.Thread(target=self._write_frames, name='gamegirl-frame-sink')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def push_frame(self, graphics):
+        try:
+            buffer = self.free_buffers.get(block=self.block)
+        except Empty:
+            self.frames_dropped += 1
+            return
+
+        buffer[:] = graphics.framebuffer
+        self.pending.put((buffer, graphics.palette_tables))
+        self.frames_queued += 1
+
+    def close(self):
+        """
+        Wait for queued frames to be written and close the writer, then
+        raise the error that stopped the writer thread, if any.
+        """
+        self.pending.put(None)
+        self.thread.join()
+        self.writer.close()
+        if self.error is not None:
+            raise self.error
+
+    @property
+    def stats(self):
+        return {
+            'queued': self.frames_queued,
+            'dropped': self.frames_dropped,
+            'written': self.frames_written,
+            'pending': self.pending.qsize(),
+        }
+
+    def _write_frames(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+
+            buffer, tables = item
+            if self.error is None:
+                try:
+                    self.writer.write_frame(buffer, tables)
+                    self.frames_written += 1
+                except Exception as error:
+                    # Keep draining so the emulator never deadlocks on a
+                    # broken pipe or full disk.
+                    self.error = error
+            self.free_buffers.put(buffer)
+
+
+class StreamWriter(object):
+    """Base class for writers that output to a file-like stream."""
+    def __init__(self, stream, close_stream=False):
+        self.stream = stream
+        self.close_stream = close_stream
+
+    def close(self):
+        self.stream.flush()
+        if self.close_stream:
+            self.stream.close()
+
+
+class RawRGBWriter(StreamWriter):
+    """Writes frames as a headerless stream of packed 24-bit RGB."""
+    def write_frame(self, frame, tables):
+        self.stream.write(tables.expand(frame, 3))
+
+
+class Y4MWriter(StreamWriter):
+    """Writes frames as a YUV4MPEG2 stream with full-resolution chroma."""
+    def __init__(self, stream, close_stream=False):
+        super(Y4MWriter, self).__init__(stream, close_stream)
+        self._tables = None
+        self._planes = None
+
+        self.stream.write('YUV4MPEG2 W{0} H{1} F{2}:{3} Ip A1:1 C444\n'.format(
+            SCREEN_WIDTH, SCREEN_HEIGHT, CLOCK_SPEED, FRAME_CYCLES
+        ).encode('ascii'))
+
+    def write_frame(self, frame, tables):
+        if tables is not self._tables:
+            self._planes = self._plane_tables(tables)
+            self._tables = tables
+
+        self.stream.write(b'FRAME\n')
+        for plane in self._planes:
+            self.stream.write(frame.translate(plane))
+
+    def _plane_tables(self, tables):
+        """Build Y, Cb and Cr translation tables (BT.601, studio range)."""
+        red, green, blue = [bytearray(channel) for channel in tables.channels[:3]]
+        planes = ([], [], [])
+        for r, g, b in zip(red, green, blue):
+            planes[0].append(16 + int(round((65.481 * r + 128.553 * g + 24.966 * b) / 255)))
+            planes[1].append(128 + int(round((-37.797 * r - 74.203 * g + 112.0 * b) / 255)))
+            planes[2].append(128 + int(round((112.0 * r - 93.786 * g - 18.214 * b) / 255)))
+        return [bytes(bytearray(plane)) for plane in planes]
+
+
+class PNGWriter(object):
+    """Writes each frame to a numbered PNG file in a directory."""
+    SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+    def __init__(self, directory, filename='frame{0:06d}.png', compression=6):
+        self.directory = directory
+        self.filename = filename
+        self.compression = compression
+        self.frame_number = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def write_frame(self, frame, tables):
+        rgb = tables.expand(frame, 3)
+        stride = SCREEN_WIDTH * 3
+        scanlines = b''.join(b'\x00' + rgb[start:start + stride]
+                             for start in range(0, len(rgb), stride))
+
+        path = os.path.join(self.directory, self.filename.format(self.frame_number))
+        with open(path, 'wb') as f:
+            f.write(self.SIGNATURE)
+            f.write(self._chunk(b'IHDR', struct.pack('>IIBBBBB', SCREEN_WIDTH, SCREEN_HEIGHT,
+                                                     8, 2, 0, 0, 0)))
+            f.write(self._chunk(b'IDAT', zlib.compress(scanlines, self.compression)))
+            f.write(self._chunk(b'IEND', b''))
+        self.frame_number += 1
+
+    def close(self):
+        pass
+
+    def _chunk(self, chunk_type, data):
+        checksum = zlib.crc32(chunk_type + data) & 0xffffffff
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', checksum)
+
+
+WRITERS = {
+    'raw': RawRGBWriter,
+    'y4m': Y4MWriter,
+    'png': PNGWriter,
+    'ggr': RecordingWriter,
+}
+
+
+def open_writer(path, format):
+    """
+    Create a writer for the given format. Streaming formats write to
+    path ('-' for stdout); PNG treats path as the output directory.
+    """
+    if format not in WRITERS:
+        raise ValueError('Unknown recording format: {0}'.format(format))
+
+    if format == 'png':
+        return PNGWriter(path)
+    elif path == '-':
+        return WRITERS[format](getattr(sys.stdout, 'buffer', sys.stdout))
+    else:
+        return WRITERS[format](open(path, 'wb'), close_stream=True)
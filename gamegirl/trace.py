@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+Decode execution traces recorded with `gamegirl --trace`.
+
+Usage:
+  gamegirl-trace show TRACE [options]
+  gamegirl-trace diff TRACE OTHER [options]
+
+Options:
+  --help           Show this screen.
+  --from ADDRESS   Only include instructions at or above this PC (hex).
+  --to ADDRESS     Only include instructions at or below this PC (hex).
+  --limit N        Stop after N matching instructions.
+  --context N      Instructions to show before the first difference.
+                   [default: 5]
+
+A trace is a header followed by one fixed-size record per executed
+instruction, holding the CPU state just before it ran:
+
+- Header: magic `GGTR`, version byte, record size (little-endian short).
+- Record: PC (short), opcode, A, F, B, C, D, E, H, L (bytes), SP (short)
+  and the cycle count (long long), all little-endian.
+
+Records are packed into a preallocated buffer and written out a chunk
+at a time, so tracing costs one struct.pack_into per instruction.
+"""
+import struct
+import sys
+from collections import deque
+
+from docopt import docopt
+
+
+MAGIC = b'GGTR'
+VERSION = 1
+
+HEADER = struct.Struct('<4sBH')
+RECORD = struct.Struct('<HBBBBBBBBBHQ')
+FIELDS = ('pc', 'opcode', 'a', 'f', 'b', 'c', 'd', 'e', 'h', 'l', 'sp', 'cycles')
+
+
+class TraceError(Exception):
+    pass
+
+
+class Tracer(object):
+    """Records every instruction cpu executes to stream."""
+    def __init__(self, cpu, stream, close_stream=False, chunk_records=65536):
+        self.cpu = cpu
+        self.stream = stream
+        self.close_stream = close_stream
+        self.buffer = bytearray(RECORD.size * chunk_records)
+        self.offset = 0
+        self.count = 0
+
+        stream.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        cpu.tracer = self
+
+    def record(self, cpu, opcode):
+        """Called by the CPU after reading an opcode, before running it."""
+        RECORD.pack_into(self.buffer, self.offset, (cpu.PC - 1) & 0xffff, opcode,
+                         cpu.A, cpu.F, cpu.B, cpu.C, cpu.D, cpu.E, cpu.H, cpu.L,
+                         cpu.SP, cpu.cycles)
+        self.offset += RECORD.size
+        if self.offset == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        self.count += self.offset // RECORD.size
+        self.stream.write(memoryview(self.buffer)[:self.offset])
+        self.offset = 0
+
+    def close(self):
+        if self.cpu.tracer is self:
+            self.cpu.tracer = None
+        self.flush()
+        self.stream.flush()
+        if self.close_stream:
+            self.stream.close()
+
+
+def read_trace(stream, chunk_records=65536):
+    """Yield the records of a trace as tuples in FIELDS order."""
+    magic, version, record_size = HEADER.unpack(stream.read(HEADER.size))
+    if magic != MAGIC:
+        raise TraceError('Not a GameGirl trace.')
+    if version != VERSION or record_size != RECORD.size:
+        raise TraceError('Unsupported trace version: {0}'.format(version))
+
+    while True:
+        chunk = stream.read(RECORD.size * chunk_records)
+        # Drop a partial record left by a trace that was never closed.
+        for offset in range(0, len(chunk) - RECORD.size + 1, RECORD.size):
+            yield RECORD.unpack_from(chunk, offset)
+        if len(chunk) < RECORD.size * chunk_records:
+            return
+
+
+def filter_records(records, start=0, end=0xffff, limit=None):
+    """Yield (index, record) for records with start <= PC <= end."""
+    count = 0
+    for index, record in enumerate(records):
+        if start <= record[0] <= end:
+            if limit is not None and count >= limit:
+                return
+            count += 1
+            yield index, record
+
+
+def format_record(index, record):
+    pc, opcode, a, f, b, c, d, e, h, l, sp, cycles = record
+    return ('{0:>10} {1:>12}  ${2:04x}  ${3:02x}  A=${4:02x} F=${5:02x} B=${6:02x} C=${7:02x} '
+            'D=${8:02x} E=${9:02x} H=${10:02x} L=${11:02x} SP=${12:04x}'
+            .format(index, cycles, pc, opcode, a, f, b, c, d, e, h, l, sp))
+
+
+def diff_traces(records, other_records, context=5):
+    """
+    Compare two traces instruction by instruction. Returns None if they
+    match, or (history, (index, record), (other_index, other_record))
+    for the first difference, where history holds up to `context`
+    matching (index, record) pairs before it. A trace that ends early
+    differs with a record of None.
+    """
+    history = deque(maxlen=context)
+    other_records = iter(other_records)
+    for index, record in records:
+        other = next(other_records, None)
+        if other is None:
+            return list(history), (index, record), (None, None)
+        if record != other[1]:
+            return list(history), (index, record), other
+        history.append((index, record))
+
+    other = next(other_records, None)
+    if other is not None:
+        return list(history), (None, None), other
+    return None
+
+
+def main():
+    args = docopt(__doc__)
+    start = int(args['--from'].lstrip('$'), 16) if args['--from'] else 0
+    end = int(args['--to'].lstrip('$'), 16) if args['--to'] else 0xffff
+    limit = int(args['--limit']) if args['--limit'] else None
+
+    with open(args['TRACE'], 'rb') as stream:
+        records = filter_records(read_trace(stream), start, end, limit)
+        if args['show']:
+            for index, record in records:
+                print(format_record(index, record))
+            return
+
+        with open(args['OTHER'], 'rb') as other_stream:
+            other_records = filter_records(read_trace(other_stream), start, end, limit)
+            difference = diff_traces(records, other_records, int(args['--context']))
+
+    if difference is None:
+        print('Traces match.')
+        return
+
+    history, (index, record), (other_index, other) = difference
+    for history_index, history_record in history:
+        print('  ' + format_record(history_index, history_record))
+    print('- ' + (format_record(index, record) if record else '(end of trace)'))
+    print('+ ' + (format_record(other_index, other) if other else '(end of trace)'))
+    if record and other:
+        fields = [name for name, value, other_value in zip(FIELDS, record, other)
+                  if value != other_value]
+        print('Differs in: {0}'.format(', '.join(fields)))
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
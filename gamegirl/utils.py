@@ -1,2 +1,28 @@
+from binascii import hexlify, unhexlify
+
+
 def get_bit(byte, bit):
     return (byte & (2 ** bit)) >> bit
+
+
+def xor_bytes(a, b):
+    """XOR two equal-length byte strings in one big-integer operation."""
+    value = int(hexlify(a), 16) ^ int(hexlify(b), 16)
+    return unhexlify('{0:0{1}x}'.format(value, len(a) * 2))
+
+
+_numpy = []
+
+
+def import_numpy():
+    """
+    Return the numpy module, or None if it isn't installed. It's optional
+    and slow to import, so only import it once something needs it.
+    """
+    if not _numpy:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy.append(numpy)
+    return _numpy[0]
@@ -32,7 +32,10 @@ setup(
     include_package_data=True,
     entry_points={
       'console_scripts':[
-          'gamegirl = gamegirl.cmd:main'
+          'gamegirl = gamegirl.cmd:main',
+          'gamegirl-trace = gamegirl.trace:main',
+          'gamegirl-difftest = gamegirl.difftest:main',
+          'gamegirl-romindex = gamegirl.romindex:main',
       ]
    }
 )
@@ -0,0 +1,21 @@
+import pytest
+
+from gamegirl.cpu import CPU
+from gamegirl.memory import Memory, Ram, Rom
+
+
+@pytest.fixture
+def cpu_running():
+    """
+    Factory for a CPU running a test program from the BIOS area, with
+    an empty cartridge. handlers maps addresses (interrupt vectors,
+    usually) to code placed there.
+    """
+    def make(program, handlers=None):
+        bios = bytearray(0x100)
+        bios[:len(program)] = program
+        for address, code in (handlers or {}).items():
+            bios[address:address + len(code)] = code
+        memory = Memory(rom=Rom(bytes(bytearray(0x8000))), bios=Ram(bytes(bios)))
+        return CPU(memory=memory)
+    return make
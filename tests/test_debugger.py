@@ -0,0 +1,57 @@
+import logging
+
+import urwid
+
+from gamegirl import difftest
+from gamegirl.cpu import CPU
+from gamegirl.debugger import DebuggerLogHandler, MemoryView, log_record
+
+
+def test_log_records_keep_only_template_fields():
+    rom_data, registers = difftest.synthetic_program(0, 500)
+    cpu = difftest.build_cpu(CPU, rom_data, registers=registers)
+    cpu.debug = True
+    for index in range(500):
+        pc = cpu.PC
+        template, kwargs, debug_bytes = cpu.read_and_execute()
+        record = log_record(pc, template, kwargs, debug_bytes)
+        assert set(record[2]) <= set(['bit', 'condition', 'destination', 'source'])
+        assert template.format(**record[2]) == template.format(**kwargs)
+
+
+def test_memory_view_reads_every_region(cpu_running):
+    view = MemoryView(cpu_running(b'\x18\xfe').memory)
+    for address in (0x0000, 0x8000, 0xfe00, 0xfea0, 0xff00, 0xff80):
+        values = view._read(address)
+        assert len(values) == 16
+        widget, position = view._row(address >> 4)
+        assert position == address >> 4
+    # $ff03 has no register behind it.
+    assert view._read(0xff00)[3] is None
+    assert None not in view._read(0xff80)
+
+
+class FakeDebugger(object):
+    def __init__(self):
+        self.log_walker = urwid.SimpleListWalker([])
+
+
+def test_log_handler_only_drains_explicitly():
+    debugger = FakeDebugger()
+    handler = DebuggerLogHandler(debugger=debugger)
+    logger = logging.getLogger('gamegirl.tests.debugger')
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    try:
+        for index in range(3):
+            logger.info('repeated')
+        logger.warning('other')
+        # logging.shutdown() flushes every handler.
+        handler.flush()
+        assert len(debugger.log_walker) == 0
+
+        handler.drain()
+        assert [row.contents[1][0].text for row in debugger.log_walker] == [
+            'repeated (x3)', 'other']
+    finally:
+        logger.removeHandler(handler)
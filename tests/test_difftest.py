@@ -0,0 +1,50 @@
+from gamegirl import difftest
+from gamegirl.cpu import CPU
+
+
+def run(seed, length, exclude=difftest.REFERENCE_FAULTS):
+    rom_data, registers = difftest.synthetic_program(seed, length, exclude)
+    reference = difftest.build_cpu(CPU, rom_data, registers=registers)
+    candidate = difftest.build_cpu(CPU, rom_data, registers=registers)
+    return difftest.run_lockstep(reference, candidate, length)
+
+
+def test_synthetic_programs_run_to_the_end():
+    for seed in range(20):
+        executed, divergence, error = run(seed, 500)
+        assert (seed, executed, divergence, error) == (seed, 500, None, None)
+
+
+def test_long_synthetic_programs_run_to_the_end():
+    for seed in range(10):
+        executed, divergence, error = run(seed, 5000)
+        assert (seed, executed, divergence, error) == (seed, 5000, None, None)
+
+
+def test_cb_opcodes_can_be_excluded():
+    cb_opcodes = [0xcb00 | opcode for opcode in difftest.SYNTHETIC_CB_OPCODES]
+    rom_data, registers = difftest.synthetic_program(
+        0, 500, exclude=list(difftest.REFERENCE_FAULTS) + cb_opcodes)
+    cpu = difftest.build_cpu(CPU, rom_data, registers=registers)
+    for index in range(500):
+        assert bytearray(rom_data)[cpu.PC] != 0xcb
+        cpu.read_and_execute()
+
+
+def test_shared_error_is_reported():
+    # Seeds that stop on a reference fault once they're allowed back in.
+    results = [run(seed, 500, exclude=()) for seed in range(20)]
+    stopped = [(executed, error) for executed, divergence, error in results if error]
+    assert stopped
+    assert all(executed < 500 for executed, error in stopped)
+
+
+def test_divergence_is_found():
+    rom_data, registers = difftest.synthetic_program(0, 200)
+    reference = difftest.build_cpu(CPU, rom_data, registers=registers)
+    candidate = difftest.build_cpu(CPU, rom_data, registers=registers)
+    candidate.cycles += 4
+
+    executed, divergence, error = difftest.run_lockstep(reference, candidate, 200)
+    assert divergence.fields == ['cycles']
+    assert error is None
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+from gamegirl import joypad
+from gamegirl.explore import explore
+
+
+# Selects the action buttons and copies P1 into WRAM forever, so each
+# branch's RAM depends on its input.
+PROGRAM = bytearray([
+    0x3e, 0x10, 0xe0, 0x00,  # LD A,$10; LDH ($00),A
+    0xf0, 0x00,              # loop: LDH A,($00)
+    0xea, 0x00, 0xc0,        # LD ($c000),A
+    0x18, 0xf9,              # JR loop
+])
+
+SCRIPTS = [
+    [0],
+    [joypad.A],
+    [0, joypad.B, joypad.B],
+    [joypad.START, 0, joypad.A],
+]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_fork_matches_pool(cpu_running):
+    cpu = cpu_running(PROGRAM)
+    fork_results = explore(cpu, SCRIPTS, 3, processes=2, method='fork')
+    pool_results = explore(cpu, SCRIPTS, 3, processes=2, method='pool')
+
+    assert fork_results == pool_results
+    assert [result['frame'] for result in fork_results] == [3] * len(SCRIPTS)
+    assert len(set(result['ram'] for result in fork_results)) > 1
@@ -0,0 +1,72 @@
+import socket
+import threading
+import time
+
+from gamegirl.gdbstub import GDBServer, checksum
+
+
+# INC B; loop: INC A; JR loop. $0010 holds an invalid opcode.
+PROGRAM = b'\x04\x3c\x18\xfd'
+BAD_OPCODE = b'\xd3'
+
+
+class Client(object):
+    def __init__(self, path):
+        for attempt in range(200):
+            try:
+                self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.connection.connect(path)
+                break
+            except (IOError, OSError):
+                self.connection.close()
+                time.sleep(0.01)
+        else:
+            raise AssertionError('Server never started listening.')
+        self.connection.settimeout(10)
+        self.buffer = b''
+
+    def request(self, data):
+        data = data.encode('latin-1')
+        self.connection.sendall(b'$' + data + '#{0:02x}'.format(checksum(data)).encode('ascii'))
+        while True:
+            start = self.buffer.find(b'$')
+            end = self.buffer.find(b'#', start)
+            if start >= 0 and end >= 0 and len(self.buffer) >= end + 3:
+                reply = self.buffer[start + 1:end]
+                self.buffer = self.buffer[end + 3:]
+                return reply.decode('latin-1')
+            self.buffer += self.connection.recv(4096)
+
+
+def test_session(cpu_running, tmp_path, capsys):
+    cpu = cpu_running(PROGRAM, handlers={0x10: BAD_OPCODE})
+    path = str(tmp_path / 'gdb.sock')
+    server = GDBServer(cpu, path)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+
+    client = Client(path)
+    try:
+        assert client.request('g') == '000000000000000000000000'
+        assert client.request('m0,4') == '043c18fd'
+        # $ff03 has no register, so this stops at the gap.
+        assert len(client.request('mff00,4')) == 6
+        assert client.request('Mc000,2:abcd') == 'OK'
+        assert client.request('mc000,2') == 'abcd'
+
+        assert client.request('Z0,1,1') == 'OK'
+        assert client.request('c') == 'S05'
+        assert cpu.PC == 1
+        assert client.request('c') == 'S05'
+        assert (cpu.PC, cpu.A) == (1, 1)
+        assert client.request('s') == 'S05'
+        assert (cpu.PC, cpu.A) == (2, 2)
+
+        assert client.request('s10') == 'S04'
+        assert 'Unknown opcode: $d3' in capsys.readouterr().err
+
+        assert client.request('D') == 'OK'
+    finally:
+        client.connection.close()
+        thread.join(10)
+    assert not thread.is_alive()
@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only needed by --debug, sinks and the APU; plain runs shouldn't load them.
+OPTIONAL = ('urwid', 'numpy', 'logging')
+
+
+def test_cmd_skips_optional_modules():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    output = subprocess.check_output(
+        [sys.executable, '-c', 'import sys, gamegirl.cmd; print(" ".join(sys.modules))'],
+        env=env, universal_newlines=True)
+    imported = set(output.split())
+    assert [name for name in OPTIONAL if name in imported] == []
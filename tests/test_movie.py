@@ -0,0 +1,86 @@
+from io import BytesIO
+
+from gamegirl import joypad
+from gamegirl.movie import MoviePlayer, MovieRecorder
+
+
+# Selects the action buttons, enables the joypad interrupt and copies P1
+# into WRAM forever; the interrupt handler counts interrupts at $c001.
+PROGRAM = bytearray([
+    0x31, 0xf0, 0xdf,        # LD SP,$dff0
+    0x3e, 0x10, 0xe0, 0x00,  # LD A,$10; LDH ($00),A
+    0x3e, 0x10, 0xe0, 0xff,  # LD A,$10; LDH ($ff),A
+    0xfb,                    # EI
+    0xf0, 0x00,              # loop: LDH A,($00)
+    0xea, 0x00, 0xc0,        # LD ($c000),A
+    0x18, 0xf9,              # JR loop
+])
+HANDLER = bytearray([
+    0x21, 0x01, 0xc0,        # LD HL,$c001
+    0x34,                    # INC (HL)
+    0xd9,                    # RETI
+])
+
+FRAMES = 12
+
+
+REGISTERS = ('A', 'F', 'B', 'C', 'D', 'E', 'H', 'L', 'SP', 'PC', 'cycles')
+
+
+def interrupt_flags(cpu):
+    return cpu.memory.io_ports.named_registers['if'].value
+
+
+def run_to(cpu, frame):
+    while cpu.graphics.frame_count < frame:
+        cpu.read_and_execute()
+
+
+def make_cpu(cpu_running):
+    return cpu_running(PROGRAM, {0x60: HANDLER})
+
+
+def record(cpu):
+    """Record a movie pressing A on and off on cpu; returns the movie."""
+    source = joypad.CallableSource(lambda frame: joypad.A if frame % 4 in (1, 2) else 0)
+    pad = joypad.Joypad(cpu, source)
+    stream = BytesIO()
+    recorder = MovieRecorder(cpu, stream, checkpoint_interval=5)
+    run_to(cpu, FRAMES)
+    recorder.close()
+    pad.close()
+    return stream.getvalue()
+
+
+def assert_same_state(expected, actual):
+    assert ([getattr(actual, name) for name in REGISTERS] ==
+            [getattr(expected, name) for name in REGISTERS])
+    assert actual.memory.wram.raw_data == expected.memory.wram.raw_data
+    assert actual.memory.stack.raw_data == expected.memory.stack.raw_data
+    assert interrupt_flags(actual) == interrupt_flags(expected)
+    assert actual.memory.p1.pressed == expected.memory.p1.pressed
+
+
+def test_recording_requests_joypad_interrupts(cpu_running):
+    recorded = make_cpu(cpu_running)
+    record(recorded)
+    assert recorded.memory.read_byte(0xc001) == 3
+
+
+def test_seek_matches_recording(cpu_running):
+    recorded = make_cpu(cpu_running)
+    movie = record(recorded)
+    cpu = make_cpu(cpu_running)
+    MoviePlayer(cpu, BytesIO(movie)).seek(FRAMES)
+    assert_same_state(recorded, cpu)
+
+
+def test_play_matches_recording(cpu_running):
+    recorded = make_cpu(cpu_running)
+    movie = record(recorded)
+    cpu = make_cpu(cpu_running)
+    player = MoviePlayer(cpu, BytesIO(movie))
+    player.play()
+    run_to(cpu, FRAMES)
+    player.stop()
+    assert_same_state(recorded, cpu)
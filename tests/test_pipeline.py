@@ -0,0 +1,47 @@
+import pytest
+
+from gamegirl import pipeline
+
+
+# Turns the LCD on, then keeps rewriting tile 0 (which fills the
+# background) and bumping BGP, so VRAM changes every line or two and
+# the palettes every frame.
+PROGRAM = bytearray([
+    0x3e, 0x91, 0xe0, 0x40,  # LD A,$91; LDH ($40),A
+    0x21, 0x00, 0x80,        # loop: LD HL,$8000
+    0x7e, 0x3c, 0x22,        # inner: LD A,(HL); INC A; LD (HL+),A
+    0x7d, 0xfe, 0x10,        # LD A,L; CP $10
+    0x20, 0xf8,              # JR NZ,inner
+    0xf0, 0x47, 0x3c, 0xe0, 0x47,  # LDH A,($47); INC A; LDH ($47),A
+    0x18, 0xed,              # JR loop
+])
+
+
+class FrameCollector(object):
+    def __init__(self):
+        self.frames = []
+
+    def push_frame(self, graphics):
+        self.frames.append((bytes(graphics.framebuffer), graphics.palette_tables.shades))
+
+
+def run_frames(cpu, renderer, frames):
+    collector = FrameCollector()
+    cpu.graphics.add_sink(collector)
+    if renderer:
+        cpu.graphics.set_pipeline(renderer)
+    while cpu.graphics.frame_count < frames:
+        cpu.read_and_execute()
+    if renderer:
+        cpu.graphics.set_pipeline(None)
+        renderer.close()
+    return collector.frames
+
+
+@pytest.mark.skipif(pipeline.shared_memory is None, reason='needs multiprocessing.shared_memory')
+def test_pipelined_frames_match_in_process(cpu_running):
+    expected = run_frames(cpu_running(PROGRAM), None, 6)
+    actual = run_frames(cpu_running(PROGRAM), pipeline.PipelinedRenderer(), 6)
+    first = expected[0][0]
+    assert len(set(first[line * 160:(line + 1) * 160] for line in range(144))) > 1
+    assert actual == expected
@@ -0,0 +1,85 @@
+import random
+from io import BytesIO
+
+import pytest
+
+from gamegirl.graphics import SCREEN_HEIGHT, SCREEN_WIDTH, Graphics, PaletteTables
+from gamegirl.recording import RecordingError, RecordingReader, RecordingWriter
+
+
+FRAME_SIZE = SCREEN_WIDTH * SCREEN_HEIGHT
+DEFAULT_PALETTES = ((0, 1, 2, 3), (0, 1, 2, 3), (0, 1, 2, 3))
+DARK_PALETTES = ((3, 2, 1, 0), (0, 1, 2, 3), (1, 1, 2, 3))
+
+
+def make_frames(count, seed=0):
+    """
+    Return (frame, palettes) pairs mixing changed frames, exact repeats
+    of recent frames and palette changes.
+    """
+    rng = random.Random(seed)
+    frame = bytearray(rng.randrange(4) for index in range(FRAME_SIZE))
+    frames = []
+    for number in range(count):
+        if frames and number % 5 == 3:
+            frame = bytearray(frames[rng.randrange(max(0, len(frames) - 4), len(frames))][0])
+        else:
+            for index in range(rng.randrange(1, 200)):
+                frame[rng.randrange(FRAME_SIZE)] = rng.randrange(4)
+        palettes = DARK_PALETTES if number % 7 in (4, 5) else DEFAULT_PALETTES
+        frames.append((bytes(frame), palettes))
+    return frames
+
+
+def write(frames, close=True, keyframe_interval=10):
+    stream = BytesIO()
+    writer = RecordingWriter(stream, keyframe_interval=keyframe_interval)
+    tables = dict((palettes, PaletteTables(palettes, Graphics.COLORS))
+                  for palettes in (DEFAULT_PALETTES, DARK_PALETTES))
+    for frame, palettes in frames:
+        writer.write_frame(frame, tables[palettes])
+    if close:
+        writer.close()
+    return writer, stream.getvalue()
+
+
+def test_round_trip_with_seeking():
+    frames = make_frames(45)
+    writer, data = write(frames)
+    assert writer.stats['repeats'] > 0
+    assert writer.stats['keyframes'] == 5
+
+    reader = RecordingReader(BytesIO(data))
+    assert len(reader) == len(frames)
+    assert list(reader) == frames
+
+    order = list(range(len(frames)))
+    random.Random(1).shuffle(order)
+    for number in order + [44, 0, 12, 11, 10, 9, 30, 31]:
+        assert reader.read_frame(number) == frames[number]
+
+    with pytest.raises(IndexError):
+        reader.read_frame(len(frames))
+
+
+def test_unclosed_recording_is_scanned():
+    frames = make_frames(25)
+    writer, data = write(frames, close=False)
+    reader = RecordingReader(BytesIO(data))
+    assert len(reader) == len(frames)
+    assert reader.read_frame(17) == frames[17]
+
+
+def test_truncated_recording_drops_partial_frame():
+    frames = make_frames(25)
+    # Frame 24 changes pixels, so it's a delta rather than a repeat.
+    writer, data = write(frames, close=False)
+    reader = RecordingReader(BytesIO(data[:-5]))
+    assert len(reader) == len(frames) - 1
+    assert list(reader) == frames[:-1]
+
+
+def test_truncated_header():
+    writer, data = write(make_frames(2))
+    with pytest.raises(RecordingError):
+        RecordingReader(BytesIO(data[:4]))
@@ -0,0 +1,96 @@
+import os
+import struct
+
+from gamegirl.memory import Rom
+from gamegirl.romindex import RomIndex
+
+
+def make_rom(title=b'TEST', size_code=0x00, fill=0x5a, checksum=None):
+    """A 32KB ROM with a valid header and, unless given, global checksum."""
+    data = bytearray([fill]) * 0x8000
+    data[0x134:0x143] = bytearray(title.ljust(15, b'\0'))
+    data[0x143:0x14d] = bytearray(10)
+    data[0x148] = size_code
+    data[0x14d] = -(sum(data[0x134:0x14d]) + 0x19) & 0xff
+    data[0x14e:0x150] = bytearray(2)
+    if checksum is None:
+        checksum = sum(data) & 0xffff
+    data[0x14e:0x150] = bytearray(struct.pack('>H', checksum))
+    return bytes(data)
+
+
+def test_global_checksum():
+    rom = Rom(make_rom())
+    assert rom.passed_complement_check
+    # The sum has distinct bytes, so reading it little-endian would fail.
+    assert rom.checksum >> 8 != rom.checksum & 0xff
+    assert rom.global_checksum() == rom.checksum
+    assert rom.passed_global_checksum
+
+
+def test_global_checksum_mismatch():
+    data = bytearray(make_rom())
+    data[0x4000] ^= 0xff
+    rom = Rom(bytes(data))
+    assert rom.passed_complement_check
+    assert not rom.passed_global_checksum
+
+
+def test_large_rom_size_codes():
+    for code, name in ((0x08, '64 MBit'), (0x52, '9 MBit'), (0x53, '10 MBit'),
+                       (0x54, '12 MBit')):
+        assert Rom(make_rom(size_code=code)).rom_size[1] == name
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_scan_reuses_unchanged_entries(tmp_path):
+    good = str(tmp_path / 'good.gb')
+    bad = str(tmp_path / 'bad.gb')
+    write(good, make_rom(b'GOOD'))
+    write(bad, make_rom(b'BAD', checksum=0x1234))
+    index_path = str(tmp_path / 'index.json')
+
+    index = RomIndex(index_path)
+    read, found = index.scan(str(tmp_path))
+    assert sorted(read) == found == sorted([good, bad])
+    assert index.entries[good]['passed_global_checksum']
+    assert not index.entries[bad]['passed_global_checksum']
+    index.save()
+
+    index = RomIndex(index_path)
+    assert index.scan(str(tmp_path)) == ([], sorted([good, bad]))
+
+    # A new mtime or size means reading the file again.
+    stat = os.stat(good)
+    os.utime(good, (stat.st_atime, stat.st_mtime + 10))
+    write(bad, make_rom(b'BAD') + bytes(bytearray(0x8000)))
+    read, found = index.scan(str(tmp_path))
+    assert sorted(read) == sorted([good, bad])
+    assert index.entries[bad]['size'] == 0x10000
+
+    assert sorted(index.scan(str(tmp_path), rescan=True)[0]) == sorted(read)
+
+    os.unlink(bad)
+    assert index.scan(str(tmp_path)) == ([], [good])
+    assert bad not in index.entries
+
+
+def test_scan_records_unreadable_files(tmp_path):
+    good = str(tmp_path / 'good.gb')
+    broken = str(tmp_path / 'broken.gb')
+    write(good, make_rom())
+    os.symlink(str(tmp_path / 'missing.gb'), broken)
+
+    index = RomIndex(str(tmp_path / 'index.json'))
+    read, found = index.scan(str(tmp_path))
+    assert found == sorted([broken, good])
+    assert index.entries[broken] == {
+        'error': 'No such file or directory', 'mtime': None, 'size': None}
+    assert 'error' not in index.entries[good]
+
+    # Unreadable files are tried again.
+    assert index.scan(str(tmp_path))[0] == [broken]
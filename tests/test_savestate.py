@@ -0,0 +1,20 @@
+from gamegirl.savestate import load_state, save_state
+
+
+def test_same_cycle_events_keep_order(cpu_running):
+    fired = []
+    cpus = [cpu_running(b'\x18\xfe'), cpu_running(b'\x18\xfe')]
+    for cpu in cpus:
+        for name in ('later', 'earlier'):
+            cpu.scheduler.register(name, lambda cycle, name=name: fired.append(name))
+
+    # Scheduled against alphabetical order, which is how events are saved.
+    cpus[0].scheduler.schedule('later', cpus[0].cycles + 1000000)
+    cpus[0].scheduler.schedule('earlier', cpus[0].cycles + 1000000)
+    state = save_state(cpus[0])
+    load_state(cpus[1], state)
+    assert save_state(cpus[1]) == state
+
+    for cpu in cpus:
+        cpu.scheduler.run(cpu.cycles + 1000000)
+    assert fired == ['later', 'earlier'] * 2
@@ -0,0 +1,17 @@
+def send(serial, text):
+    for byte in bytearray(text):
+        serial.sb.value = byte
+        serial.complete_transfer()
+        if serial.matched:
+            break
+
+
+def test_stop_pattern_output_is_capped(cpu_running):
+    serial = cpu_running(b'\x18\xfe').serial
+    serial.capture = True
+    serial.stop_patterns = [b'Passed', b'Failed 1']
+    send(serial, b'x' * 10000 + b'Pass')
+    assert len(serial.output) == len(b'Failed 1')
+    assert serial.matched is None
+    send(serial, b'ed\n')
+    assert serial.matched == b'Passed'
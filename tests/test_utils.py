@@ -0,0 +1,10 @@
+from gamegirl.utils import xor_bytes
+
+
+def test_xor_bytes():
+    assert xor_bytes(b'\x0f\xf0\xaa', b'\xff\x0f\xaa') == b'\xf0\xff\x00'
+
+
+def test_xor_bytes_keeps_leading_zeros():
+    assert xor_bytes(b'\x00\x00\x01', b'\x00\x00\x00') == b'\x00\x00\x01'
+    assert xor_bytes(b'\x12\x34', b'\x12\x34') == b'\x00\x00'